@@ -17,6 +17,7 @@ setup(
         'bluesky-darkframes',
         'distributed',
         'suitcase-csv',
+        'h5py',
         'streamz',
         'stdio-proxy',
         'matplotlib',
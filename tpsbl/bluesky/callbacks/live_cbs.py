@@ -1,50 +1,562 @@
 from bluesky.callbacks.core import LiveTable
 from bluesky.callbacks.best_effort import BestEffortCallback
-from bluesky.callbacks.fitting import LiveFit
+from bluesky.callbacks.fitting import LiveFit, PeakStats
+from bluesky.callbacks.core import CallbackBase, make_class_safe
+from bluesky.callbacks.mpl_plotting import QtAwareCallback
 from lmfit.models import GaussianModel
+from ophyd import Kind
 from types import MethodType
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
 import pandas as pd
+import numpy as np
+import threading
+import warnings
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _unique_mean(x, y):
+    '''
+        :return: (x, y) sorted by x, y averaged over repeated x, y as 2D
+    '''
+    x, inverse = np.unique(np.asarray(x, dtype=float), return_inverse=True)
+    y = np.asarray(y, dtype=float).reshape(len(inverse), -1)
+    total = np.zeros((len(x), y.shape[1]))
+    np.add.at(total, inverse.ravel(), y)
+    return x, total/np.bincount(inverse.ravel(), minlength=len(x))[:,None]
 
 class LiveEdgeFit(LiveFit):
+    '''
+        Fit the model to the derivative dy/dx of an edge scan.
+
+        (x, y) are accumulated in growable numpy buffers, the derivative is
+        computed with np.gradient on the points sorted by x (repeated x are
+        averaged), so uneven step sizes are taken into account.
+        Each refit is warm-started from the previous parameters with at most
+        max_nfev function evaluations. It starts from model.guess instead when
+        there is no previous fit, the guessed center has moved by more than
+        the previous fwhm, or the previous peak is wider than the scanned range.
+
+        A refit costs O(points), so refitting every update_every events costs
+        O(points**2) over the scan. The refits are also spaced geometrically:
+        an update_every event refits only once the points have grown by
+        refit_growth since the last fit, which bounds the total cost by
+        refit_growth/(refit_growth-1) fits of the whole scan. The fit of the
+        last points is made at stop.
+
+        :param max_nfev: evaluation budget of each refit
+        :param refit_growth: growth factor of the points between refits,
+                             None to refit at every update_every event
+    '''
+    def __init__(self, model, y, independent_vars, init_guess=None, *, update_every=1, max_nfev=100,
+                 refit_growth=1.05):
+        self._x = np.empty(64)
+        self._y = np.empty(64)
+        self._num_points = 0
+        self._num_fitted = 0
+        self.max_nfev = max_nfev
+        self.refit_growth = refit_growth
+        super().__init__(model, y, independent_vars, init_guess, update_every=update_every)
+        self._x_name, = self.independent_vars.keys()
+
+    def _reset(self):
+        super()._reset()
+        self._num_points = 0
+        self._num_fitted = 0
+
+    @property
+    def x_data(self):
+        return self._x[:self._num_points]
+
+    @property
+    def y_data(self):
+        return self._y[:self._num_points]
+
+    def update_caches(self, y, independent_vars):
+        if self._num_points == len(self._x):
+            self._x = np.resize(self._x, 2*len(self._x))
+            self._y = np.resize(self._y, 2*len(self._y))
+        self._x[self._num_points] = independent_vars[self._x_name]
+        self._y[self._num_points] = y
+        self._num_points += 1
+
+    def derivative(self):
+        '''
+            :return: (x, dy/dx) over the distinct x of the accumulated points
+        '''
+        x, y = _unique_mean(self.x_data, self.y_data)
+        if len(x) < 2:
+            return x, np.zeros_like(x)
+        return x, np.gradient(y[:,0], x)
+
+    def event(self, doc):
+        if self.y not in doc['data']:
+            return
+
+        y = doc['data'][self.y]
+        idv = {k: doc['data'][v] for k, v in self.independent_vars.items()}
+        self.update_caches(y, idv)
+
+        if self.update_every is not None:
+            i = self._num_points
+            N = len(self.model.param_names)
+            if i < N:
+                # not enough points to fit yet
+                pass
+            elif ((i == N) or ((i - 1) % self.update_every == 0)) and self._refit_due():
+                self.update_fit()
+        CallbackBase.event(self, doc)
+
+    def _refit_due(self):
+        return (self.refit_growth is None or not self._num_fitted
+                or self._num_points >= self.refit_growth*self._num_fitted)
+
+    def stop(self, doc):
+        # Update the fit if it was not updated by the last event.
+        if self._num_fitted != self._num_points:
+            self.update_fit()
+        CallbackBase.stop(self, doc)
+
+    def update_fit(self):
+        x, dydx = self.derivative()
+        N = len(self.model.param_names)
+        if len(x) < N:
+            warnings.warn(f"LiveEdgeFit cannot update fit until there are at least {N} distinct points",
+                          stacklevel=1)
+            return
+
+        kwargs = {self._x_name: x}
+        try:
+            # a falling edge gives a negative peak
+            negative = bool(abs(dydx.min()) > abs(dydx.max()))
+            guess = self.model.guess(dydx, negative=negative, **kwargs)
+        except NotImplementedError:
+            guess = self.model.make_params()
+        for name, value in self.init_guess.items():
+            guess[name].set(value=value)
+
+        params = guess
+        if self.result is not None:
+            prev = self.result.params
+            # warm start unless the edge has moved out of the previous peak,
+            # e.g. the previous fit only saw the tail of the edge,
+            # or the previous peak is wider than the scanned range
+            if ('center' not in prev or 'fwhm' not in prev
+                    or (abs(guess['center'].value - prev['center'].value) <= abs(prev['fwhm'].value)
+                        and abs(prev['fwhm'].value) <= np.ptp(x))):
+                params = prev.copy()
+        kwargs['max_nfev'] = self.max_nfev
+        self.result = self.model.fit(dydx, params, **kwargs)
+        self._num_fitted = self._num_points
+
+'''
+    Closed-form peak/edge estimators
+
+    Non-iterative alternatives to the lmfit based 'fit' and 'edgefit'.
+    x has shape (n,), y has shape (n,) or (n, channels); the estimates of
+    all channels are computed at once and returned as
+    dict(pos=..., height=..., fwhm=...) of scalars or (channels,) arrays.
+    Estimates that cannot be made (flat data, too few points) are nan.
+'''
+FWHM_PER_SIGMA = 2*np.sqrt(2*np.log(2))
+
+def _estimate(shape, **params):
+    '''
+        reshape the per-channel estimates back to the channel shape of y
+    '''
+    return {k: np.reshape(v, shape)[()] for k, v in params.items()}
+
+def _baseline(y, ends=0.1):
+    '''
+        mean of y over the first and last ends fraction of the points
+    '''
+    k = max(1, int(len(y)*ends))
+    return np.concatenate([y[:k], y[-k:]]).mean(axis=0)
+
+def moment_peak(x, y, ends=0.1):
+    '''
+        Gaussian parameters from the zeroth, first and second moments of
+        y above the baseline at both ends of the scan, weighted by the step
+        size (trapezoid rule). The noise of the tails averages out instead
+        of widening the peak as a minimum baseline would.
+    '''
+    shape = np.shape(y)[1:]
+    x, y = _unique_mean(x, y)
+    if len(x) < 3:
+        nan = np.full(y.shape[1], np.nan)
+        return _estimate(shape, pos=nan, height=nan, fwhm=nan)
+    y = y - _baseline(y, ends)
+    w = y*np.gradient(x)[:,None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        area = w.sum(axis=0)
+        pos = (x[:,None]*w).sum(axis=0)/area
+        var = ((x[:,None] - pos)**2*w).sum(axis=0)/area
+        height = area/np.sqrt(2*np.pi*var)
+        fwhm = FWHM_PER_SIGMA*np.sqrt(var)
+    return _estimate(shape, pos=pos, height=height, fwhm=fwhm)
+
+def caruana_peak(x, y, threshold=0.5):
+    '''
+        Caruana's algorithm: least squares parabola ln(y) = a + b*x + c*x**2
+        over the points above threshold of the maximum (y above its minimum),
+        then pos = -b/2c, sigma**2 = -1/2c, height = exp(a - b**2/4c).
+        The normal equations of all channels are solved in one batch.
+    '''
+    shape = np.shape(y)[1:]
+    x, y = _unique_mean(x, y)
+    nan = np.full(y.shape[1], np.nan)
+    if len(x) < 3:
+        return _estimate(shape, pos=nan, height=nan, fwhm=nan)
+    y = y - y.min(axis=0)
+    mask = (y > threshold*y.max(axis=0)) & (y > 0)
+    ln_y = np.log(np.where(mask, y, 1))
+    # expand around the maximum to keep the normal equations well conditioned
+    x0 = x[y.argmax(axis=0)]
+    u = np.where(mask, x[:,None] - x0, 0)
+    powers = u[...,None]**np.arange(5)*mask[...,None]   # (n, channels, 5)
+    S = powers.sum(axis=0)
+    A = S[:, np.arange(3)[:,None] + np.arange(3)]       # (channels, 3, 3)
+    B = (powers[...,:3]*ln_y[...,None]).sum(axis=0)
+    ok = mask.sum(axis=0) >= 3
+    A[~ok] = np.eye(3)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        a, b, c = np.linalg.solve(A, B[...,None])[...,0].T
+        c = np.where(ok & (c < 0), c, np.nan)
+        pos = x0 - b/(2*c)
+        sigma = np.sqrt(-1/(2*c))
+        height = np.exp(a - b**2/(4*c))
+    return _estimate(shape, pos=pos, height=height, fwhm=FWHM_PER_SIGMA*sigma)
+
+def derivative_edge(x, y, smooth=1.0, threshold=0.5):
+    '''
+        Locate an edge as the caruana_peak of dy/dx after Gaussian smoothing
+        of y by smooth points, the fwhm is corrected for the smoothing width.
+        A falling edge gives a negative height.
+    '''
+    from scipy.ndimage import gaussian_filter1d
+    shape = np.shape(y)[1:]
+    x, y = _unique_mean(x, y)
+    if len(x) < 3:
+        nan = np.full(y.shape[1], np.nan)
+        return _estimate(shape, pos=nan, height=nan, fwhm=nan)
+    if smooth:
+        y = gaussian_filter1d(y, smooth, axis=0, mode='nearest')
+    dydx = np.gradient(y, x, axis=0)
+    sign = np.where(np.abs(dydx.min(axis=0)) > np.abs(dydx.max(axis=0)), -1.0, 1.0)
+    # the baseline of dy/dx is 0, the opposite lobe would lift the tails
+    res = caruana_peak(x, np.clip(sign*dydx, 0, None), threshold)
+    pos, height, fwhm = (np.reshape(res[k], -1) for k in ('pos', 'height', 'fwhm'))
+    # derivative of an erf edge smoothed by a gaussian of smooth*step
+    width = FWHM_PER_SIGMA*smooth*np.mean(np.diff(x))
+    fwhm = np.sqrt(np.clip(fwhm**2 - width**2, 0, None))
+    return _estimate(shape, pos=pos, height=sign*height, fwhm=fwhm)
+
+'''
+    choice name: estimator
+'''
+ESTIMATORS = dict(moments=moment_peak, caruana=caruana_peak, derivative=derivative_edge)
+
+class LiveMultiFit(CallbackBase):
+    '''
+        Live closed-form estimates of many y channels against one x.
+
+        All channels share one (points, channels) numpy buffer and are
+        estimated in a single batched call of the estimator, instead of one
+        LiveFit per channel. A channel missing from an event is nan there.
+
+        :param x: data key of the independent variable
+        :param ys: data keys of the channels, see channel_names for a TsujiCounter
+        :param method: name in ESTIMATORS or estimator(x, y) -> dict(pos=, height=, fwhm=)
+        :param update_every: re-estimate every update_every points, None only at stop
+        :param positioner: moved at stop according to move_policy
+        :param move_policy: None does not move,
+                            a channel name moves to the pos of that channel,
+                            'mean' or 'median' of the valid pos of all channels,
+                            'strongest' to the pos of the channel of largest |height|,
+                            or a callable(results DataFrame) returning the position
+        :param verbose: print the results table at stop
+
+        :example:
+            tc.select_channels([0, 1, 2, 3])
+            RE(scan([tc], slit, -1, 1, 41),
+               LiveMultiFit('slit', channel_names(tc), 'derivative',
+                            positioner=slit, move_policy='tc_channels_ch2'))
+    '''
+    def __init__(self, x, ys, method='caruana', *, update_every=None,
+                 positioner=None, move_policy=None, verbose=True):
+        super().__init__()
+        self.x = x
+        self.ys = list(ys)
+        self.method = method
+        self.estimator = ESTIMATORS[method] if isinstance(method, str) else method
+        self.update_every = update_every
+        self.positioner = positioner
+        self.move_policy = move_policy
+        self.verbose = verbose
+        self._reset()
+
+    def _reset(self):
+        self._x = np.empty(64)
+        self._y = np.empty((64, len(self.ys)))
+        self._num_points = 0
+        self._num_estimated = 0
+        self.estimate = None
+
+    @property
+    def x_data(self):
+        return self._x[:self._num_points]
+
+    @property
+    def y_data(self):
+        return self._y[:self._num_points]
+
+    def _append(self, x, y):
+        n = self._num_points + len(x)
+        if n > len(self._x):
+            size = max(n, 2*len(self._x))
+            self._x = np.resize(self._x, size)
+            self._y = np.resize(self._y, (size, len(self.ys)))
+        self._x[self._num_points:n] = x
+        self._y[self._num_points:n] = y
+        self._num_points = n
+
     def start(self, doc):
+        self._reset()
         super().start(doc)
-        self.yv_prev = None
 
     def event(self, doc):
-        if self.y not in doc['data']:
+        data = doc['data']
+        if self.x not in data:
             return
+        self._append([data[self.x]], [[data.get(y, np.nan) for y in self.ys]])
+        self._maybe_update()
+        super().event(doc)
 
-        if self.yv_prev is None:
-            self.yv_prev = doc['data'][self.y]
+    def event_page(self, doc):
+        data = doc['data']
+        if self.x not in data:
             return
+        num = len(data[self.x])
+        columns = [data[y] if y in data else np.full(num, np.nan) for y in self.ys]
+        self._append(data[self.x], np.column_stack(columns) if columns else np.empty((num, 0)))
+        self._maybe_update()
+
+    def _maybe_update(self):
+        if (self.update_every is not None
+                and self._num_points - self._num_estimated >= self.update_every):
+            self.update_estimate()
+
+    def update_estimate(self):
+        self.estimate = self.estimator(self.x_data, self.y_data)
+        self._num_estimated = self._num_points
+        return self.estimate
+
+    @property
+    def results(self):
+        '''
+            :return: DataFrame of pos/height/fwhm indexed by channel
+        '''
+        if self.estimate is None:
+            return None
+        df = pd.DataFrame({k: np.reshape(v, -1) for k, v in self.estimate.items()}, index=self.ys)
+        df.index.name = 'channel'
+        return df
+
+    def move_target(self, results=None):
+        '''
+            :return: position chosen by move_policy or None
+        '''
+        results = self.results if results is None else results
+        policy = self.move_policy
+        if policy is None or results is None:
+            return None
+        if callable(policy):
+            return policy(results)
+        pos = results['pos'].dropna()
+        if policy in results.index:
+            top = results.loc[policy, 'pos']
+        elif pos.empty:
+            top = np.nan
+        elif policy == 'mean':
+            top = pos.mean()
+        elif policy == 'median':
+            top = pos.median()
+        elif policy == 'strongest':
+            top = results.loc[results['height'].abs().loc[pos.index].idxmax(), 'pos']
+        else:
+            raise ValueError(f"unknown move_policy {policy!r}")
+        return None if np.isnan(top) else float(top)
+
+    def stop(self, doc):
+        if self._num_estimated != self._num_points or self.estimate is None:
+            self.update_estimate()
+        results = self.results
+        if self.verbose:
+            with pd.option_context('display.float_format', '{:0.6f}'.format):
+                print(results, end='\n\n')
+        top = self.move_target(results)
+        if self.positioner is not None and top is not None:
+            self.positioner.move(top)
+            print(f"Moved {self.positioner.name} to {top:.3} via {self.method} {self.move_policy}\n", flush=True)
+        super().stop(doc)
+
+def channel_names(detector, kind=Kind.normal):
+    '''
+        :return: data keys of the channels of a TsujiCounter selected
+                 by select_channels, i.e. not omitted
+    '''
+    return [getattr(detector.channels, name).name
+            for name in detector.channels.component_names
+            if getattr(detector.channels, name).kind & kind]
+
+_fit_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='LiveCbsFactory')
+
+class OutOfBandFits:
+    '''
+        Run the final fit of LiveFit callbacks once, on an executor.
+
+        The stop method of each callback is replaced so that the final
+        update_fit, if the fit is stale, is submitted instead of computed in
+        the callback chain. submit(method) returns the same future whoever
+        asks first, already done with the current result when the fit is
+        up to date.
+    '''
+    def __init__(self, callbacks, executor=None):
+        self.callbacks = callbacks
+        self.executor = executor or _fit_executor
+        self.futures = {}
+        self._lock = threading.Lock()
+        for method in callbacks:
+            self._defer_stop(method)
+
+    def _defer_stop(self, method):
+        cb = self.callbacks[method]
+        def stop(doc):
+            # Update the fit if it was not updated by the last event.
+            if self.stale(cb):
+                self.submit(method)
+            CallbackBase.stop(cb, doc)
+        cb.stop = stop
+
+    @staticmethod
+    def stale(cb):
+        '''
+            :return: True if the last points are not fitted yet
+        '''
+        if isinstance(cb, LiveEdgeFit):
+            return cb._num_fitted != cb._num_points
+        return getattr(cb, '_LiveFit__stale', True)
+
+    @staticmethod
+    def _final_fit(cb):
+        cb.update_fit()
+        return cb.result
+
+    def submit(self, method):
+        with self._lock:
+            if method not in self.futures:
+                cb = self.callbacks[method]
+                if self.stale(cb):
+                    self.futures[method] = self.executor.submit(self._final_fit, cb)
+                else:
+                    self.futures[method] = Future()
+                    self.futures[method].set_result(cb.result)
+            return self.futures[method]
 
-        yv_diff = doc['data'][self.y] - self.yv_prev
-        self.yv_prev = doc['data'][self.y]
+    def result(self, method, timeout=None):
+        return self.submit(method).result(timeout=timeout)
 
-        doc_new = dict(doc)
-        doc_new['data'] = dict(doc['data'])
-        doc_new['data'][self.y] = yv_diff
+    def wait(self, timeout=None):
+        return wait([self.submit(method) for method in self.callbacks], timeout=timeout)
 
-        super().event(doc_new)
+@make_class_safe(logger=logger)
+class FitReport(QtAwareCallback):
+    '''
+        Print the table of all methods and the fit reports, and plot the fit
+        results at stop, once the fits are done. stop runs in the Qt main
+        thread when the teleporter is in use, the caller runs it otherwise.
+
+        :param top_res: {method: dict(pos=, height=, fwhm=)} of the methods
+                        known at stop, the fits are added to it
+    '''
+    def __init__(self, fits, scan_id, top_res=None, fit_plots_enabled=True, verbose=False,
+                 use_teleporter=None, **kwargs):
+        if use_teleporter is None:
+            import matplotlib
+            use_teleporter = 'qt' in matplotlib.get_backend().lower()
+        self.use_teleporter = use_teleporter
+        super().__init__(use_teleporter=use_teleporter, **kwargs)
+        self.fits = fits
+        self.scan_id = scan_id
+        self.top_res = {} if top_res is None else top_res
+        self.fit_plots_enabled = fit_plots_enabled
+        self.verbose = verbose
+        self.table = None
+
+    def stop(self, doc):
+        for method in self.fits.callbacks:
+            try:
+                result = self.fits.result(method)
+                self.top_res[method] = dict(pos=result.params['center'].value,
+                                            height=result.params['height'].value,
+                                            fwhm=result.params['fwhm'].value)
+            except Exception as e:
+                self.top_res[method] = dict(pos=f'{e!r}', height='-', fwhm='-')
+        with pd.option_context('display.float_format', '{:0.6f}'.format):
+            self.table = pd.DataFrame().from_dict(self.top_res, orient='index')
+            self.table.index.name = 'method'
+            print(self.table, end='\n\n')
+
+        lf = self.fits.callbacks['fit']
+        lef = self.fits.callbacks['edgefit']
+        if self.verbose:
+            print(f'== Gaussian fit ==\n {lf.result.fit_report()}\n')
+            print(f'== Edge fit ==\n {lef.result.fit_report()}\n')
+
+        if self.fit_plots_enabled:
+            fig = lf.result.plot()
+            if hasattr(fig.canvas.manager, 'window'):
+                fig.canvas.manager.window.setGeometry(640,30,640,601)
+            fig.canvas.manager.set_window_title(f"Scan ID: {self.scan_id}, {lf.__class__.__name__}")
+
+            fig = lef.result.plot()
+            if hasattr(fig.canvas.manager, 'window'):
+                fig.canvas.manager.window.setGeometry(640,805,640,601)
+            fig.canvas.manager.set_window_title(f"Scan ID: {self.scan_id} {lef.__class__.__name__}")
 
 class LiveCbsFactory:
     def __init__(self, positioner=None, detector=None, choice=None,
                  x_data_name=None, y_data_name=None, update_every=None,
                  bec=None,
-                 live_table_enabled=False, fit_plots_enabled=True, verbose=False):
+                 live_table_enabled=False, fit_plots_enabled=True, verbose=False,
+                 fit_timeout=None, executor=None):
         '''
         a monkey patch for one dimensional scan
         to compute and move to desired position after scan
         :param positioner: move to desired position after scan
                            positioner.name is the default value of x_data_name if not None
         :param detector: detector.name is the default value of y_data_name if not None
-        :param choice: choose method to find top position
+        :param choice: choose method to find top position,
+                       'max', 'min', 'com', 'cen' from the peak statistics,
+                       'fit', 'edgefit' from the lmfit Gaussian fits,
+                       'moments', 'caruana', 'derivative' from the closed-form
+                       estimators of ESTIMATORS
         :param x_data_name: override positioner.name if not None
         :param y_data_name: override detector.name if not None
         :param update_every: see LiveFit
-        :param bec: BestEffortCallback used by RunEngine
+        :param bec: BestEffortCallback used by RunEngine,
+                    a PeakStats is added to the callbacks if None
         :param live_table_enabled: set False if outside bec table is enabled
         :param fit_plots_enabled: option to disable fit plots
+        :param fit_timeout: seconds to wait for the final fit of choice 'fit' or 'edgefit'
+                            before giving up the move, None waits forever
+        :param executor: concurrent.futures executor of the final fits,
+                         a shared thread pool by default
+
+        The final fits run on the executor, the positioner is moved as soon as
+        the result of the chosen method is known. With a Qt backend the table,
+        fit reports and fit plots follow in the Qt main thread once all fits
+        are done, without blocking the scan; without it they are made at stop.
 
         :example:
             rr = RunRouter([LiveCbsFactory(motor, noisy_det, 'method', bec=bec)])
@@ -62,6 +574,11 @@ class LiveCbsFactory:
         self.live_table_enabled = live_table_enabled
         self.fit_plots_enabled = fit_plots_enabled
         self.verbose = verbose
+        self.fit_timeout = fit_timeout
+        self.executor = executor
+        self.fits = None
+        self.fit_report = None
+        self.report_thread = None
 
     def __call__(self, name, doc):
         '''
@@ -78,43 +595,58 @@ class LiveCbsFactory:
             lt = LiveTable([y,x])
         lf = LiveFit(GaussianModel(), y, {'x':x}, update_every=self.update_every or int(doc['num_points']/10))
         lef = LiveEdgeFit(GaussianModel(), y, {'x':x}, update_every=self.update_every or int(doc['num_points']/10))
+        fits = OutOfBandFits(dict(fit=lf, edgefit=lef), self.executor)
+        self.fits = fits
 
         choice = self.choice or doc.get('choice','peak')
         positioner = self.positioner
+        bec = self.bec
+        ps = PeakStats(x, y) if bec is None else None
 
         def stop_decorator(cb):
             orig_stop = cb.stop # push
-            fit_plots_enabled = self.fit_plots_enabled
             verbose = self.verbose
-            bec = self.bec
+            fit_timeout = self.fit_timeout
+            factory = self
             def inner(self, doc):
                 cb.stop = orig_stop #pop
                 orig_stop(doc)
 
-                if verbose:
-                    print(f'== Gaussian fit ==\n {lf.result.fit_report()}\n')
-                    print(f'== Edge fit ==\n {lef.result.fit_report()}\n')
-                    print(f'== bec peaks ==\n {bec.peaks}\n')
+                if bec is not None:
+                    if verbose:
+                        print(f'== bec peaks ==\n {bec.peaks}\n')
+                    peaks = {method: bec.peaks[method][y] for method in ('max', 'min', 'com', 'cen')}
+                else:
+                    peaks = dict(max=ps.max, min=ps.min, com=ps.com, cen=ps.cen)
                 '''
-                    collect top result of all methods
+                    collect top result of the peak methods
                 '''
                 top_res = dict(
-                    max = dict(pos=bec.peaks['max'][y][0], height=bec.peaks['max'][y][1], fwhm='-'),
-                    min = dict(pos=bec.peaks['min'][y][0], height=bec.peaks['min'][y][1], fwhm='-'),
-                    com = dict(pos=bec.peaks['com'][y], height='-', fwhm='-'),
-                    cen = dict(pos=bec.peaks['cen'][y], height='-', fwhm='-'),
-                    fit = dict(pos=lf.result.params['center'].value, height=lf.result.params['height'].value,
-                               fwhm=lf.result.params['fwhm'].value),
-                    edgefit = dict(pos=lef.result.params['center'].value, height=lef.result.params['height'].value,
-                                   fwhm=lef.result.params['fwhm'].value),
+                    max = dict(pos=peaks['max'][0], height=peaks['max'][1], fwhm='-'),
+                    min = dict(pos=peaks['min'][0], height=peaks['min'][1], fwhm='-'),
+                    com = dict(pos=peaks['com'], height='-', fwhm='-'),
+                    cen = dict(pos=peaks['cen'], height='-', fwhm='-'),
                     )
-                with pd.option_context('display.float_format', '{:0.6f}'.format):
-                    df = pd.DataFrame().from_dict(top_res, orient='index')
-                    df.index.name = 'method'
-                    print(df, end='\n\n')
                 '''
-                    move positioner
+                    closed-form estimates are cheap enough to compute in place
                 '''
+                for method, estimator in ESTIMATORS.items():
+                    top_res[method] = estimator(lef.x_data, lef.y_data)
+                fit_report = FitReport(fits, scan_id, top_res, factory.fit_plots_enabled, verbose)
+                factory.fit_report = fit_report
+
+                def fit_res(method, timeout=None):
+                    result = fits.result(method, timeout=timeout)
+                    return dict(pos=result.params['center'].value, height=result.params['height'].value,
+                                fwhm=result.params['fwhm'].value)
+                '''
+                    move positioner as soon as the chosen result is known
+                '''
+                if choice in fits.callbacks:
+                    try:
+                        top_res[choice] = fit_res(choice, fit_timeout)
+                    except TimeoutError:
+                        print(f"{choice} did not finish within {fit_timeout} s, positioner is not moved\n", flush=True)
                 top = top_res.get(choice, {}).get('pos',None)
 
                 if (positioner is not None
@@ -124,23 +656,28 @@ class LiveCbsFactory:
                     positioner.move(top)
                     print(f"Found and moved to top at {top:.3} via method {choice}\n", flush=True)
 
-                if fit_plots_enabled:
-                    fig = lf.result.plot()
-                    fig.canvas.manager.window.setGeometry(640,30,640,601)
-                    fig.canvas.manager.set_window_title(f"Scan ID: {scan_id}, {lf.__class__.__name__}")
-
-                    fig = lef.result.plot()
-                    fig.canvas.manager.window.setGeometry(640,805,640,601)
-                    fig.canvas.manager.set_window_title(f"Scan ID: {scan_id} {lef.__class__.__name__}")
-
-
+                '''
+                    report all methods once the remaining fits are done,
+                    the waiting thread hands the report to the Qt main thread
+                '''
+                if fit_report.use_teleporter:
+                    def report():
+                        fits.wait()
+                        fit_report('stop', doc)
+                    factory.report_thread = threading.Thread(target=report, daemon=True)
+                    factory.report_thread.start()
+                else:
+                    fit_report('stop', doc)
 
             return MethodType(inner, cb)
-        self.bec.stop = stop_decorator(self.bec)
 
-        if self.live_table_enabled:
-            cbs = [lt, lf, lef], []
+        if bec is not None:
+            bec.stop = stop_decorator(bec)
+            cbs = [lf, lef]
         else:
-            cbs = [lf, lef], []
-        return cbs
+            ps.stop = stop_decorator(ps)
+            cbs = [lf, lef, ps]
 
+        if self.live_table_enabled:
+            cbs = [lt] + cbs
+        return cbs, []
@@ -1,5 +1,191 @@
 from bluesky.callbacks.mpl_plotting import LivePlot, QtAwareCallback, LiveGrid
+from matplotlib.backend_bases import TimerBase
+from types import SimpleNamespace
 import numpy as np
+import threading
+import time
+import weakref
+
+class RedrawScheduler:
+    '''
+        Coalesce redraw requests of live plots into frames.
+
+        A figure is redrawn at most max_fps times per second, requests
+        arriving within a frame interval are merged so that only the latest
+        state is drawn. Callbacks run in the Qt main thread through the
+        QtAwareCallback teleporter, the trailing frame is fired from a
+        canvas timer there. Backends without an event loop draw the pending
+        frame on the next request after the interval, or on flush.
+
+        :example:
+            redraw_scheduler.set_max_fps(fig, 5)
+            redraw_scheduler.request(fig)
+            redraw_scheduler.flush(fig)
+            redraw_scheduler.stats(fig)
+    '''
+    def __init__(self, max_fps=20):
+        self.max_fps = max_fps
+        self._lock = threading.RLock()
+        self._figures = weakref.WeakKeyDictionary()
+
+    def _state(self, fig):
+        state = self._figures.get(fig)
+        if state is None:
+            state = SimpleNamespace(max_fps=self.max_fps, last_render=0., pending={},
+                                    timer=None, rendered=0, dropped=0)
+            self._figures[fig] = state
+        return state
+
+    def set_max_fps(self, fig, max_fps):
+        with self._lock:
+            self._state(fig).max_fps = max_fps
+
+    def request(self, fig, render=None):
+        '''
+            ask for a redraw of fig, render defaults to fig.canvas.draw_idle
+        '''
+        render = render or fig.canvas.draw_idle
+        with self._lock:
+            state = self._state(fig)
+            if state.pending:
+                state.dropped += 1
+            state.pending[render] = None
+            wait = state.last_render + 1/state.max_fps - time.monotonic()
+            if wait <= 0:
+                self._render(fig, state)
+            elif state.timer is None:
+                timer = fig.canvas.new_timer(interval=max(1, int(wait*1000)))
+                if type(timer) is TimerBase:
+                    # no event loop to fire the timer
+                    return
+                timer.single_shot = True
+                timer.add_callback(self._on_timer, fig)
+                state.timer = timer
+                timer.start()
+
+    def _on_timer(self, fig):
+        with self._lock:
+            state = self._figures.get(fig)
+            if state is not None:
+                state.timer = None
+                if state.pending:
+                    self._render(fig, state)
+
+    def _render(self, fig, state):
+        pending, state.pending = state.pending, {}
+        state.last_render = time.monotonic()
+        state.rendered += 1
+        for render in pending:
+            render()
+
+    def flush(self, fig=None):
+        '''
+            draw the pending frame of fig (all figures if None) right now
+        '''
+        with self._lock:
+            figs = list(self._figures.keys()) if fig is None else [fig]
+            for fig in figs:
+                state = self._state(fig)
+                if state.timer is not None:
+                    state.timer.stop()
+                    state.timer = None
+                if state.pending:
+                    self._render(fig, state)
+
+    def stats(self, fig):
+        '''
+            :return: dict of rendered and dropped (merged) frame counts
+        '''
+        with self._lock:
+            state = self._state(fig)
+            return dict(rendered=state.rendered, dropped=state.dropped,
+                        pending=bool(state.pending), max_fps=state.max_fps)
+
+redraw_scheduler = RedrawScheduler()
+
+'''
+    contrast limit (clim) estimators of LiveGridImage
+'''
+class PercentileClim:
+    '''
+        exact percentiles of the full frame
+    '''
+    def __init__(self, percentile=(5,95)):
+        self.percentile = percentile
+
+    def __call__(self, I):
+        lim_low, lim_high = np.percentile(I, self.percentile)
+        return lim_low, lim_high
+
+    def reset(self):
+        pass
+
+class SubsampleClim(PercentileClim):
+    '''
+        percentiles of a strided subsample of at most max_samples pixels,
+        the cost does not depend on the frame size
+    '''
+    def __init__(self, percentile=(5,95), max_samples=16384):
+        super().__init__(percentile)
+        self.max_samples = max_samples
+
+    def sample(self, I):
+        I = np.asarray(I)
+        if I.size <= self.max_samples:
+            return I
+        if I.ndim == 2:
+            stride = int(np.ceil(np.sqrt(I.size/self.max_samples)))
+            return I[::stride, ::stride]
+        stride = int(np.ceil(I.size/self.max_samples))
+        return I.ravel()[::stride]
+
+    def __call__(self, I):
+        return super().__call__(self.sample(I))
+
+class HistogramClim(SubsampleClim):
+    '''
+        percentiles read from the cumulative histogram of a subsample,
+        accurate to (max-min)/bins
+    '''
+    def __init__(self, percentile=(5,95), max_samples=16384, bins=256):
+        super().__init__(percentile, max_samples)
+        self.bins = bins
+
+    def __call__(self, I):
+        sample = self.sample(I)
+        lo, hi = sample.min(), sample.max()
+        if lo == hi:
+            return lo, hi
+        counts, edges = np.histogram(sample, bins=self.bins, range=(lo, hi))
+        cdf = np.cumsum(counts)
+        index = np.searchsorted(cdf, np.asarray(self.percentile)/100*cdf[-1])
+        lim_low, lim_high = edges[np.minimum(index + 1, self.bins)]
+        return lim_low, lim_high
+
+class EMAClim:
+    '''
+        exponential moving average of the limits given by estimator,
+        keeps the colour scale from flickering between frames
+    '''
+    def __init__(self, estimator=None, alpha=0.3):
+        self.estimator = estimator or SubsampleClim()
+        self.alpha = alpha
+        self._lims = None
+
+    def __call__(self, I):
+        lims = np.asarray(self.estimator(I), dtype=float)
+        if self._lims is None:
+            self._lims = lims
+        else:
+            self._lims = self.alpha*lims + (1-self.alpha)*self._lims
+        lim_low, lim_high = self._lims
+        return lim_low, lim_high
+
+    def reset(self):
+        self._lims = None
+        reset = getattr(self.estimator, 'reset', None)
+        if reset:
+            reset()
 
 class PXRDPlot(LivePlot):
     def start(self, doc):
@@ -10,18 +196,66 @@ class PXRDPlot(LivePlot):
     def update_caches(self, x, y):
         self.y_data = y
         self.x_data = x
-    # def update_plot(self):
-        # self.ax.figure.canvas.draw_idle()
+
+    def update_plot(self):
+        self.current_line.set_data(self.x_data, self.y_data)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view(tight=True)
+        redraw_scheduler.request(self.ax.figure)
 
     def stop(self, doc):
+        redraw_scheduler.flush(self.ax.figure)
         QtAwareCallback.stop(self, doc)
 
-class LiveGridImage(LiveGrid):
+class DisplayPyramid:
+    '''
+        Downsampled levels of a frame for display, level k is reduced by 2**k
+        in each direction with a vectorized block reduction.
+        Levels are built on first use and cached for the frame.
+
+        :param reduce: 'mean', 'max' or 'min', use 'max' to keep sharp peaks
+    '''
+    def __init__(self, I, reduce='mean'):
+        self.reduce = reduce
+        self.levels = {0: np.asarray(I)}
+
+    @staticmethod
+    def block_reduce(I, factor, reduce='mean'):
+        h, w = I.shape[0]//factor*factor, I.shape[1]//factor*factor
+        blocks = I[:h, :w].reshape(h//factor, factor, w//factor, factor)
+        return getattr(blocks, reduce)(axis=(1, 3))
+
+    @property
+    def max_level(self):
+        return int(np.log2(max(1, min(self.levels[0].shape[:2]))))
+
+    def level(self, k):
+        k = min(k, self.max_level)
+        if k not in self.levels:
+            # reduce from the closest level already built
+            j = max(i for i in self.levels if i < k)
+            self.levels[k] = self.block_reduce(self.levels[j], 2**(k-j), self.reduce)
+        return self.levels[k]
 
-    def __init__(self,*args, interpolation='nearest', percentile=(5,95), **wkargs):
+class LiveGridImage(LiveGrid):
+    '''
+        :param percentile: percentiles of the default PercentileClim estimator
+        :param clim_estimator: callable(I) -> (low, high) used when clim is None,
+                               e.g. SubsampleClim(), HistogramClim(), EMAClim()
+        :param decimate: None to display the full frame, or 'mean', 'max', 'min'
+                         to display the DisplayPyramid level matching the axes
+                         size, cropped to the visible region. Zooming in ends
+                         at full resolution tiles of the zoomed region.
+    '''
+    def __init__(self,*args, interpolation='nearest', percentile=(5,95), clim_estimator=None,
+                 decimate=None, **wkargs):
         super().__init__(*args, **wkargs)
 
         self.percentile = percentile
+        self.clim_estimator = clim_estimator or PercentileClim(percentile)
+        self.decimate = decimate
+        self._pyramid = None
+        self._rendering_view = False
 
         def setup():
             nonlocal interpolation
@@ -29,16 +263,31 @@ class LiveGridImage(LiveGrid):
 
         def post_setup():
             self.im.set_interpolation(self.interpolation)
+            if self.decimate:
+                self.ax.callbacks.connect('xlim_changed', self.__on_view_changed)
+                self.ax.callbacks.connect('ylim_changed', self.__on_view_changed)
+                self.ax.figure.canvas.mpl_connect('resize_event', self.__on_view_changed)
+
+        def on_view_changed(event):
+            if self._pyramid is not None and not self._rendering_view:
+                self._render_view()
+                redraw_scheduler.request(self.ax.figure)
 
         self.__setup = setup
         self.__post_setup = post_setup
+        self.__on_view_changed = on_view_changed
 
     def start(self, doc):
+        reset = getattr(self.clim_estimator, 'reset', None)
+        if reset:
+            reset()
         if not hasattr(self, 'im'):
             self.__setup()
             super().start(doc)
             self.__post_setup()
-            self.ax.figure.canvas.manager.window.setGeometry(0,0,1275,700)
+            window = getattr(self.ax.figure.canvas.manager, 'window', None)
+            if window is not None:
+                window.setGeometry(0,0,1275,700)
         else:
             self.ax.set_title('scan {uid} [{sid}]'.format(sid=doc['scan_id'],
                               uid=doc['uid'][:6]))
@@ -54,13 +303,65 @@ class LiveGridImage(LiveGrid):
     def update(self, I):
         self._Idata = I
         if self.clim is None:
-            percentile_low, percentile_high = self.percentile
-            lim_low = np.percentile(self._Idata, percentile_low)
-            lim_high = np.percentile(self._Idata, percentile_high)
+            lim_low, lim_high = self.clim_estimator(self._Idata)
             self.im.set_clim(lim_low, lim_high)
 
-        self.im.set_array(self._Idata)
-        self.ax.figure.canvas.draw_idle()
+        if self.decimate:
+            self._pyramid = DisplayPyramid(self._Idata, self.decimate)
+            self._render_view()
+        else:
+            self.im.set_array(self._Idata)
+        redraw_scheduler.request(self.ax.figure)
+
+    def _frame_extent(self, shape):
+        if self.extent is not None:
+            return self.extent
+        h, w = shape[:2]
+        return (-0.5, w-0.5, -0.5, h-0.5)
+
+    def _render_view(self):
+        '''
+            display the visible region of the pyramid level matching the axes size
+        '''
+        I = self._pyramid.levels[0]
+        h, w = I.shape[:2]
+        x0, x1, y0, y1 = self._frame_extent(I.shape)
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+
+        # visible region in full resolution pixels, origin='lower'
+        cols = np.sort((np.asarray(xlim) - x0)/(x1 - x0)*w)
+        rows = np.sort((np.asarray(ylim) - y0)/(y1 - y0)*h)
+        c0, c1 = np.clip([np.floor(cols[0]), np.ceil(cols[1])], 0, w).astype(int)
+        r0, r1 = np.clip([np.floor(rows[0]), np.ceil(rows[1])], 0, h).astype(int)
+        if c1 <= c0 or r1 <= r0:
+            return
+
+        # the aspect-adjusted box lags behind the view, use the layout box
+        bbox = self.ax.get_position(original=True).transformed(self.ax.figure.transFigure)
+        factor = max((c1-c0)/max(bbox.width, 1), (r1-r0)/max(bbox.height, 1))
+        k = int(np.floor(np.log2(factor))) if factor > 1 else 0
+        level = self._pyramid.level(k)
+        f = 2**min(k, self._pyramid.max_level)
+
+        lc0, lc1 = c0//f, min(-(-c1//f), level.shape[1])
+        lr0, lr1 = r0//f, min(-(-r1//f), level.shape[0])
+        tile = level[lr0:lr1, lc0:lc1]
+        tile_extent = (x0 + lc0*f/w*(x1-x0), x0 + lc1*f/w*(x1-x0),
+                       y0 + lr0*f/h*(y1-y0), y0 + lr1*f/h*(y1-y0))
+
+        # set_extent would autoscale the axes to the tile, keep the view
+        self._rendering_view = True
+        try:
+            self.im.set_data(tile)
+            self.im.set_extent(tile_extent)
+            self.ax.set_xlim(xlim)
+            self.ax.set_ylim(ylim)
+        finally:
+            self._rendering_view = False
+
+    def stop(self, doc):
+        redraw_scheduler.flush(self.ax.figure)
+        super().stop(doc)
 
 '''
     plotting sqeuence of signal,tth data
@@ -73,7 +374,19 @@ logger = logging.getLogger(__name__)
 
 @make_class_safe(logger=logger)
 class ResultPlot(QtAwareCallback):
-    def __init__(self, y_data_name, x_data_name, ax=None, fig=None, max_line_num=10, vis_line_num=3, show_legend=True, **kwargs):
+    '''
+        Keep the last max_line_num patterns, the newest vis_line_num visible.
+
+        A pool of max_line_num Line2D is recycled with set_data, also by the
+        next runs, whose start hides and empties it. The legend lists the
+        lines of the run, the oldest first; it is rebuilt only while the
+        pool is filling up, a recycled line only restyles and relabels the
+        legend entries.
+        With blit=True and a canvas supporting it, events which do not change
+        the view limits are drawn by blitting the lines and the legend.
+    '''
+    def __init__(self, y_data_name, x_data_name, ax=None, fig=None, max_line_num=10, vis_line_num=3, show_legend=True,
+                 blit=False, **kwargs):
         self.y_data_name = y_data_name
         self.x_data_name = x_data_name
 
@@ -81,7 +394,7 @@ class ResultPlot(QtAwareCallback):
         self.__setup_lock = threading.Lock()
         self.__setup_event = threading.Event()
         def setup():
-            nonlocal ax, kwargs
+            nonlocal ax, fig, kwargs
             import matplotlib.pyplot as plt
             with self.__setup_lock:
                 if self.__setup_event.is_set():
@@ -91,14 +404,21 @@ class ResultPlot(QtAwareCallback):
                 fig = plt.figure()
                 ax = fig.add_axes([0.1, 0.1, 0.6, 0.75])
                 fig.show()
+            fig = ax.figure
             self.ax = ax
             self.fig = fig
-            fig.canvas.manager.window.setGeometry(0,802,1275,600)
+            window = getattr(fig.canvas.manager, 'window', None)
+            if window is not None:
+                window.setGeometry(0,802,1275,600)
 
             self.ax.set_xlabel('2' + r'$\theta$' +'(\u00b0)')
             self.ax.set_ylabel('Intensity')
             self.kwargs = kwargs
             fig.canvas.mpl_connect('pick_event', self.__on_pick)
+            self._canvas = fig.canvas
+            self._blit = blit and fig.canvas.supports_blit
+            if self._blit:
+                fig.canvas.mpl_connect('draw_event', self.__on_draw)
 
         def on_pick(event):
             # On the pick event, find the original line corresponding to the legend
@@ -112,53 +432,147 @@ class ResultPlot(QtAwareCallback):
             legline.set_alpha(1.0 if visible else 0.2)
             self.ax.figure.canvas.draw_idle()
 
+        def on_draw(event):
+            # A full draw skips the animated artists, keep the background
+            # of the screen canvas for blitting and draw them on top of it.
+            # A savefig (pdf, svg, ...) draws them itself.
+            canvas = event.canvas
+            if canvas.is_saving():
+                return
+            if canvas is self._canvas and hasattr(canvas, 'copy_from_bbox'):
+                self._background = canvas.copy_from_bbox(self.fig.bbox)
+            self._draw_animated(event.renderer)
+
         self.__on_pick = on_pick
+        self.__on_draw = on_draw
         self.__setup = setup
         self.max_line_num = max_line_num
         self.vis_line_num = vis_line_num
         self.show_legend = show_legend
+        self.lined = {}
+        self.lines = []  # pool lines of the run, the oldest first
+        self._pool = []
+        self.legend = None
+        self._blit = False
+        self._full_draw = False
+        self._background = None
+        self._canvas = None
 
     def start(self, doc):
         self.__setup()
         self.ax.set_title("scan id = %d" % (doc["scan_id"]))
-        self.lined = {}
         self.lines = []
+        for line in self._pool:
+            line.set_data([], [])
+            line.set_visible(False)
+        if self.legend is not None:
+            self.legend.remove()
+            self.legend = None
+            self.lined = {}
+        self._full_draw = True
+
+    def _build_legend(self):
+        self.legend = self.ax.legend(handles=self.lines,
+                                     bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
+        self.legend.set_animated(self._blit)
+        for legline in self.legend.get_lines():
+            legline.set_picker(True)  # Enable picking on the legend line.
+        self._sync_legend()
+
+    def _sync_legend(self):
+        ''' legend entry i shows self.lines[i], restyled after a recycling '''
+        self.lined = {}
+        for legline, legtext, origline in zip(self.legend.get_lines(), self.legend.get_texts(), self.lines):
+            self.lined[legline] = origline
+            legline.set_color(origline.get_color())
+            legline.set_linestyle(origline.get_linestyle())
+            legline.set_marker(origline.get_marker())
+            legtext.set_text(origline.get_label())
+            legline.set_alpha(1.0 if origline.get_visible() else 0.2)
+
+    def _draw_animated(self, renderer=None):
+        if renderer is None:
+            renderer = self.fig.canvas.get_renderer()
+        for line in self._pool:
+            line.draw(renderer)
+        if self.legend is not None:
+            self.legend.draw(renderer)
 
     def event(self, doc):
         tth = doc['data'].get(self.x_data_name,[])
         signal = doc['data'].get(self.y_data_name,[])
         if len(tth) and len(signal):
-            line = self.ax.plot(tth,signal,label=f"seq#:{doc['seq_num']}", **self.kwargs)
-            self.lines += line
-            if self.max_line_num != None and len(self.lines) > self.max_line_num:
-                self.lines[0].remove()
-                del self.lines[0]
-            for line in self.lines:
-                line.set_visible(True)
+            label = f"seq#:{doc['seq_num']}"
+            view_lim = self.ax.viewLim.frozen()
+            legend_changed = self.max_line_num == None or len(self.lines) < self.max_line_num
+            if len(self.lines) < len(self._pool):
+                ''' a line left by a previous run '''
+                line = self._pool[len(self.lines)]
+                line.set_data(tth, signal)
+                line.set_label(label)
+                self.ax.relim()
+                self.ax.autoscale_view()
+            elif legend_changed:
+                line, = self.ax.plot(tth,signal,label=label, animated=self._blit, **self.kwargs)
+                self._pool.append(line)
+            else:
+                ''' recycle the oldest line '''
+                line = self.lines.pop(0)
+                line.set_data(tth, signal)
+                line.set_label(label)
+                self.ax.relim()
+                self.ax.autoscale_view()
+            self.lines.append(line)
+
+            if self.show_legend and self.vis_line_num != None and len(self.lines) > self.vis_line_num:
+                vis_line_start_index = len(self.lines) - self.vis_line_num
+            else:
+                vis_line_start_index = 0
+            for index, origline in enumerate(self.lines):
+                origline.set_visible(index >= vis_line_start_index)
 
             if self.show_legend:
-                self.legend = self.ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
-
-                if self.vis_line_num != None and len(self.lines) > self.vis_line_num:
-                    vis_line_start_index = len(self.lines) - self.vis_line_num
+                if legend_changed or self.legend is None:
+                    self._build_legend()
                 else:
-                    vis_line_start_index = 0
-
-                for (index, legline), origline in zip(enumerate(self.legend.get_lines()), self.lines):
-                    legline.set_picker(True)  # Enable picking on the legend line.
-                    self.lined[legline] = origline
-                    if index < vis_line_start_index:
-                        legline.set_alpha(0.2)
-                        origline.set_visible(False)
-        #                 print(f"legline, origline={legline},{origline}")
-            self.ax.figure.canvas.draw_idle()
+                    self._sync_legend()
+
+            if legend_changed or self.ax.viewLim.frozen().bounds != view_lim.bounds:
+                self._full_draw = True
+            redraw_scheduler.request(self.fig, self._render)
+
+    def _render(self):
+        if self._blit and self._background is not None and not self._full_draw:
+            canvas = self.fig.canvas
+            canvas.restore_region(self._background)
+            self._draw_animated()
+            canvas.blit(self.fig.bbox)
+        else:
+            self.fig.canvas.draw_idle()
+        self._full_draw = False
+
+    def stop(self, doc):
+        redraw_scheduler.flush(self.fig)
+        super().stop(doc)
 
 from bluesky.callbacks.mpl_plotting import QtAwareCallback
 import matplotlib.pyplot as plt
 import matplotlib.lines as lines
-from matplotlib.widgets import CheckButtons
+from matplotlib.patches import Rectangle
 class ProcPlot(QtAwareCallback):
-    def __init__(self, *args, xy_lim=None, autoscale=True, **kwargs):
+    '''
+        Lines of processed data with a toggle legend on the left.
+
+        The toggle legend grows one entry per new label, clicking an entry
+        (or "All") toggles the visibility of its line(s). "All" is checked
+        while every line is visible.
+
+        :param toggle_row_height: largest row height of the toggle legend in ax_leg
+                                  axes coordinates, the rows shrink to fit all entries
+    '''
+    LABEL_ALL = "All"
+
+    def __init__(self, *args, xy_lim=None, autoscale=True, toggle_row_height=0.04, **kwargs):
         super().__init__(*args, **kwargs)
         # internal state
         self._start_doc = None
@@ -167,6 +581,11 @@ class ProcPlot(QtAwareCallback):
         self._delta_mot_poslist = []
         self._colors = plt.rcParams['axes.prop_cycle']()
         self._lines = {}
+        self._toggles = {}  # maps label to (box, text) of the toggle legend
+        self._toggle_artists = {}  # maps box and text to label
+        self._toggle_ax = None
+        self._pick_cid = None
+        self.toggle_row_height = toggle_row_height
         self.xy_lim = xy_lim
         self.autoscale = autoscale
 
@@ -178,12 +597,19 @@ class ProcPlot(QtAwareCallback):
             ax_leg.set_aspect('equal', anchor='N')
             ax = plt.subplot2grid((1,fig_cols), (0,3), colspan=fig_cols-2, fig=fig)
             ax.set_position([0.3, 0.1, 0.5, 0.75])
-            fig_win = ax.figure.canvas.manager.window
-            fig_win.setGeometry(0,0,1275,700)
-            fig.canvas.set_window_title('---  TPS HRPXRD ---')
+            manager = fig.canvas.manager
+            fig_win = getattr(manager, 'window', None)
+            if fig_win is not None:
+                fig_win.setGeometry(0,0,1275,700)
+            if manager is not None:
+                manager.set_window_title('---  TPS HRPXRD ---')
             fig.show()
             self._lines.clear()
 
+        if getattr(self, 'fig', None) is not fig:
+            if self._pick_cid is not None:
+                self.fig.canvas.mpl_disconnect(self._pick_cid)
+            self._pick_cid = fig.canvas.mpl_connect('pick_event', self.on_pick)
         self.fig =fig
         axes = fig.axes
         self.ax_leg = axes[0]
@@ -195,6 +621,7 @@ class ProcPlot(QtAwareCallback):
 
         for line in self.ax.lines:
             self._lines[line.get_label()] = line
+        self.update_check_buttons()
 
     def start(self, doc):
         self._start_doc = doc
@@ -209,39 +636,90 @@ class ProcPlot(QtAwareCallback):
         self._descriptors[doc['uid']] = doc
         self.setup()
 
+    def _add_toggle(self, label, color, visible):
+        box = Rectangle((0.02, 0), 0.1, 0, transform=self.ax_leg.transAxes,
+                        edgecolor=color, facecolor=color if visible else 'none', picker=True)
+        text = self.ax_leg.text(0.16, 0, label, transform=self.ax_leg.transAxes,
+                                va='center', picker=True)
+        self.ax_leg.add_patch(box)
+        self._toggles[label] = (box, text)
+        self._toggle_artists[box] = label
+        self._toggle_artists[text] = label
+
+    def _layout_toggles(self):
+        '''
+            stack the entries from the top, shrinking the rows and the font
+            when toggle_row_height does not fit all of them
+        '''
+        h = min(self.toggle_row_height, 1/max(len(self._toggles), 1))
+        fontsize = plt.rcParams['font.size']*h/self.toggle_row_height
+        for row, (box, text) in enumerate(self._toggles.values()):
+            y = 1 - (row + 1)*h
+            box.set_y(y + 0.15*h)
+            box.set_height(0.7*h)
+            text.set_y(y + 0.5*h)
+            text.set_fontsize(fontsize)
+
+    def _set_toggle(self, label, visible):
+        box, _ = self._toggles[label]
+        box.set_facecolor(box.get_edgecolor() if visible else 'none')
+
     def update_check_buttons(self):
-        LABEL_ALL = "All"
-        label_all_vis = True
-        self.ax_leg.clear()
-        self.check_labels = [label for label in self._lines.keys()] + [LABEL_ALL]
-        check_labels_vis = [line.get_visible() for line in self._lines.values()] + [label_all_vis]
-
-        check_buttons = CheckButtons(self.ax_leg, self.check_labels, check_labels_vis)
-        self.check_buttons = check_buttons
-        # scale symbols according to live_ax_leg.set_ylim(top=
-        live_ax_leg_yscale=2
-        w=check_buttons.rectangles[0].get_width()
-        [rect.set_width(w*live_ax_leg_yscale) for rect in check_buttons.rectangles]
-        xd = check_buttons.lines[0][0].get_xdata()
-        xd = [xd[0],live_ax_leg_yscale*xd[1]-xd[0]]
-        [[line.set_xdata(xd) for line in cross] for cross in check_buttons.lines]
-        self.ax_leg.set_ylim(top=live_ax_leg_yscale)
-        self.ax_leg.axis('off')
-
-        def on_check_func(label):
-            index = self.check_labels.index(label)
-            vis = self.check_buttons.get_status()[index]
-            #! print(f"on_clicked {label}, index:{index}")
-            #live_lines[index].set_visible(not live_lines[index].get_visible())
-            if index == self.check_labels.index(LABEL_ALL):
-                for line, chk_btn  in zip(self._lines.values(), self.check_buttons.lines):
-                    line.set_visible(vis)
-                    chk_btn[0].set_visible(vis)
-                    chk_btn[1].set_visible(vis)
-            else:
-                self._lines[label].set_visible(vis)
-            self.fig.canvas.draw()
-        check_buttons_cid = check_buttons.on_clicked(on_check_func)
+        '''
+            add toggle entries for new lines, existing entries are kept
+        '''
+        if self._toggle_ax is not self.ax_leg:
+            # new or shared figure, take over the legend axes once
+            self.ax_leg.clear()
+            self.ax_leg.axis('off')
+            self._toggle_ax = self.ax_leg
+            self._toggles.clear()
+            self._toggle_artists.clear()
+            self._add_toggle(self.LABEL_ALL, 'k', True)
+        for label, line in self._lines.items():
+            if label not in self._toggles:
+                self._add_toggle(label, line.get_color(), line.get_visible())
+        self._set_toggle(self.LABEL_ALL, all(line.get_visible() for line in self._lines.values()))
+        self._layout_toggles()
+
+    @property
+    def check_labels(self):
+        return list(self._toggles.keys())
+
+    def get_status(self):
+        return [box.get_facecolor()[3] > 0 for box, _ in self._toggles.values()]
+
+    def on_pick(self, event):
+        label = self._toggle_artists.get(event.artist)
+        if label is None:
+            return
+        box, _ = self._toggles[label]
+        vis = box.get_facecolor()[3] == 0
+        self._set_toggle(label, vis)
+        if label == self.LABEL_ALL:
+            for line_label, line in self._lines.items():
+                line.set_visible(vis)
+                self._set_toggle(line_label, vis)
+        else:
+            self._lines[label].set_visible(vis)
+            self._set_toggle(self.LABEL_ALL, all(line.get_visible() for line in self._lines.values()))
+        redraw_scheduler.request(self.fig)
+
+    def _update_line(self, label, x, y, line_params):
+        '''
+            :return: True if a new line is created
+        '''
+        line = self._lines.get(label)
+        if line:
+            line.set_data(x, y)
+            return False
+        ''' new line '''
+        line = lines.Line2D(x, y,
+                            **dict(line_params, label=label),
+                            **next(self._colors))
+        self.ax.add_line(line)
+        self._lines[label] = line
+        return True
 
     def event(self, doc):
         '''
@@ -250,34 +728,41 @@ class ProcPlot(QtAwareCallback):
             'data': {'x': tth_plot_sign*tth_temp, 'y':signal_temp},
             'line_params': {'label':f'{self._raw["label"]}{delta_mythen}', 'marker':'x', 'linestyle':'', 'markersize':5}
             }
+        batched doc example, all series are applied with a single redraw:
+        doc_plot = {
+            'series': {'raw12.3': (x, y), 'bci12.3': (x, y)},
+            'line_params': {'marker':'x', 'linestyle':'', 'markersize':5}
+            }
         '''
         line_params = doc.get('line_params',{})
-        line_label = line_params.get('label')
-        if line_label:
+        if 'series' in doc:
+            series = doc['series']
+        else:
+            line_label = line_params.get('label')
+            if not line_label:
+                return
+            data = doc.get('data',{})
+            series = {line_label: (data.get('x',[]), data.get('y',[]))}
+        line_params = {k: v for k, v in line_params.items() if k != 'label'}
+
+        new_line = False
+        for line_label, (x, y) in series.items():
             if line_label == 'all_lines':
-                x = doc.get('data',{}).get('x',[])
-                y = doc.get('data',{}).get('y',[])
                 for line in self._lines.values():
-                    line.set_xdata(x)
-                    line.set_ydata(y)
+                    line.set_data(x, y)
             else:
-                x = doc.get('data',{}).get('x',[])
-                y = doc.get('data',{}).get('y',[])
-                line = self._lines.get(line_label)
-                if line:
-                    line.set_xdata(x)
-                    line.set_ydata(y)
-                else:
-                    ''' new line '''
-                    line = lines.Line2D(x, y,
-                                        **line_params,
-                                        **next(self._colors))
-                    self.ax.add_line(line)
-                    self._lines[line_label] = line
-                    self.ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
-                    if self.autoscale: self.ax.autoscale()
-                    self.update_check_buttons()
-            self.fig.canvas.draw_idle()
+                new_line |= self._update_line(line_label, x, y, line_params)
+
+        if new_line:
+            self.ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
+            if self.autoscale: self.ax.autoscale()
+            self.update_check_buttons()
+        redraw_scheduler.request(self.fig)
+
+    def stop(self, doc):
+        if hasattr(self, 'fig'):
+            redraw_scheduler.flush(self.fig)
+        super().stop(doc)
 '''
 proc_plot = ProcPlot()
 
@@ -291,11 +776,13 @@ delta_mythen=12.3
 data_angoft = {'raw':1, 'bci':3, 'ff':5, 'valid':7, 'dvdl':11}
 # data_angoft = {'raw':0, 'bci':0, 'ff':0, 'valid':0, 'dvdl':0}
 for i in range(101):
+    series = {}
     for label, angoft in data_angoft.items():
         signal_temp = np.sin(np.pi/100*(tth_temp+angoft+i*angoft)*5)
-        doc = {'data':{'x': tth_temp, 'y':signal_temp},
-               'line_params': {'label':f'{label}{delta_mythen}', 'marker':'x', 'linestyle':'', 'markersize':5}
-               }
-        proc_plot('event', doc)
+        series[f'{label}{delta_mythen}'] = (tth_temp, signal_temp)
+    doc = {'series': series,
+           'line_params': {'marker':'x', 'linestyle':'', 'markersize':5}
+           }
+    proc_plot('event', doc)
     plt.pause(0.05)
 '''
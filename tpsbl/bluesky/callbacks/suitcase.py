@@ -1,7 +1,49 @@
 # Set up a RunRouter suitable for exporting from many runs.
 import copy
+import queue
+import threading
+import time
+import json
+import os
+import numpy as np
 import pandas as pd
+from collections.abc import Mapping
 from suitcase.csv import Serializer as CSVSerializer
+
+class _PageRow(Mapping):
+    '''
+        Read-only view of one row of an event page.
+
+        Every column is exposed as a length-1 slice so that filename templates
+        written for the row-0 path (``{event[seq_num][0]:04d}``) format the
+        same way for any row, without copying the page.
+    '''
+    def __init__(self, page, index):
+        self._page = page
+        self._index = index
+
+    def __getitem__(self, key):
+        value = self._page[key]
+        if isinstance(value, str):
+            return value
+        if isinstance(value, Mapping):
+            return _PageRow(value, self._index)
+        return value[self._index:self._index+1]
+
+    def __iter__(self):
+        return iter(self._page)
+
+    def __len__(self):
+        return len(self._page)
+
+def xye_header(x_data_name, y_data_name, sep=',', index_label=None, header=True, **kwargs):
+    '''
+        header line of the xye files for the to_csv kwargs of the serializer
+    '''
+    if not header:
+        return ''
+    return f'{index_label or x_data_name}{sep}{y_data_name}\n'
+
 class XYESerializer(CSVSerializer):
     '''
         Method 1: override superior function
@@ -18,13 +60,24 @@ class XYESerializer(CSVSerializer):
         string may include templates as in
         ``{motor1-{event[data][motor1_setpoint]}-motor2-{event[data][motor2_setpoint]}``,
         The default value is extracted all motors except the innermost motor from RunStart document
+        page_mode : bool, optional
+            Write every row of an event page to its own xye file, formatting
+        the columns straight from the numpy buffers with ``xye_fmt``.
+        The default (False) keeps the pandas path which only writes row 0.
+        xye_fmt : tuple of str, optional
+            printf-style formats of the x and y columns used by page_mode.
     '''
-    def __init__(self, y_data_name, x_data_name, *args, xye_prefix=None, data_alias_name={},**kwargs):
+    def __init__(self, y_data_name, x_data_name, *args, xye_prefix=None, data_alias_name={},
+                 page_mode=False, xye_fmt=('%.3f', '%.1f'), **kwargs):
         super().__init__(*args, **kwargs)
         self._xye_prefix = xye_prefix
         self.y_data_name = y_data_name
         self.x_data_name = x_data_name
         self.data_alias_name = data_alias_name
+        self.page_mode = page_mode
+        self.xye_fmt = xye_fmt
+        self.motor_name_list = []
+        self._compiled_xye_prefix = {}  # maps descriptor uid to xye_prefix
 
     def start(self,doc):
         super().start(doc)
@@ -39,6 +92,31 @@ class XYESerializer(CSVSerializer):
                     self.motor_name_list.append(motorname)
             self._xye_prefix = '-'.join(mtr_sp_list)
 
+    def descriptor(self, doc):
+        super().descriptor(doc)
+        self._compiled_xye_prefix[doc['uid']] = self._compile_xye_prefix(doc['data_keys'])
+
+    def _apply_alias(self, xye_prefix):
+        for motorname in self.motor_name_list:
+            # use data_alias_name if any
+            for motor_spname in [f'{motorname}_setpoint', f'{motorname}_user_setpoint']:
+                for spname_key in [f'{motorname}_setpoint', f'{motorname}_user_setpoint']:
+                    aliasname = self.data_alias_name.get(spname_key,None)
+                    if aliasname:
+                        xye_prefix = xye_prefix.replace(motor_spname, aliasname)
+        return xye_prefix
+
+    def _compile_xye_prefix(self, data_keys):
+        '''
+            resolve the xye_prefix against the data keys of a stream
+        '''
+        xye_prefix = self._xye_prefix
+        for motorname in self.motor_name_list:
+            # veryfy motor_sp name
+            if f'{motorname}_setpoint' in data_keys:
+                xye_prefix = xye_prefix.replace(f'{motorname}_user_setpoint', f'{motorname}_setpoint')
+        return self._apply_alias(xye_prefix)
+
     def to_xye(self, doc):
         df = pd.DataFrame({self.x_data_name:doc['data'][self.x_data_name][0].round(3),
                            self.y_data_name:doc['data'][self.y_data_name][0].round(1)})
@@ -63,9 +141,49 @@ class XYESerializer(CSVSerializer):
         f = self._manager.open('stream_data', filename, 'xt')
         df.to_csv(f, **self._kwargs)
 
+    def _xye_header(self):
+        return xye_header(self.x_data_name, self.y_data_name, **self._kwargs)
+
+    def to_xye_page(self, doc):
+        '''
+            write every row of an event page without copying the page
+        '''
+        xye_prefix = self._compiled_xye_prefix.get(doc['descriptor'])
+        if xye_prefix is None:
+            xye_prefix = self._compile_xye_prefix(doc['data'])
+            self._compiled_xye_prefix[doc['descriptor']] = xye_prefix
+
+        x_filled = doc['filled'].get(self.x_data_name)
+        y_filled = doc['filled'].get(self.y_data_name)
+        x_fmt, y_fmt = self.xye_fmt
+        line_fmt = f"{x_fmt}{self._kwargs.get('sep', ',')}{y_fmt}\n"
+        header = self._xye_header()
+
+        for index in range(len(doc['seq_num'])):
+            if ((x_filled is not None and not x_filled[index]) or
+                (y_filled is not None and not y_filled[index])):
+                continue
+            x = np.asarray(doc['data'][self.x_data_name][index])
+            y = np.asarray(doc['data'][self.y_data_name][index])
+            xy = np.empty((len(x), 2))
+            xy[:, 0] = x
+            xy[:, 1] = y
+
+            _templated_xye_prefix = xye_prefix.format(event=_PageRow(doc, index))
+            filename = (f'{self._templated_file_prefix}'
+                        f"{_templated_xye_prefix}.xye")
+            f = self._manager.open('stream_data', filename, 'xt')
+            f.write(header + (line_fmt * len(xy)) % tuple(xy.ravel().tolist()))
+            if self._flush:
+                f.flush()
+
     def event_page(self, doc):
         if (len(doc['data'].get(self.x_data_name,[])) and
             len(doc['data'].get(self.y_data_name,[]))):
+            if self.page_mode:
+                self.to_xye_page(doc)
+                return
+
             ''' filter out unfilled data '''
             doc_new = copy.deepcopy(doc)
             if not all(map(all, doc['filled'].values())):
@@ -80,3 +198,377 @@ class XYESerializer(CSVSerializer):
 
     def stop(self, doc):
         super().stop(doc)
+
+class XYEHDF5Serializer(XYESerializer):
+    '''
+        Append every pattern of a run into one chunked HDF5 file
+        ``<directory>/<file_prefix>xye.h5`` instead of one xye file per event.
+
+        Layout
+        ------
+        /<x_data_name> : (n_axes, n_points) distinct 2theta axes of the run
+        /<y_data_name> : (n_rows, n_points) intensity, one chunk per row
+        /table/<col>   : (n_rows,) seq_num, time, axis_index and every scalar
+                         field of the streams, e.g. the motor setpoints,
+                         nan in the rows of a stream without the field
+
+        Use XYERunReader to slice rows and hdf5_to_xye to emit xye files.
+
+        Parameters
+        ----------
+        compression : str, optional
+            h5py compression filter of the intensity dataset, e.g. 'gzip'
+        grow_by : int, optional
+            number of rows allocated each time the datasets are extended
+    '''
+    def __init__(self, y_data_name, x_data_name, *args, compression=None, grow_by=64, **kwargs):
+        super().__init__(y_data_name, x_data_name, *args, **kwargs)
+        self.compression = compression
+        self.grow_by = grow_by
+        self._h5 = None
+        self._num_rows = 0
+        self._num_axes = 0
+        self._scalar_fields = {}  # maps descriptor uid to scalar field names
+
+    def start(self, doc):
+        super().start(doc)
+        self._start_doc = doc
+
+    def descriptor(self, doc):
+        super().descriptor(doc)
+        self._scalar_fields[doc['uid']] = [
+            field for field, data_key in doc['data_keys'].items()
+            if not data_key.get('shape') and data_key.get('dtype') in ('number', 'integer')]
+
+    def _open(self, doc, num_points):
+        filename = f'{self._templated_file_prefix}xye.h5'
+        # h5py needs a read/write handle, reserve the name and let it open the file
+        import h5py
+        filepath = self._manager.reserve_name('stream_data', filename)
+        self._h5 = h5py.File(filepath, 'w-')
+        self._h5.attrs['x_data_name'] = self.x_data_name
+        self._h5.attrs['y_data_name'] = self.y_data_name
+        self._h5.attrs['xye_header'] = self._xye_header()
+        self._h5.attrs['sep'] = self._kwargs.get('sep', ',')
+        self._h5.attrs['xye_prefix'] = self._compiled_xye_prefix.get(doc['descriptor'], self._xye_prefix)
+        self._h5.attrs['start'] = json.dumps(self._start_doc, default=repr)
+        self._h5.create_dataset(self.x_data_name, shape=(0, num_points), maxshape=(None, num_points),
+                                chunks=(1, num_points), dtype='f8')
+        self._h5.create_dataset(self.y_data_name, shape=(0, num_points), maxshape=(None, num_points),
+                                chunks=(1, num_points), dtype='f8', compression=self.compression)
+        table = self._h5.create_group('table')
+        for col, dtype in [('seq_num', 'i8'), ('time', 'f8'), ('axis_index', 'i8')]:
+            table.create_dataset(col, shape=(0,), maxshape=(None,), chunks=(self.grow_by,), dtype=dtype)
+
+    def _table_fields(self, descriptor):
+        '''
+            :return: scalar fields of descriptor, their table datasets are
+                     created on first use, nan for the rows written before
+        '''
+        fields = self._scalar_fields.get(descriptor, [])
+        table = self._h5['table']
+        for field in fields:
+            if field not in table:
+                table.create_dataset(field, shape=(len(table['seq_num']),), maxshape=(None,),
+                                     chunks=(self.grow_by,), dtype='f8', fillvalue=np.nan)
+        return fields
+
+    def _reserve(self, num_rows):
+        intensity = self._h5[self.y_data_name]
+        if num_rows <= len(intensity):
+            return
+        size = (num_rows // self.grow_by + 1) * self.grow_by
+        intensity.resize(size, axis=0)
+        for dset in self._h5['table'].values():
+            dset.resize(size, axis=0)
+
+    def _axis_index(self, x):
+        ''' store x only when it differs from the previous axis '''
+        if self._num_axes and np.array_equal(self._last_axis, x):
+            return self._num_axes - 1
+        axes = self._h5[self.x_data_name]
+        axes.resize(self._num_axes + 1, axis=0)
+        axes[self._num_axes] = x
+        self._last_axis = x
+        self._num_axes += 1
+        return self._num_axes - 1
+
+    def event_page(self, doc):
+        if not (len(doc['data'].get(self.x_data_name,[])) and
+                len(doc['data'].get(self.y_data_name,[]))):
+            return
+
+        ''' filter out unfilled data '''
+        rows = np.ones(len(doc['seq_num']), dtype=bool)
+        for field in (self.x_data_name, self.y_data_name):
+            if field in doc['filled']:
+                rows &= np.asarray(doc['filled'][field], dtype=bool)
+        rows = np.flatnonzero(rows)
+        if not len(rows):
+            return
+
+        y = np.asarray(doc['data'][self.y_data_name])[rows]
+        if self._h5 is None:
+            self._open(doc, y.shape[1])
+
+        start, stop = self._num_rows, self._num_rows + len(rows)
+        self._reserve(stop)
+        self._h5[self.y_data_name][start:stop] = y
+        table = self._h5['table']
+        table['seq_num'][start:stop] = np.asarray(doc['seq_num'])[rows]
+        table['time'][start:stop] = np.asarray(doc['time'])[rows]
+        table['axis_index'][start:stop] = [self._axis_index(np.asarray(doc['data'][self.x_data_name][row]))
+                                           for row in rows]
+        for field in self._table_fields(doc['descriptor']):
+            if field in doc['data']:
+                table[field][start:stop] = np.asarray(doc['data'][field], dtype=float)[rows]
+        self._num_rows = stop
+        if self._flush:
+            self._h5.flush()
+
+    def stop(self, doc):
+        self.close()
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5[self.y_data_name].resize(self._num_rows, axis=0)
+            for dset in self._h5['table'].values():
+                dset.resize(self._num_rows, axis=0)
+            self._h5.close()
+            self._h5 = None
+        super().close()
+
+class XYERunReader:
+    '''
+        Read a file written by XYEHDF5Serializer.
+
+        Rows are read chunk by chunk on demand, the whole run is never loaded.
+
+        :example:
+            with XYERunReader('uid-xye.h5') as run:
+                tth, signal = run[10:20]
+                df = run.table
+    '''
+    def __init__(self, path):
+        import h5py
+        self._h5 = h5py.File(path, 'r')
+        self.x_data_name = self._h5.attrs['x_data_name']
+        self.y_data_name = self._h5.attrs['y_data_name']
+        self.xye_prefix = self._h5.attrs['xye_prefix']
+        self.sep = self._h5.attrs.get('sep', ',')
+        self.xye_header = self._h5.attrs.get('xye_header',
+                                             xye_header(self.x_data_name, self.y_data_name, self.sep))
+        self._axis_index = self._h5['table/axis_index'][()]
+
+    @property
+    def start(self):
+        return json.loads(self._h5.attrs['start'])
+
+    @property
+    def table(self):
+        '''
+            per-row seq_num, time and scalar fields as a DataFrame
+        '''
+        return pd.DataFrame({col: dset[()] for col, dset in self._h5['table'].items()})
+
+    def __len__(self):
+        return len(self._axis_index)
+
+    def __getitem__(self, rows):
+        '''
+            :return: (x, y) of the selected rows, x has the shape of y
+        '''
+        rows = np.arange(len(self))[rows]
+        scalar = rows.ndim == 0
+        rows = np.atleast_1d(rows)
+        # h5py fancy indexing needs increasing, unique indices
+        uniq, inverse = np.unique(rows, return_inverse=True)
+        y = self._h5[self.y_data_name][uniq][inverse]
+        axes_uniq, axes_inverse = np.unique(self._axis_index[rows], return_inverse=True)
+        x = self._h5[self.x_data_name][axes_uniq][axes_inverse]
+        if scalar:
+            return x[0], y[0]
+        return x, y
+
+    def close(self):
+        self._h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_details):
+        self.close()
+
+def hdf5_to_xye(path, directory, rows=None, file_prefix='', xye_prefix=None, xye_fmt=('%.3f', '%.1f')):
+    '''
+        Emit xye files from a file written by XYEHDF5Serializer, with the
+        header and separator the serializer would have written.
+
+        :param rows: row selection (slice, index array), all rows if None
+        :param xye_prefix: filename template, the one of the run if None
+        :return: list of written file paths
+    '''
+    written = []
+    with XYERunReader(path) as run:
+        table = run.table
+        selected = np.arange(len(run))[slice(None) if rows is None else rows]
+        page = {'seq_num': table['seq_num'].values,
+                'time': table['time'].values,
+                'data': {col: table[col].values for col in table.columns}}
+        template = xye_prefix or run.xye_prefix
+        line_fmt = f'{xye_fmt[0]}{run.sep}{xye_fmt[1]}\n'
+        header = run.xye_header
+        for row in np.atleast_1d(selected):
+            x, y = run[row]
+            filename = os.path.join(directory, f'{file_prefix}{template.format(event=_PageRow(page, row))}.xye')
+            xy = np.empty((len(x), 2))
+            xy[:, 0] = x
+            xy[:, 1] = y
+            with open(filename, 'xt') as f:
+                f.write(header + (line_fmt * len(xy)) % tuple(xy.ravel().tolist()))
+            written.append(filename)
+    return written
+
+class AsyncSerializer:
+    '''
+        Run a serializer on a background writer thread.
+
+        Documents are handed to the worker through a bounded queue so that a
+        slow file system does not stall the RunEngine callback chain.
+        Works with XYESerializer and any suitcase.csv.Serializer subclass.
+
+        Parameters
+        ----------
+        serializer : callable
+            serializer(name, doc), e.g. XYESerializer(...)
+        maxsize : int, optional
+            queue length before backpressure applies
+        policy : {'block', 'drop'}, optional
+            what to do with an event/event_page when the queue is full:
+            'block' waits for the writer, 'drop' discards and counts it.
+            start, descriptor and stop documents are never dropped.
+        timeout : float, optional
+            seconds close() waits for the writer to finish the queue
+
+        The first error of the serializer stops the writer, the documents
+        queued after it are discarded. The error is raised by the next call,
+        every later call raises RuntimeError.
+
+        :example:
+            rr = RunRouter([lambda name, doc: ([AsyncSerializer(XYESerializer('signal', 'tth', path))], [])])
+    '''
+    _droppable = ('event', 'event_page', 'bulk_events')
+
+    def __init__(self, serializer, maxsize=16, policy='block', timeout=60.):
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"policy must be 'block' or 'drop', not {policy!r}")
+        self.serializer = serializer
+        self.policy = policy
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._error = None
+        self._failed = False
+        self._dropped = 0
+        self._written = 0
+        self._max_queue_depth = 0
+        self._latency_last = 0.
+        self._latency_max = 0.
+        self._latency_total = 0.
+        self._thread = threading.Thread(target=self._worker, name='AsyncSerializer', daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, doc = item
+                if self._failed:
+                    ''' discard the documents queued after the error '''
+                    continue
+                t0 = time.monotonic()
+                try:
+                    self.serializer(name, doc)
+                except Exception as e:
+                    self._error = e
+                    self._failed = True
+                    continue
+                latency = time.monotonic() - t0
+                with self._lock:
+                    self._written += 1
+                    self._latency_last = latency
+                    self._latency_max = max(self._latency_max, latency)
+                    self._latency_total += latency
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __call__(self, name, doc):
+        self._raise_error()
+        if self._failed:
+            raise RuntimeError('AsyncSerializer stopped after a write error')
+        if not self._thread.is_alive():
+            raise RuntimeError('AsyncSerializer has been closed')
+        if self.policy == 'drop' and name in self._droppable:
+            try:
+                self._queue.put_nowait((name, doc))
+            except queue.Full:
+                with self._lock:
+                    self._dropped += 1
+                return
+        else:
+            self._queue.put((name, doc))
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+
+        if name == 'stop':
+            self.close()
+
+    def flush(self):
+        '''
+            block until every queued document has been written
+        '''
+        self._queue.join()
+        self._raise_error()
+
+    def close(self, timeout=None):
+        '''
+            flush the queue and stop the writer thread
+
+            :param timeout: seconds to wait for the writer, self.timeout if None
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                raise TimeoutError(f'AsyncSerializer writer still busy after {timeout} s')
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                raise TimeoutError(f'AsyncSerializer writer still busy after {timeout} s')
+        self._raise_error()
+
+    @property
+    def artifacts(self):
+        return self.serializer.artifacts
+
+    @property
+    def stats(self):
+        '''
+            queue-depth and write-latency counters, latencies in second
+        '''
+        with self._lock:
+            return dict(queue_depth=self._queue.qsize(),
+                        max_queue_depth=self._max_queue_depth,
+                        written=self._written,
+                        dropped=self._dropped,
+                        write_latency_last=self._latency_last,
+                        write_latency_max=self._latency_max,
+                        write_latency_mean=(self._latency_total/self._written
+                                            if self._written else 0.))
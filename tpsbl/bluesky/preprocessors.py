@@ -1,12 +1,23 @@
 from bluesky.preprocessors import msg_mutator, plan_mutator
 from bluesky.utils import make_decorator
 from collections import ChainMap
+import bluesky.protocols
 import bluesky_darkframes
 
 def collect_stream_wrapper(plan):
+    '''
+        emit the collected data as it comes instead of returning it,
+        bluesky with EventPageCollectable always emits event pages and
+        rejects stream=True, so only return_payload is patched there
+    '''
+    if hasattr(bluesky.protocols, 'EventPageCollectable'):
+        patch = {'return_payload':False}
+    else:
+        patch = {'stream':True, 'return_payload':False}
+
     def patch_collect(msg):
         if msg.command == 'collect':
-            msg = msg._replace(kwargs=ChainMap({'stream':True, 'return_payload':False}, msg.kwargs))
+            msg = msg._replace(kwargs=ChainMap(patch, msg.kwargs))
         return msg
 
     return (yield from msg_mutator(plan, patch_collect))
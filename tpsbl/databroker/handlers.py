@@ -0,0 +1,68 @@
+import os
+import threading
+
+class XPDHDF5Handler:
+    '''
+        Handler of the XPD_HDF5 resources written by XPDHDF5Plugin.
+
+        The file is opened once, on the first datum, and kept open with its
+        dataset for all the datums of the resource. A datum past the end of
+        the dataset, e.g. of a run still being written, refreshes the
+        dataset (SWMR) or reopens the file once before failing.
+
+        :param filename: HDF5 file of the resource
+        :param frame_per_point: frames of each datum
+        :param dataset: path of the frames in the file
+
+        :example:
+            handler = XPDHDF5Handler(path, frame_per_point=1)
+            frame = handler(point_number=3)
+    '''
+    specs = {'XPD_HDF5'}
+
+    def __init__(self, filename, frame_per_point=1, dataset='/entry/data/data'):
+        self.filename = os.fspath(filename)
+        self.frame_per_point = frame_per_point
+        self.dataset = dataset
+        self._lock = threading.Lock()
+        self._file = None
+        self._data = None
+
+    def _open(self):
+        import h5py
+        try:
+            self._file = h5py.File(self.filename, 'r', swmr=True)
+        except (OSError, ValueError):
+            ''' not written in SWMR mode '''
+            self._file = h5py.File(self.filename, 'r')
+        self._data = self._file[self.dataset]
+
+    def _frames(self, start, stop):
+        if self._data is None:
+            self._open()
+        if stop > len(self._data):
+            if self._file.swmr_mode:
+                self._data.refresh()
+            else:
+                self.close()
+                self._open()
+        if stop > len(self._data):
+            raise IndexError(f'frames {start}:{stop} of {self.filename} '
+                             f'with {len(self._data)} frames')
+        return self._data[start:stop]
+
+    def __call__(self, point_number):
+        start = point_number*self.frame_per_point
+        with self._lock:
+            return self._frames(start, start + self.frame_per_point).squeeze()
+
+    def get_file_list(self, datum_kwarg_gen):
+        return [self.filename]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._data = None
+
+HANDLER_REGISTRY = {'XPD_HDF5': 'tpsbl.databroker.handlers.XPDHDF5Handler'}
@@ -0,0 +1,265 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+
+INDEX_FILENAME = '.tpsbl_index.sqlite'
+SCHEMA_VERSION = 1
+
+def scan_msgpack_dir(msgpack_dir):
+    '''
+        :return: {path: (size, mtime_ns)} of the *.msgpack files in msgpack_dir
+    '''
+    files = {}
+    try:
+        entries = list(os.scandir(msgpack_dir))
+    except FileNotFoundError:
+        return files
+    for entry in entries:
+        if entry.name.endswith('.msgpack') and entry.is_file():
+            st = entry.stat()
+            files[entry.path] = (st.st_size, st.st_mtime_ns)
+    return files
+
+def changed_files(old, new):
+    '''
+        :return: sorted paths of new that are not in old or have grown/changed
+    '''
+    return sorted(path for path, stat in new.items() if old.get(path) != stat)
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return repr(obj)
+
+def index_path(msgpack_dir, filename=INDEX_FILENAME):
+    '''
+        :return: the index file in msgpack_dir if it is writable, else in the
+                 tpsbl/index folder of the user cache directory, ':memory:'
+                 for a missing msgpack_dir or without a writable cache
+    '''
+    if not os.path.isdir(msgpack_dir):
+        return ':memory:'
+    if os.access(msgpack_dir, os.W_OK):
+        return os.path.join(msgpack_dir, filename)
+    import hashlib
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                             'tpsbl', 'index')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return ':memory:'
+    if not os.access(cache_dir, os.W_OK):
+        return ':memory:'
+    name = hashlib.sha1(msgpack_dir.encode()).hexdigest() + '.sqlite'
+    return os.path.join(cache_dir, name)
+
+def read_start_stop(path):
+    '''
+        Read the start document and, if the run is finished, the stop document
+        of a msgpack run file. The documents in between are skipped without
+        being decoded.
+
+        :return: (start, stop), start is None for an empty or partial file,
+                 stop is None for a running scan
+    '''
+    import msgpack
+    import msgpack_numpy
+    with open(path, 'rb') as file:
+        unpacker = msgpack.Unpacker(file, object_hook=msgpack_numpy.decode)
+        try:
+            name, start = unpacker.unpack()
+        except (msgpack.OutOfData, ValueError):
+            return None, None
+        if name != 'start':
+            return None, None
+        last = unpacker.tell()
+        try:
+            while True:
+                pos = unpacker.tell()
+                unpacker.skip()
+                last = pos
+        except msgpack.OutOfData:
+            ''' end of file or a document being written '''
+            pass
+        file.seek(last)
+        unpacker = msgpack.Unpacker(file, object_hook=msgpack_numpy.decode)
+        try:
+            name, doc = unpacker.unpack()
+        except (msgpack.OutOfData, ValueError):
+            return start, None
+    return start, (doc if name == 'stop' else None)
+
+class RunIndex:
+    '''
+        SQLite sidecar index of the msgpack runs in msgpack_dir.
+
+        The index file is kept in the directory itself and holds one row of
+        start/stop metadata per run, with the size and mtime of its file.
+        A read-only (e.g. archived) directory is indexed in the user cache
+        directory instead, a missing one in memory, see index_path; the
+        directory is never created.
+        update() only reads the files that are new or have grown since they
+        were indexed, search() answers queries without opening any run file.
+
+        :example:
+            index = RunIndex('~/data_temp/20240101')
+            index.update()
+            index.search(plan_name='scan', since='2024-01-01 12:00')
+    '''
+    columns = ('uid', 'path', 'size', 'mtime_ns', 'scan_id', 'plan_name', 'sample_name',
+               'time', 'stop_time', 'exit_status', 'start', 'stop')
+
+    def __init__(self, msgpack_dir, filename=INDEX_FILENAME):
+        self.msgpack_dir = os.path.abspath(os.path.expanduser(msgpack_dir))
+        self.path = index_path(self.msgpack_dir, filename)
+        self._lock = threading.RLock()
+        try:
+            self._connect()
+        except sqlite3.OperationalError:
+            ''' e.g. a read-only index file '''
+            self.path = ':memory:'
+            self._connect()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        try:
+            self._create()
+        except sqlite3.OperationalError:
+            self._conn.close()
+            raise
+
+    def _create(self):
+        with self._lock, self._conn:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self._conn.execute('DROP TABLE IF EXISTS runs')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    uid TEXT PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER,
+                    scan_id INTEGER, plan_name TEXT, sample_name TEXT,
+                    time REAL, stop_time REAL, exit_status TEXT,
+                    start TEXT, stop TEXT)''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS runs_scan_id ON runs (scan_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS runs_time ON runs (time)')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def files(self):
+        '''
+            :return: {path: (size, mtime_ns)} as of the last update
+        '''
+        with self._lock:
+            return {row['path']: (row['size'], row['mtime_ns'])
+                    for row in self._conn.execute('SELECT path, size, mtime_ns FROM runs')}
+
+    def update(self, files=None):
+        '''
+            index the new or changed msgpack files and drop the deleted ones
+
+            :param files: {path: (size, mtime_ns)} of the directory if already scanned
+            :return: list of the rows (dict) of the (re)indexed runs
+        '''
+        files = scan_msgpack_dir(self.msgpack_dir) if files is None else files
+        indexed = []
+        with self._lock, self._conn:
+            ''' one transaction for the whole update '''
+            old = self.files()
+            for path in changed_files(old, files):
+                start, stop = read_start_stop(path)
+                if start is None:
+                    ''' not a run yet, retry at the next update '''
+                    continue
+                row = self._row(path, files[path], start, stop)
+                self._conn.execute('DELETE FROM runs WHERE path = ?', (path,))
+                self._conn.execute(f'INSERT OR REPLACE INTO runs VALUES ({",".join("?"*len(self.columns))})',
+                                   [row[c] for c in self.columns])
+                indexed.append(self._decode(row))
+            self._conn.executemany('DELETE FROM runs WHERE path = ?',
+                                   [(path,) for path in old if path not in files])
+        return indexed
+
+    def _row(self, path, stat, start, stop):
+        return dict(uid=start['uid'], path=path, size=stat[0], mtime_ns=stat[1],
+                    scan_id=start.get('scan_id'), plan_name=start.get('plan_name'),
+                    sample_name=start.get('sample_name'), time=start.get('time'),
+                    stop_time=None if stop is None else stop.get('time'),
+                    exit_status=None if stop is None else stop.get('exit_status'),
+                    start=json.dumps(start, default=_json_default),
+                    stop=None if stop is None else json.dumps(stop, default=_json_default))
+
+    @staticmethod
+    def _decode(row):
+        row = dict(row)
+        row['start'] = json.loads(row['start'])
+        row['stop'] = None if row['stop'] is None else json.loads(row['stop'])
+        return row
+
+    @staticmethod
+    def _timestamp(value):
+        if value is None or isinstance(value, (int, float)):
+            return value
+        from datetime import datetime
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value.timestamp()
+
+    def search(self, scan_id=None, plan_name=None, sample_name=None, since=None, until=None, **md):
+        '''
+            :param scan_id: an int or a (first, last) range
+            :param since, until: start time as timestamp, datetime or iso string
+            :param md: other start document keys that must be equal
+            :return: list of the matching rows (dict) ordered by start time
+        '''
+        where, args = [], []
+        if isinstance(scan_id, (tuple, list)):
+            where.append('scan_id BETWEEN ? AND ?')
+            args += list(scan_id)
+        elif scan_id is not None:
+            where.append('scan_id = ?')
+            args.append(scan_id)
+        for column, value in (('plan_name', plan_name), ('sample_name', sample_name)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value)
+        if since is not None:
+            where.append('time >= ?')
+            args.append(self._timestamp(since))
+        if until is not None:
+            where.append('time < ?')
+            args.append(self._timestamp(until))
+        for key, value in md.items():
+            where.append('json_extract(start, ?) = ?')
+            args += [f'$.{key}', value]
+        sql = 'SELECT * FROM runs' + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY time'
+        with self._lock:
+            return [self._decode(row) for row in self._conn.execute(sql, args)]
+
+    def lookup(self, paths):
+        '''
+            :return: {path: row (dict)} of the indexed paths
+        '''
+        with self._lock:
+            rows = {}
+            for path in paths:
+                row = self._conn.execute('SELECT * FROM runs WHERE path = ?', (path,)).fetchone()
+                if row is not None:
+                    rows[path] = self._decode(row)
+            return rows
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
@@ -0,0 +1,169 @@
+import os
+import threading
+from itertools import islice
+from event_model import pack_event_page, unpack_event_page, unpack_datum_page
+
+class MsgpackRun:
+    '''
+        Lazy reader of a msgpack run file written by suitcase.msgpack.
+
+        One pass records the byte offset, length and name of every document
+        without decoding them (only the name of each [name, doc] pair is read).
+        Afterwards documents are decoded one at a time from their offsets:
+        start/stop are O(1) and events or event pages are streamed by
+        generators, so memory is bounded by the largest single document.
+        refresh() continues the pass from where it stopped, for running scans.
+
+        :param path: msgpack file
+        :param start, stop: documents already known, e.g. from the RunIndex row
+
+        :example:
+            run = MsgpackRun(path)
+            run.start['scan_id']
+            for event in run.events(limit=10): ...
+            run.replay(XYESerializer('signal', 'tth', directory, page_mode=True))
+    '''
+    def __init__(self, path, start=None, stop=None):
+        self.path = os.fspath(path)
+        self._lock = threading.Lock()
+        self._docs = []
+        self._by_name = {}
+        self._end = 0
+        self._start = start
+        self._stop = stop
+        self.refresh()
+
+    @classmethod
+    def from_index_row(cls, row):
+        return cls(row['path'], start=row['start'], stop=row['stop'])
+
+    def refresh(self):
+        '''
+            record the documents appended since the last pass
+            :return: number of new documents
+        '''
+        import msgpack
+        with self._lock, open(self.path, 'rb') as file:
+            file.seek(self._end)
+            unpacker = msgpack.Unpacker(file)
+            num = len(self._docs)
+            try:
+                while True:
+                    pos = unpacker.tell()
+                    unpacker.read_array_header()
+                    name = unpacker.unpack()
+                    unpacker.skip()
+                    end = unpacker.tell()
+                    self._by_name.setdefault(name, []).append(len(self._docs))
+                    self._docs.append((self._end + pos, end - pos, name))
+            except msgpack.OutOfData:
+                ''' end of file or a document being written '''
+                pass
+            if len(self._docs) > num:
+                pos, length, name = self._docs[-1]
+                self._end = pos + length
+            return len(self._docs) - num
+
+    def counts(self):
+        '''
+            :return: {document name: number of documents}
+        '''
+        return {name: len(indexes) for name, indexes in self._by_name.items()}
+
+    @staticmethod
+    def _decode(file, pos, length):
+        import msgpack
+        import msgpack_numpy
+        file.seek(pos)
+        return msgpack.unpackb(file.read(length), object_hook=msgpack_numpy.decode)
+
+    def _read(self, index):
+        with open(self.path, 'rb') as file:
+            return self._decode(file, *self._docs[index][:2])[1]
+
+    @property
+    def start(self):
+        if self._start is None and self._by_name.get('start'):
+            self._start = self._read(self._by_name['start'][0])
+        return self._start
+
+    @property
+    def stop(self):
+        if self._stop is None and self._by_name.get('stop'):
+            self._stop = self._read(self._by_name['stop'][-1])
+        return self._stop
+
+    def documents(self, names=None):
+        '''
+            generator of (name, doc) in file order,
+            only the documents of names are decoded if given
+        '''
+        if names is None:
+            indexes = range(len(self._docs))
+        else:
+            indexes = sorted(i for name in names for i in self._by_name.get(name, ()))
+        with open(self.path, 'rb') as file:
+            for i in indexes:
+                pos, length, name = self._docs[i]
+                yield self._decode(file, pos, length)
+
+    def descriptors(self, stream_name=None):
+        '''
+            :return: descriptors of stream_name or of all streams if None
+        '''
+        return [doc for name, doc in self.documents(['descriptor'])
+                if stream_name is None or doc.get('name') == stream_name]
+
+    def event_pages(self, stream_name='primary'):
+        '''
+            generator of the event pages of stream_name, single events are
+            packed into pages of one event
+        '''
+        uids = {doc['uid'] for doc in self.descriptors(stream_name)}
+        for name, doc in self.documents(['event', 'event_page']):
+            if doc['descriptor'] not in uids:
+                continue
+            yield pack_event_page(doc) if name == 'event' else doc
+
+    def events(self, stream_name='primary', limit=None):
+        '''
+            generator of the events of stream_name, the first limit ones if given
+        '''
+        def gen():
+            for page in self.event_pages(stream_name):
+                yield from unpack_event_page(page)
+        return islice(gen(), limit)
+
+    def datums(self):
+        for name, doc in self.documents(['datum', 'datum_page']):
+            if name == 'datum':
+                yield doc
+            else:
+                yield from unpack_datum_page(doc)
+
+    def replay(self, callback, names=None):
+        '''
+            stream the documents (of names) in file order to callback(name, doc),
+            e.g. an XYESerializer
+        '''
+        for name, doc in self.documents(names):
+            callback(name, doc)
+
+    def __len__(self):
+        return len(self._docs)
+
+def open_runs(msgpack_dir, **query):
+    '''
+        generator of the MsgpackRun of the runs in msgpack_dir matching query,
+        searched in the sidecar RunIndex of the directory
+
+        :example:
+            for run in open_runs('~/data_temp/20240101', plan_name='count'):
+                run.replay(serializer)
+    '''
+    from tpsbl.databroker.index import RunIndex
+    with RunIndex(msgpack_dir) as index:
+        index.update()
+        rows = index.search(**query)
+    for row in rows:
+        yield MsgpackRun.from_index_row(row)
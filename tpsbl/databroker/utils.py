@@ -1,38 +1,267 @@
 import tempfile
 from pathlib import Path
 import os
-from datetime import datetime
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import databroker
+from tpsbl.databroker.index import RunIndex, scan_msgpack_dir, changed_files
+from tpsbl.databroker.handlers import HANDLER_REGISTRY
 
-def get_catalog(name, msgpack_dir=None):
-    if msgpack_dir is None:
-        home = str(Path.home())
-        archive_root = os.path.join(home, 'data_temp')
-        date_str = datetime.now().strftime('%Y%m%d')
-        msgpack_dir = os.path.join(archive_root, date_str)
-
-    cat_name = f'{name}_temp'
-
-    path = tempfile.mkdtemp()
-    catalog_file = os.path.join(path, f'{cat_name}.yaml')
-    with open(catalog_file, 'w') as f:
-        f.write(f'''
-    sources:
-      {cat_name}:
+def archive_root():
+    home = str(Path.home())
+    return os.path.join(home, 'data_temp')
+
+def today_msgpack_dir():
+    date_str = datetime.now().strftime('%Y%m%d')
+    return os.path.join(archive_root(), date_str)
+
+def _as_date(day):
+    '''
+        :param day: date, datetime, 'YYYYMMDD' or 'YYYY-MM-DD'
+    '''
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    day = str(day)
+    return datetime.strptime(day, '%Y-%m-%d' if '-' in day else '%Y%m%d').date()
+
+def msgpack_dirs(first_day, last_day=None, root=None):
+    '''
+        :param first_day, last_day: inclusive range of days, last_day is today if None
+        :param root: ~/data_temp if None
+        :return: the existing root/YYYYMMDD directories of the range
+    '''
+    root = archive_root() if root is None else root
+    day = _as_date(first_day)
+    last_day = datetime.now().date() if last_day is None else _as_date(last_day)
+    dirs = []
+    while day <= last_day:
+        msgpack_dir = os.path.join(root, day.strftime('%Y%m%d'))
+        if os.path.isdir(msgpack_dir):
+            dirs.append(msgpack_dir)
+        day += timedelta(days=1)
+    return dirs
+
+def _msgpack_gen(path):
+    import msgpack
+    import msgpack_numpy
+    with open(path, 'rb') as file:
+        yield from msgpack.Unpacker(file, object_hook=msgpack_numpy.decode)
+
+class CatalogRegistry:
+    '''
+        Process-wide cache of the msgpack catalogs built by get_catalog.
+
+        A catalog is created once per (name, msgpack_dir) from a single config
+        file shared by all the registered sources, and is opened on its own,
+        so databroker.catalog.force_reload and the rescan of every configured
+        catalog are not needed. refresh() upserts only the msgpack files that
+        are new or have changed (e.g. grown by a running scan) since the last
+        scan of the directory. The start/stop documents of those files come
+        from the RunIndex of the directory, which also answers search().
+    '''
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._indexes = {}
+        self._scanned = {}
+        self._config_file = None
+
+    def index(self, msgpack_dir):
+        '''
+            :return: the cached RunIndex of msgpack_dir
+        '''
+        msgpack_dir = os.path.abspath(msgpack_dir)
+        with self._lock:
+            if msgpack_dir not in self._indexes:
+                self._indexes[msgpack_dir] = RunIndex(msgpack_dir)
+            return self._indexes[msgpack_dir]
+
+    @property
+    def config_file(self):
+        with self._lock:
+            if self._config_file is None:
+                path = tempfile.mkdtemp(prefix='tpsbl_catalogs_')
+                self._config_file = os.path.join(path, 'tpsbl_catalogs.yaml')
+            return self._config_file
+
+    def _write_config(self):
+        handlers = ''.join(f'''
+            {spec}: {handler}''' for spec, handler in HANDLER_REGISTRY.items())
+        sources = ''.join(f'''
+      {entry['cat_name']}:
         description: Some imaginary beamline
         driver: "bluesky-msgpack-catalog"
         container: catalog
         args:
-          paths: {msgpack_dir}/*.msgpack
+          paths: {entry['msgpack_dir']}/*.msgpack
+          handler_registry:{handlers}
         metadata:
           beamline: "TPS Beamline"
-
+''' for entry in self._entries.values())
+        with open(self.config_file, 'w') as f:
+            f.write(f'''
+    sources:{sources}
         ''')
 
-    combo_catalog_path = databroker.catalog._catalogs[-1].path
-    if all(cat_name not in cat for cat in  databroker.catalog._catalogs[-1].path):
-        combo_catalog_path.append(catalog_file)
-        databroker.catalog.force_reload()
+    def _open(self, cat_name):
+        import intake
+        catalog = intake.open_catalog(self.config_file)[cat_name]
+
+        '''
+            expose the sources to databroker.catalog at its next reload
+        '''
+        combo_catalog_path = databroker.catalog._catalogs[-1].path
+        if self.config_file not in combo_catalog_path:
+            combo_catalog_path.append(self.config_file)
+        return catalog
+
+    def get(self, name, msgpack_dir):
+        key = (name, os.path.abspath(msgpack_dir))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                cat_names = {e['cat_name'] for e in self._entries.values()}
+                cat_name = f'{name}_temp'
+                if cat_name in cat_names:
+                    cat_name = f'{name}_temp_{len(self._entries)}'
+                entry = dict(cat_name=cat_name, msgpack_dir=key[1], catalog=None, files={})
+                self._entries[key] = entry
+                try:
+                    self._write_config()
+                    ''' the catalog loads all the files of the directory when it is opened '''
+                    entry['files'] = scan_msgpack_dir(key[1])
+                    entry['catalog'] = self._open(cat_name)
+                except Exception:
+                    del self._entries[key]
+                    raise
+            return entry['catalog']
+
+    def refresh(self, name=None, msgpack_dir=None):
+        '''
+            upsert the new or changed msgpack files of the registered catalogs,
+            all of them or those matching name and/or msgpack_dir
+
+            :return: list of the upserted files
+        '''
+        msgpack_dir = None if msgpack_dir is None else os.path.abspath(msgpack_dir)
+        upserted = []
+        with self._lock:
+            for (key_name, key_dir), entry in self._entries.items():
+                if name not in (None, key_name) or msgpack_dir not in (None, key_dir):
+                    continue
+                files = scan_msgpack_dir(key_dir)
+                index = self.index(key_dir)
+                index.update(files)
+                rows = index.lookup(changed_files(entry['files'], files))
+                for path in changed_files(entry['files'], files):
+                    if path not in rows:
+                        ''' not a run yet, retry at the next refresh '''
+                        files.pop(path)
+                        continue
+                    entry['catalog'].upsert(rows[path]['start'], rows[path]['stop'],
+                                            _msgpack_gen, (path,), {})
+                    upserted.append(path)
+                entry['files'] = files
+        return upserted
 
-    catalog = databroker.catalog[cat_name]
+    def updated_index(self, msgpack_dir):
+        '''
+            :return: the RunIndex of msgpack_dir, updated only if the files of
+                     the directory have changed since the last call
+        '''
+        msgpack_dir = os.path.abspath(msgpack_dir)
+        index = self.index(msgpack_dir)
+        files = scan_msgpack_dir(msgpack_dir)
+        with self._lock:
+            if self._scanned.get(msgpack_dir) == files:
+                return index
+        index.update(files)
+        with self._lock:
+            self._scanned[msgpack_dir] = files
+        return index
+
+    def search_rows(self, msgpack_dirs, max_workers=8, **query):
+        '''
+            Scan, index and search msgpack_dirs concurrently.
+
+            :param query: see RunIndex.search
+            :return: the matching rows of all the directories ordered by start time
+        '''
+        def search(msgpack_dir):
+            return self.updated_index(msgpack_dir).search(**query)
+
+        msgpack_dirs = list(msgpack_dirs)
+        if len(msgpack_dirs) <= 1 or max_workers <= 1:
+            results = map(search, msgpack_dirs)
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(msgpack_dirs)),
+                                    thread_name_prefix='CatalogRegistry') as pool:
+                results = list(pool.map(search, msgpack_dirs))
+        return sorted((row for rows in results for row in rows),
+                      key=lambda row: row['time'] or 0)
+
+    def search(self, msgpack_dirs, max_workers=8, **query):
+        '''
+            Search the RunIndex of one or several directories, no run file is
+            opened until its run is accessed in the returned catalog.
+
+            :param query: see RunIndex.search
+            :return: an in-memory catalog of the matching runs
+        '''
+        from databroker.in_memory import BlueskyInMemoryCatalog
+        if isinstance(msgpack_dirs, (str, os.PathLike)):
+            msgpack_dirs = [msgpack_dirs]
+        catalog = BlueskyInMemoryCatalog(handler_registry=HANDLER_REGISTRY)
+        for row in self.search_rows(msgpack_dirs, max_workers, **query):
+            catalog.upsert(row['start'], row['stop'], _msgpack_gen, (row['path'],), {})
+        return catalog
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scanned.clear()
+
+catalog_registry = CatalogRegistry()
+
+def get_catalog(name, msgpack_dir=None, refresh=True, **query):
+    '''
+        :param name: the catalog is named {name}_temp
+        :param msgpack_dir: ~/data_temp/YYYYMMDD of today if None
+        :param refresh: pick up the new or grown msgpack files of a cached catalog
+        :param query: scan_id, plan_name, sample_name, since, until or other start
+                      keys searched in the sidecar index, see RunIndex.search
+        :return: the cached catalog of (name, msgpack_dir),
+                 or a catalog of the matching runs only if query is given
+
+        :example:
+            get_catalog('xrd', scan_id=(100, 120), sample_name='LaB6')
+    '''
+    if msgpack_dir is None:
+        msgpack_dir = today_msgpack_dir()
+
+    if query:
+        return catalog_registry.search(msgpack_dir, **query)
+
+    catalog = catalog_registry.get(name, msgpack_dir)
+    if refresh:
+        catalog_registry.refresh(name, msgpack_dir)
     return catalog
+
+def get_range_catalog(first_day, last_day=None, root=None, max_workers=8, **query):
+    '''
+        one catalog of the runs of several daily msgpack directories
+
+        :param first_day, last_day: inclusive range of days, see msgpack_dirs
+        :param root: ~/data_temp if None
+        :param max_workers: directories scanned and indexed concurrently,
+                            unchanged directories are not indexed again
+        :param query: see RunIndex.search
+        :return: an in-memory catalog of the matching runs
+
+        :example:
+            get_range_catalog('2024-03-01', '2024-03-07', plan_name='count')
+    '''
+    return catalog_registry.search(msgpack_dirs(first_day, last_day, root), max_workers, **query)
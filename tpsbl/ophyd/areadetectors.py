@@ -1,17 +1,28 @@
 from ophyd.areadetector import (AreaDetector, ImagePlugin,
-                                TIFFPlugin, StatsPlugin,
+                                TIFFPlugin, HDF5Plugin, StatsPlugin,
                                 ProcessPlugin, ROIPlugin,
                                 TransformPlugin)
 from ophyd.areadetector.filestore_mixins import (FileStoreIterativeWrite,
-                                                 FileStoreTIFFSquashing)
+                                                 FileStoreTIFFSquashing,
+                                                 FileStoreHDF5IterativeWrite)
 from ophyd.areadetector.trigger_mixins import SingleTrigger, MultiTrigger
-from ophyd import (Component as Cpt, Signal)
+from ophyd import (Component as Cpt, Signal, DeviceStatus, Staged)
+import threading
+import logging
+import time
+import numpy as np
+from tpsbl.ophyd.timing import TimingRing
+
+logger = logging.getLogger(__name__)
 
 '''
     common
 '''
-class XPDTIFFPlugin(TIFFPlugin, FileStoreTIFFSquashing,
-                    FileStoreIterativeWrite):
+class SampleNameFilename:
+    '''
+        file plugin named after md['sample_name'] instead of a short uid,
+        the read/write paths and their path semantics are left to FileStoreBase
+    '''
     def __init__(self, *args, md={}, **kwargs):
         super().__init__(*args, **kwargs)
         self.md = md
@@ -26,10 +37,247 @@ class XPDTIFFPlugin(TIFFPlugin, FileStoreTIFFSquashing,
                 filename += f'_{self.filename_desc}'
         return filename, read_path, write_path
 
+class XPDTIFFPlugin(SampleNameFilename, TIFFPlugin, FileStoreTIFFSquashing,
+                    FileStoreIterativeWrite):
+    pass
+
+class XPDHDF5Plugin(SampleNameFilename, HDF5Plugin, FileStoreHDF5IterativeWrite):
+    '''
+        All the frames of a stage, i.e. of a run, in one chunked dataset of
+        one HDF5 file written in Stream mode, with a single XPD_HDF5 resource
+        and one datum per generate_datum, read back by
+        tpsbl.databroker.handlers.XPDHDF5Handler.
+
+        The cam and proc plugins are configured as for "tiff squashing"
+        (FileStoreTIFFSquashing): proc averages images_per_set frames into
+        each written frame, cam acquires images_per_set*number_of_sets
+        frames per trigger, so each datum holds number_of_sets frames.
+
+        :param images_per_set_name, number_of_sets_name: signals of the parent
+        :param cam_name: cam of the parent
+        :param proc_name: plugin feeding the file plugin
+        :param chunk_frames: frames per chunk of the dataset
+        :param compression: None or the Compression of the plugin, e.g. 'zlib', 'blosc', 'lz4'
+        :param zlevel: level of zlib compression
+        :param frames_per_datum: frames of each datum, number_of_sets at stage if None
+    '''
+    def __init__(self, *args, images_per_set_name='images_per_set', number_of_sets_name='number_of_sets',
+                 cam_name='cam', proc_name='proc', chunk_frames=1, compression=None,
+                 zlevel=None, frames_per_datum=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filestore_spec = 'XPD_HDF5'
+        self.frames_per_datum = frames_per_datum
+        self._ips_name = images_per_set_name
+        self._num_sets_name = number_of_sets_name
+        self._cam_name = cam_name
+        self._proc_name = proc_name
+        cam = getattr(self.parent, cam_name)
+        proc = getattr(self.parent, proc_name)
+
+        ''' the chunking must be set before capture opens the file '''
+        capture = self.stage_sigs.pop('capture')
+        self.stage_sigs.update([(proc.nd_array_port, cam.port_name.get()),
+                                (proc.reset_filter, 1),
+                                (proc.enable_filter, 1),
+                                (proc.filter_type, 'Average'),
+                                (proc.auto_reset_filter, 1),
+                                (proc.filter_callbacks, 1),
+                                ('nd_array_port', proc.port_name.get()),
+                                ('num_frames_chunks', chunk_frames),
+                                ('compression', 'None' if compression is None else compression)])
+        if zlevel is not None:
+            self.stage_sigs.update([('zlevel', zlevel)])
+        self.stage_sigs.update([('capture', capture)])
+
+    def get_frames_per_point(self):
+        if self.frames_per_datum is not None:
+            return self.frames_per_datum
+        return getattr(self.parent, self._num_sets_name).get()
+
+    def stage(self):
+        cam = getattr(self.parent, self._cam_name)
+        proc = getattr(self.parent, self._proc_name)
+        images_per_set = getattr(self.parent, self._ips_name).get()
+        num_sets = getattr(self.parent, self._num_sets_name).get()
+
+        capture = self.stage_sigs.pop('capture', None)
+        self.stage_sigs.update([(proc.num_filter, images_per_set),
+                                (cam.num_images, images_per_set*num_sets)])
+        if capture is not None:
+            self.stage_sigs.update([('capture', capture)])
+        return super().stage()
+
+class TrackedPuts:
+    '''
+        Skip the puts of values the detector has already applied.
+
+        The last value put to a signal, by stage, unstage or put_if_changed,
+        is remembered and a put of the same value is skipped, including the
+        get of the original value at stage. Only the puts of this device are
+        tracked, set force_puts (or force=True) after the IOC has been changed
+        behind its back, e.g. by caput or a restart. Commands such as
+        cam.acquire are always put.
+
+        unstage puts back the original values of the stage_sigs, so a staged
+        value that differs from the original one (e.g. a new exposure time)
+        is put again at every stage: the puts are skipped for the triggers
+        of one staging, and across runs only for the values already applied
+        before stage.
+    '''
+    force_puts = False
+    untracked_sigs = ('cam.acquire',)
+
+    @property
+    def _known_values(self):
+        return self.__dict__.setdefault('_known_puts', {})
+
+    @property
+    def put_counts(self):
+        '''
+            :return: {'applied': n, 'skipped': n} puts since the device was created
+        '''
+        return self.__dict__.setdefault('_put_counts', dict(applied=0, skipped=0))
+
+    def _resolve_signal(self, sig):
+        return getattr(self, sig) if isinstance(sig, str) else sig
+
+    def _is_known(self, sig, value, force=None):
+        force = self.force_puts if force is None else force
+        if force or sig.dotted_name in self.untracked_sigs:
+            return False
+        known = self._known_values
+        return sig in known and self._same_value(sig, known[sig], value)
+
+    @staticmethod
+    def _same_value(sig, a, b):
+        ''' enum values may be given as index or as string '''
+        enum_strs = getattr(sig, 'enum_strs', None)
+        if enum_strs and isinstance(a, str) != isinstance(b, str):
+            a, b = [enum_strs[v] if isinstance(v, int) and 0 <= v < len(enum_strs) else v
+                    for v in (a, b)]
+        try:
+            return bool(a == b)
+        except ValueError:
+            ''' arrays '''
+            return False
+
+    def put_if_changed(self, sig, value, timeout=3.0, force=None):
+        '''
+            :param sig: signal or dotted attribute name, e.g. 'cam.acquire_time'
+            :return: True if value was put, False if skipped
+        '''
+        sig = self._resolve_signal(sig)
+        if self._is_known(sig, value, force):
+            self.put_counts['skipped'] += 1
+            return False
+        sig._set_and_wait(value, timeout)
+        self._known_values[sig] = value
+        self.put_counts['applied'] += 1
+        return True
+
+    def forget_puts(self):
+        self._known_values.clear()
+
+    def stage(self):
+        stage_sigs = self.stage_sigs
+        applied = type(stage_sigs)()
+        for sig, value in stage_sigs.items():
+            if self._is_known(self._resolve_signal(sig), value):
+                self.put_counts['skipped'] += 1
+            else:
+                applied[sig] = value
+        self.stage_sigs = applied
+        try:
+            devices = super().stage()
+        finally:
+            self.stage_sigs = stage_sigs
+        for sig, value in applied.items():
+            self._known_values[self._resolve_signal(sig)] = value
+        self.put_counts['applied'] += len(applied)
+        return devices
+
+    def unstage(self):
+        originals = dict(self._original_vals)
+        staged = {self._resolve_signal(sig) for sig in self.stage_sigs}
+        devices = super().unstage()
+        ''' the plugins may have restored the other signals put since stage '''
+        known = self._known_values
+        for sig in [sig for sig in known if sig not in staged]:
+            del known[sig]
+        ''' unstage has put back the original values '''
+        known.update(originals)
+        self.put_counts['applied'] += len(originals)
+        return devices
+
+class TriggerTiming:
+    '''
+        Per frame timing of the trigger phases, in seconds,
+            set_exposure: trigger called -> exposure time applied
+            acquire: acquire put -> acquire done
+            plugin_write: acquire done -> array counter of the file_plugin
+                          of the detector updated, 0 if the plugin was done first
+        of the last trigger_timing_size frames.
+    '''
+    trigger_timing_size = 10000
+    timing_phases = ('set_exposure', 'acquire', 'plugin_write')
+
+    _timing = None
+
+    def timing_start(self):
+        if self._timing is None:
+            self._timing = TimingRing(('called',) + self.timing_phases, self.trigger_timing_size)
+        self._timing.start()
+
+    def timing_mark(self, phase):
+        if self._timing is not None:
+            self._timing.mark(phase)
+
+    def _acquire_changed(self, value=None, old_value=None, **kwargs):
+        if self._status is not None and old_value == 1 and value == 0:
+            self.timing_mark('acquire')
+        super()._acquire_changed(value=value, old_value=old_value, **kwargs)
+
+    def _plugin_written(self, **kwargs):
+        self.timing_mark('plugin_write')
+
+    def stage(self):
+        devices = super().stage()
+        ''' subscribed once staged, nothing is left subscribed if stage fails '''
+        plugin = getattr(self, self.file_plugin, None)
+        if plugin is not None:
+            plugin.array_counter.subscribe(self._plugin_written, run=False)
+        return devices
+
+    def unstage(self):
+        devices = super().unstage()
+        plugin = getattr(self, self.file_plugin, None)
+        if plugin is not None:
+            plugin.array_counter.clear_sub(self._plugin_written)
+        return devices
+
+    @property
+    def trigger_timing(self):
+        '''
+        :return: (frames, 3) array of the timing_phases in seconds, nan if not seen
+        '''
+        if self._timing is None:
+            return np.empty((0, 3))
+        called, exposed, acquired, written = self._timing.times().T
+        return np.column_stack([exposed - called, acquired - exposed,
+                                np.maximum(written - acquired, 0)])
+
+    def trigger_histogram(self, bins=20, phase='acquire'):
+        '''
+        :param phase: one of timing_phases
+        :return: np.histogram of the phase in seconds
+        '''
+        return TimingRing.histogram(self.trigger_timing[:, self.timing_phases.index(phase)], bins)
+
 '''
     Eiger Detector
 '''
-class EigerDetector(AreaDetector):
+class EigerDetector(TrackedPuts, AreaDetector):
+    file_plugin = 'tiff'
     image = Cpt(ImagePlugin, 'image1:')
     _default_configuration_attrs = (
         AreaDetector._default_configuration_attrs +
@@ -73,10 +321,11 @@ class EigerDetector(AreaDetector):
     def __init__(self, *args, md={}, **kwargs):
         super().__init__(*args, **kwargs)
         self.md = md
-        self.tiff.md = md
+        plugin = getattr(self, self.file_plugin)
+        plugin.md = md
         self.stage_sigs.update([('cam.trigger_mode', 'Internal Series')])
         self.stage_sigs.update([('cam.acquire_time', 1)])
-        self.tiff.stage_sigs.update([(self.proc.nd_array_port, self.trans1.port_name.get())])
+        plugin.stage_sigs.update([(self.proc.nd_array_port, self.trans1.port_name.get())])
 
         ''' ref. ophyd.areadetector.plugins.ImagePlugin '''
         self.image.shaped_image._shape = (self.image.array_size.height,
@@ -100,14 +349,222 @@ class EigerDetector(AreaDetector):
 
         return super().stage()
 
-class EigerStandard(SingleTrigger, EigerDetector):
+class EigerStandard(TriggerTiming, SingleTrigger, EigerDetector):
+    def trigger(self):
+        self.timing_start()
+        ''' the exposure time is applied at stage '''
+        self.timing_mark('set_exposure')
+        return SingleTrigger.trigger(self)
+
+class EigerSeries(EigerDetector):
+    '''
+        Eiger acquiring a series of series_frames frames per acquire, as a flyer.
+
+        kickoff starts one acquisition of cam.num_images frames in Internal
+        Series mode and returns at once, every frame (cam array counter
+        update) gets its own datum of the file plugin with the IOC timestamp.
+        complete finishes when all the frames have arrived. When the
+        acquisition stops first, the frames still in flight are waited for
+        series_settle_time seconds at most; the frames still missing then
+        are logged as a warning and counted in series_missing, the series
+        is reported as it is. collect_pages reports the frames
+        as one event page, so there is one RunEngine round trip per series
+        instead of per frame. A series must be collected before the next
+        kickoff, which waits series_settle_time at most for the previous
+        acquisition to end; unstage drops a series not collected.
+
+        :example:
+            eiger.series_frames.put(100)
+
+            @collect_stream_decorator()
+            def series(det, num_series=1):
+                yield from bps.open_run()
+                yield from bps.stage(det)
+                for _ in range(num_series):
+                    yield from bps.kickoff(det, wait=True)
+                    yield from bps.complete(det, wait=True)
+                    yield from bps.collect(det)
+                yield from bps.unstage(det)
+                yield from bps.close_run()
+    '''
+    _default_configuration_attrs = (
+        EigerDetector._default_configuration_attrs + ('series_frames',))
+    series_frames = Cpt(Signal, value=1, kind='config')
+    series_stream_name = 'primary'
+    series_settle_time = 1.0
+
+    def __init__(self, *args, image_name=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if image_name is None:
+            image_name = '_'.join([self.name, 'image'])
+        self._image_name = image_name
+        self._frame_name = '_'.join([self.name, 'frame'])
+        self.stage_sigs.update([('cam.acquire', 0), ('cam.image_mode', 1)])
+        self._series_lock = threading.Lock()
+        self._series_status = None
+        self._series_timer = None
+        self._series = None
+        self.series_missing = 0
+
+    def kickoff(self):
+        '''
+            start the acquisition of series_frames frames
+        '''
+        if self._staged != Staged.yes:
+            raise RuntimeError("This detector is not ready to kickoff. "
+                               "Call the stage() method before kickoff.")
+        with self._series_lock:
+            if self._series is not None:
+                raise RuntimeError(f"{self.name}: the last series is not collected yet. "
+                                   "Call the collect() method before the next kickoff.")
+        self._wait_acquire_idle(self.series_settle_time)
+        with self._series_lock:
+            num = int(self.series_frames.get())
+            self._series = dict(num=num, frames=[], times=[], datums=[])
+            self.series_missing = 0
+            self._series_status = DeviceStatus(self)
+        try:
+            self.put_if_changed('cam.num_images', num)
+        except Exception:
+            with self._series_lock:
+                self._series = self._series_status = None
+            raise
+        self.cam.array_counter.subscribe(self._series_frame, run=False)
+        self.cam.acquire.subscribe(self._series_acquire_changed, run=False)
+        self.cam.acquire.put(1, wait=False)
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
+    def _wait_acquire_idle(self, timeout):
+        '''
+            the last frame of a series may arrive before acquire drops,
+            wait for the previous acquisition to end before the next one
+        '''
+        idle = threading.Event()
+        def acquire_changed(value=None, **kwargs):
+            if value == 0:
+                idle.set()
+        cid = self.cam.acquire.subscribe(acquire_changed)
+        try:
+            if not idle.wait(timeout):
+                raise RuntimeError(f"{self.name}: still acquiring after {timeout} s, "
+                                   "cannot kickoff the next series")
+        finally:
+            self.cam.acquire.unsubscribe(cid)
+
+    def _series_frame(self, value=None, timestamp=None, **kwargs):
+        plugin = getattr(self, self.file_plugin)
+        with self._series_lock:
+            series = self._series
+            if self._series_status is None or len(series['frames']) >= series['num']:
+                return
+            timestamp = time.time() if timestamp is None else timestamp
+            series['frames'].append(value)
+            series['times'].append(timestamp)
+            series['datums'].append(plugin.generate_datum(self._image_name, timestamp, {}))
+            done = len(series['frames']) == series['num']
+        if done:
+            self._series_done()
+
+    def _series_acquire_changed(self, value=None, old_value=None, **kwargs):
+        if old_value == 1 and value == 0:
+            with self._series_lock:
+                series = self._series
+                if (self._series_status is None or self._series_timer is not None
+                        or len(series['frames']) >= series['num']):
+                    return
+                ''' the last frames may arrive after acquire drops '''
+                self._series_timer = threading.Timer(self.series_settle_time, self._series_done)
+                self._series_timer.daemon = True
+                self._series_timer.start()
+
+    def _series_done(self):
+        with self._series_lock:
+            status, self._series_status = self._series_status, None
+            if self._series_timer is not None:
+                self._series_timer.cancel()
+                self._series_timer = None
+            series = self._series
+            if status is not None and series is not None:
+                self.series_missing = series['num'] - len(series['frames'])
+        self.cam.array_counter.clear_sub(self._series_frame)
+        self.cam.acquire.clear_sub(self._series_acquire_changed)
+        if status is not None:
+            if self.series_missing:
+                logger.warning("%s: series of %d frames ended with %d frames missing",
+                               self.name, series['num'], self.series_missing)
+            status.set_finished()
+
+    def complete(self):
+        '''
+            :return: status finished when the series is done
+        '''
+        with self._series_lock:
+            status = self._series_status
+        if status is None:
+            status = DeviceStatus(self)
+            status.set_finished()
+        return status
+
+    def describe_collect(self):
+        plugin = getattr(self, self.file_plugin)
+        shape = [self.cam.array_size.array_size_y.get(), self.cam.array_size.array_size_x.get()]
+        return {self.series_stream_name: {
+                    self._image_name: dict(source=f'PV:{plugin.prefix}',
+                                           dtype='array', shape=shape, external='FILESTORE:'),
+                    self._frame_name: dict(source=f'PV:{self.cam.prefix}ArrayCounter_RBV',
+                                           dtype='integer', shape=[])}}
+
+    def collect_pages(self):
+        '''
+            one event page of the frames of the last series
+        '''
+        with self._series_lock:
+            series, self._series = self._series, None
+        if not series or not series['frames']:
+            return
+        t = list(series['times'])
+        yield dict(time=t,
+                   data={self._image_name: list(series['datums']),
+                         self._frame_name: list(series['frames'])},
+                   timestamps={self._image_name: t, self._frame_name: t})
+
+    def unstage(self):
+        self._series_done()
+        with self._series_lock:
+            self._series = None
+        return super().unstage()
+
+class EigerHDF5(EigerDetector):
+    '''
+        Eiger writing HDF5 files by XPDHDF5Plugin instead of TIFF files,
+        to be mixed in before the trigger classes, e.g. EigerHDF5Standard
+    '''
+    file_plugin = 'hdf5'
+    tiff = None
+    hdf5 = Cpt(XPDHDF5Plugin, 'HDF1:',
+               write_path_template='/a/b/c/',
+               read_path_template=None,
+               cam_name='cam',  # used to configure "tiff squashing"
+               proc_name='proc',  # ditto
+               read_attrs=[],
+               root=None,
+               path_semantics='posix',
+               )
+
+class EigerHDF5Standard(EigerHDF5, EigerStandard):
+    pass
+
+class EigerHDF5Series(EigerHDF5, EigerSeries):
     pass
 
 '''
     PerkinElmer Detector
 '''
 from ophyd.areadetector import PerkinElmerDetector
-class XPDPerkinElmer(PerkinElmerDetector):
+class XPDPerkinElmer(TrackedPuts, PerkinElmerDetector):
+    file_plugin = 'tiff'
     image = Cpt(ImagePlugin, 'image1:')
     _default_configuration_attrs = (
         PerkinElmerDetector._default_configuration_attrs +
@@ -156,10 +613,11 @@ class XPDPerkinElmer(PerkinElmerDetector):
     def __init__(self, *args, md={}, **kwargs):
         super().__init__(*args, **kwargs)
         self.md = md
-        self.tiff.md = md
+        plugin = getattr(self, self.file_plugin)
+        plugin.md = md
         self.stage_sigs.update([('cam.trigger_mode', 'Internal')])
         self.stage_sigs.update([('cam.acquire_time', 1)])
-        self.tiff.stage_sigs.update([(self.proc.nd_array_port, self.trans1.port_name.get())])
+        plugin.stage_sigs.update([(self.proc.nd_array_port, self.trans1.port_name.get())])
 
     def stage(self):
         exp_time_sig_name = 'cam.acquire_time'
@@ -173,19 +631,45 @@ class XPDPerkinElmer(PerkinElmerDetector):
         return super().stage()
 
 class PerkinElmerTrigger:
-    def trigger(self):
-        ''' set exposure time again '''
+    def trigger(self, force=None):
+        ''' set exposure time again, only if it is not the last value applied '''
         acq_time_key = 'cam.acquire_time'
         if acq_time_key in self.stage_sigs:
-            self.cam.acquire_time._set_and_wait(self.stage_sigs[acq_time_key], 3.0)
+            self.put_if_changed(acq_time_key, self.stage_sigs[acq_time_key], 3.0, force=force)
 
-class PerkinElmerStandard(SingleTrigger, XPDPerkinElmer, PerkinElmerTrigger):
+class PerkinElmerStandard(TriggerTiming, SingleTrigger, XPDPerkinElmer, PerkinElmerTrigger):
     def trigger(self):
+        self.timing_start()
         PerkinElmerTrigger.trigger(self)
+        self.timing_mark('set_exposure')
         return SingleTrigger.trigger(self)
 
-class PerkinElmerMulti(MultiTrigger, XPDPerkinElmer):
+class PerkinElmerMulti(TriggerTiming, MultiTrigger, XPDPerkinElmer, PerkinElmerTrigger):
     def trigger(self):
+        self.timing_start()
         PerkinElmerTrigger.trigger(self)
+        self.timing_mark('set_exposure')
         return MultiTrigger.trigger(self)
 
+class PerkinElmerHDF5(XPDPerkinElmer):
+    '''
+        PerkinElmer writing HDF5 files by XPDHDF5Plugin instead of TIFF files,
+        to be mixed in before the trigger classes, e.g. PerkinElmerHDF5Standard
+    '''
+    file_plugin = 'hdf5'
+    tiff = None
+    hdf5 = Cpt(XPDHDF5Plugin, 'HDF1:',
+               write_path_template='/a/b/c/',
+               read_path_template=None,
+               cam_name='cam',  # used to configure "tiff squashing"
+               proc_name='proc',  # ditto
+               read_attrs=[],
+               root=f'/blsw/19a/data/commission/',
+               path_semantics='windows',
+               )
+
+class PerkinElmerHDF5Standard(PerkinElmerHDF5, PerkinElmerStandard):
+    pass
+
+class PerkinElmerHDF5Multi(PerkinElmerHDF5, PerkinElmerMulti):
+    pass
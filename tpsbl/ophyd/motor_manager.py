@@ -1,17 +1,178 @@
 from ophyd import Device
 from ophyd import Component as Cpt
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import reduce
+import threading
+import time
+import os
+import numpy as np
+
+class MotorSnapshot:
+    '''
+        Positions of motors at one time, array-backed.
+
+        :param names: dotted names of the motors
+        :param values: positions, nan where the motor could not be read
+        :param connected: bool per motor, False where it could not be read
+        :param time: unix time of the snapshot
+    '''
+    def __init__(self, names, values, connected=None, time=None):
+        self.names = np.asarray(names, dtype=str)
+        self.values = np.asarray(values, dtype=float)
+        self.connected = (np.isfinite(self.values) if connected is None
+                          else np.asarray(connected, dtype=bool))
+        self.time = time
+        self._index = {name: i for i, name in enumerate(self.names.tolist())}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        return self.values[self._index[name]]
+
+    def as_dict(self):
+        return dict(zip(self.names.tolist(), self.values.tolist()))
+
+    def _tolerances(self, names, tol):
+        '''
+            :param tol: a number or {dotted name: tolerance}, 0 for missing names
+        '''
+        if isinstance(tol, dict):
+            return np.array([tol.get(name, 0.0) for name in names], dtype=float)
+        return np.full(len(names), float(tol))
+
+    def diff(self, other, tol=0.0):
+        '''
+            motors whose positions differ by more than tol between self and other,
+            only the motors in both snapshots and connected in both are compared
+
+            :param tol: a number or {dotted name: tolerance}
+            :return: {dotted name: (self value, other value)}
+        '''
+        common = [name for name in self.names.tolist() if name in other._index]
+        i = np.array([self._index[name] for name in common], dtype=int)
+        j = np.array([other._index[name] for name in common], dtype=int)
+        a, b = self.values[i], other.values[j]
+        changed = ((np.abs(a - b) > self._tolerances(common, tol))
+                   & self.connected[i] & other.connected[j])
+        return {common[k]: (a[k], b[k]) for k in np.flatnonzero(changed)}
+
+    @staticmethod
+    def _npz_path(path):
+        '''
+            np.savez appends .npz to a path without it, np.load does not
+        '''
+        path = os.fspath(path)
+        return path if path.endswith('.npz') else path + '.npz'
+
+    def save(self, path):
+        '''
+            :return: the path written, with the .npz suffix
+        '''
+        path = self._npz_path(path)
+        np.savez(path, names=self.names, values=self.values, connected=self.connected,
+                 time=np.nan if self.time is None else self.time)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        '''
+            :param path: path given to or returned by save
+        '''
+        with np.load(cls._npz_path(path)) as f:
+            t = float(f['time'])
+            return cls(f['names'], f['values'], f['connected'], None if np.isnan(t) else t)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} motors, time={self.time})'
 
 class MotorManager(Device):
-    motors = []
-    def __init__(self, *args, fstr_width=10, fstr_prec=5, connection_timeout=0.1, **kwargs):
+    def __init__(self, *args, fstr_width=10, fstr_prec=5, connection_timeout=0.1,
+                 readout_timeout=1.0, readout_workers=32, stale_after=60.0, monitor=True, **kwargs):
+        '''
+        :param connection_timeout: connection timeout of each motor readout
+        :param readout_timeout: overall deadline of motors_val, the motors
+                                not read by then are reported as 'timeout'
+        :param readout_workers: threads reading the motors concurrently
+        :param stale_after: seconds without monitor update or successful read
+                            after which show_all marks a position as stale, the
+                            motors are read again every stale_after/2 seconds in
+                            the background so an idle motor is not stale;
+                            only disconnected motors if None
+        :param monitor: subscribe to the motors as they are registered, else
+                        at the first monitor_motors (e.g. the first show_all)
+        '''
+        ''' motors register themselves while Device.__init__ creates the components '''
+        self._motors = {}
         Device.__init__(self, *args, **kwargs)
         self.fstr_width = fstr_width
         self.fstr_prec = fstr_prec
-        self.connection_timeout = connection_timeout
+        ''' Device.connection_timeout is a read-only property of ophyd '''
+        self.readout_connection_timeout = connection_timeout
+        self.readout_timeout = readout_timeout
+        self.readout_workers = readout_workers
+        self._readout_executor = None
+        self._readout_lock = threading.Lock()
+        self.stale_after = stale_after
+        self._monitored = {}
+        self._position_cache = {}
+        self._revalidation_timer = None
+        self._monitor = monitor
+        if monitor:
+            self.monitor_motors()
+
+    @property
+    def motors(self):
+        return list(self._motors.values())
 
     def add_motor(self, motor):
-        self.motors.append(motor)
+        '''
+            register a motor by its dotted name, registering again replaces it
+        '''
+        self._motors[motor.dotted_name] = motor
+        if getattr(self, '_monitor', False):
+            ''' registered after __init__ '''
+            self._monitor_motor(motor)
+
+    def get_motor(self, dotted_name):
+        return self._motors[dotted_name]
+
+    def snapshot(self, timeout=None):
+        '''
+            read all motors concurrently into a MotorSnapshot
+            :param timeout: see read_motors
+        '''
+        t = time.time()
+        values, status = self.read_motors(timeout)
+        names = list(status)
+        return MotorSnapshot(names, [values.get(name, np.nan) for name in names],
+                             [status[name] == 'ok' for name in names], t)
+
+    def restore(self, snapshot, tol=0.0, names=None, timeout=None):
+        '''
+            move the motors back to the positions of snapshot, all at once
+
+            only the registered and connected motors differing by more than tol
+            from their current positions are moved
+            :param tol: a number or {dotted name: tolerance}
+            :param names: restore only these dotted names
+            :param timeout: of the current positions readout, see read_motors
+            :return: combined status of all the moves
+        '''
+        from ophyd.status import AndStatus, Status
+        current = self.snapshot(timeout)
+        moves = {name: value for name, (value, _) in snapshot.diff(current, tol).items()
+                 if name in self._motors and (names is None or name in names)}
+        statuses = [self._motors[name].set(value) for name, value in moves.items()]
+        if not statuses:
+            status = Status()
+            status.set_finished()
+            return status
+        return reduce(AndStatus, statuses)
 
     #deprecated
     def get_object_ref_name(self, obj):
@@ -28,27 +189,169 @@ class MotorManager(Device):
             ref_name = f"{self.get_object_ref_name(obj.parent)}.{last_dotted_name}"
         return ref_name
 
-    @property
-    def motors_val(self):
-        motors_val = {}
+    @staticmethod
+    def motor_signals(motor):
+        '''
+            :return: (setpoint, readback) signals,
+                     user_setpoint/user_readback of an EpicsMotor,
+                     setpoint/readback of an ophyd.sim SynAxis
+        '''
+        if hasattr(motor, 'user_setpoint'):
+            return motor.user_setpoint, motor.user_readback
+        return motor.setpoint, motor.readback
+
+    def read_setpoint(self, motor):
+        setpoint, readback = self.motor_signals(motor)
+        if hasattr(motor, 'user_setpoint'):
+            return setpoint.get(connection_timeout=self.readout_connection_timeout)
+        return setpoint.get()
+
+    def monitor_motors(self):
+        '''
+            subscribe once to the setpoint and readback of every motor,
+            the motors added since the last call are subscribed as well
+
+            :return: the position cache, {dotted name: {'setpoint', 'readback',
+                     'timestamp', 'checked'}}, checked is the time.time() of the
+                     last monitor update or successful read
+        '''
         for motor in self.motors:
-            try:
-                # motor_ref_name = self.get_object_ref_name(motor)
-                motor_ref_name = motor.dotted_name
-                motors_val[f'{motor_ref_name}'] = motor.user_setpoint.get(connection_timeout=self.connection_timeout)
+            self._monitor_motor(motor)
+        return self._position_cache
+
+    def _monitor_motor(self, motor):
+        motor_ref_name = motor.dotted_name
+        signals = self.motor_signals(motor)
+        with self._readout_lock:
+            monitored = self._monitored.get(motor_ref_name)
+            if monitored is not None:
+                if monitored[0] == signals:
+                    return
+                ''' registered again, replaced '''
+                for signal, cid in zip(*monitored):
+                    signal.unsubscribe(cid)
+            entry = dict(setpoint=None, readback=None, timestamp=None, checked=None)
+            self._position_cache[motor_ref_name] = entry
+            cids = []
+            for key, signal in zip(('setpoint', 'readback'), signals):
+                def update(value=None, timestamp=None, entry=entry, key=key, **kwargs):
+                    entry[key] = value
+                    entry['timestamp'] = timestamp
+                    entry['checked'] = time.time()
+                cids.append(signal.subscribe(update, run=True))
+            self._monitored[motor_ref_name] = (signals, cids)
+        self._schedule_revalidation()
+
+    def _schedule_revalidation(self):
+        '''
+            read the motors again every stale_after/2 seconds (1 s at least),
+            a monitor is only updated when the value changes
+        '''
+        with self._readout_lock:
+            if self.stale_after is None or self._revalidation_timer is not None:
+                return
+            def revalidate():
+                try:
+                    self.revalidate()
+                finally:
+                    with self._readout_lock:
+                        self._revalidation_timer = None
+                    self._schedule_revalidation()
+            self._revalidation_timer = threading.Timer(max(self.stale_after/2, 1.0), revalidate)
+            self._revalidation_timer.daemon = True
+            self._revalidation_timer.start()
 
-            except Exception as e:
-                print(e)
+    def revalidate(self, timeout=None):
+        '''
+            read all motors, a successful read refreshes the checked time of
+            its position cache entry
+            :param timeout: see read_motors
+        '''
+        values, status = self.read_motors(timeout)
+        now = time.time()
+        for motor_ref_name in values:
+            entry = self._position_cache.get(motor_ref_name)
+            if entry is not None:
+                entry['checked'] = now
+
+    def cached_motors_val(self, now=None):
+        '''
+            :return: (values, stale) from the position cache, stale holds the
+                     motors disconnected, never updated or neither updated nor
+                     read within stale_after seconds
+        '''
+        cache = self.monitor_motors()
+        now = time.time() if now is None else now
+        values, stale = {}, set()
+        for motor_ref_name, entry in list(cache.items()):
+            value = entry['setpoint'] if entry['setpoint'] is not None else entry['readback']
+            values[motor_ref_name] = value
+            (setpoint, _), _ = self._monitored[motor_ref_name]
+            if (value is None or not setpoint.connected
+                    or (self.stale_after is not None
+                        and now - (entry['checked'] or 0) > self.stale_after)):
+                stale.add(motor_ref_name)
+        return values, stale
+
+    @property
+    def readout_executor(self):
+        with self._readout_lock:
+            if self._readout_executor is None:
+                self._readout_executor = ThreadPoolExecutor(max_workers=self.readout_workers,
+                                                            thread_name_prefix='MotorManager')
+            return self._readout_executor
+
+    def read_motors(self, timeout=None):
+        '''
+            read all motors concurrently, so offline motors wait for their
+            connection timeouts in parallel instead of one after the other
+
+            :param timeout: overall deadline in seconds, readout_timeout if None
+            :return: (values, status) dicts by dotted name,
+                     status is 'ok', 'timeout' or the repr of the exception,
+                     values only holds the motors read successfully
+        '''
+        timeout = self.readout_timeout if timeout is None else timeout
+        futures = {self.readout_executor.submit(self.read_setpoint, motor): motor.dotted_name
+                   for motor in self.motors}
+        done, not_done = wait(futures, timeout=timeout)
+        values, status = {}, {}
+        for future, motor_ref_name in futures.items():
+            if future in not_done:
+                future.cancel()
+                status[motor_ref_name] = 'timeout'
+            elif future.exception() is not None:
+                status[motor_ref_name] = repr(future.exception())
+            else:
+                values[motor_ref_name] = future.result()
+                status[motor_ref_name] = 'ok'
+        return values, status
+
+    @property
+    def motors_val(self):
+        motors_val, status = self.read_motors()
+        for motor_ref_name, st in status.items():
+            if st != 'ok':
+                print(f'{motor_ref_name}: {st}')
         return motors_val
 
-    def show_all(self):
-        import cmd
-        import os
+    def show_all(self, cached=True):
+        '''
+            :param cached: render from the monitor-backed position cache,
+                           stale positions are marked with *, unknown ones with ?,
+                           read all motors again if False
+        '''
+        import shutil
         from more_itertools import grouper
-        motors_val = self.motors_val
-        rows, columns = os.popen('stty size', 'r').read().split()
+        if cached:
+            motors_val, stale = self.cached_motors_val()
+        else:
+            motors_val, stale = self.motors_val, set()
+        if not motors_val:
+            return
+        columns = shutil.get_terminal_size().columns
         field_len = max(max([len(name) for name in motors_val.keys()])+1,self.fstr_width)
-        fields_per_line = int(int(columns)/field_len)
+        fields_per_line = max(1, int(columns/field_len))
         data_group = grouper(motors_val, fields_per_line)
         for dg in data_group:
             for data_key in dg:
@@ -57,7 +360,13 @@ class MotorManager(Device):
             print('')
             for data_key in dg:
                 if data_key:
-                    print(f"{motors_val[data_key]:{field_len}.{self.fstr_prec}f}", end='')
+                    val = motors_val[data_key]
+                    if val is None:
+                        print(f"{'?':>{field_len}s}", end='')
+                    elif data_key in stale:
+                        print(f"{val:{field_len-1}.{self.fstr_prec}f}*", end='')
+                    else:
+                        print(f"{val:{field_len}.{self.fstr_prec}f}", end='')
             print('')
             print('')
 
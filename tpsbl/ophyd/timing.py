@@ -0,0 +1,55 @@
+import time
+import numpy as np
+
+class TimingRing:
+    '''
+        Ring buffer of the time.monotonic() marks of the last size triggers,
+        one row per trigger, one column per mark, nan for a mark not seen.
+
+        :param marks: names of the marks, the first one is set by start
+        :param size: rows kept
+
+        :example:
+            ring = TimingRing(('put', 'start', 'done'))
+            ring.start()
+            ring.mark('done')
+            put, start, done = ring.times().T
+    '''
+    def __init__(self, marks, size=10000):
+        self.marks = tuple(marks)
+        self._times = np.full((size, len(self.marks)), np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, len(self._times))
+
+    def start(self):
+        ''' a new row, its first mark set now, the oldest row is dropped when full '''
+        row = self._times[self.count % len(self._times)]
+        row[:] = np.nan
+        row[0] = time.monotonic()
+        self.count += 1
+
+    def mark(self, name):
+        ''' set the mark of the current row now, only its first time '''
+        if self.count == 0:
+            return
+        row = self._times[(self.count - 1) % len(self._times)]
+        column = self.marks.index(name)
+        if np.isnan(row[column]):
+            row[column] = time.monotonic()
+
+    def times(self):
+        '''
+        :return: (len(self), len(marks)) array of the marks, the oldest row first
+        '''
+        rows = np.arange(self.count - len(self), self.count) % len(self._times)
+        return self._times[rows]
+
+    @staticmethod
+    def histogram(values, bins=20):
+        '''
+        :return: np.histogram of the finite values
+        '''
+        values = np.asarray(values)
+        return np.histogram(values[np.isfinite(values)], bins=bins)
@@ -1,7 +1,10 @@
 from collections import OrderedDict
 from ophyd import (EpicsSignalRO, EpicsSignal, Component as Cpt,
-               DynamicDeviceComponent as DDCpt, Device)
+               DynamicDeviceComponent as DDCpt, Device, Kind)
 from ophyd.device import DeviceStatus
+from tpsbl.ophyd.timing import TimingRing
+import threading
+import numpy as np
 
 def _chan_fields(attr_base, field_base, range_):
     defn = OrderedDict()
@@ -20,12 +23,181 @@ class TsujiCounter(Device):
     stop_mode = Cpt(EpicsSignalRO, 'MOD:STOPMODE', kind='config', string=True)
     rdal = Cpt(EpicsSignalRO, 'RDAL', kind='normal', auto_monitor=True)
 
-    def __init__(self, *args, md={}, **kwargs):
+    def __init__(self, *args, md={}, read_mode='channels', **kwargs):
+        '''
+        :param read_mode: 'channels' reads each selected RDAL:CHn signal,
+                          'rdal' decodes all the selected channels from one fetch
+                          of the RDAL waveform, with the same keys and kinds
+        '''
         self.md = md
+        self.read_mode = read_mode
         Device.__init__(self, *args, **kwargs)
 
+    @property
+    def rdal_indexes(self):
+        '''
+        position of each channel in the RDAL waveform, see _rdal_indexes
+        '''
+        return self._rdal_indexes(len(self.rdal.get()))
+
+    def _rdal_indexes(self, length):
+        '''
+        RDAL holds CH0, CH1, ... of all the counters of the hardware, then
+        CHT, which can be more counters than the chN fields of the class:
+        CHn is at n, CHT is the last element of a waveform of length.
+        '''
+        names = self.channels.component_names
+        length = length or len(names)
+        return {name: length - 1 if name == 'cht' else int(name[2:]) for name in names}
+
+    def _rdal_mode(self, method, rdal_entry, channel_entry, indexes):
+        '''
+        compose read() or describe() in the 'rdal' read mode,
+        channel_entry(signal, index) replaces method() of the selected channels
+        '''
+        res = OrderedDict()
+        for cpt_name in self.component_names:
+            cpt = getattr(self, cpt_name)
+            if not cpt.kind & Kind.normal:
+                continue
+            if cpt_name == 'rdal':
+                res[cpt.name] = rdal_entry
+            elif cpt_name == 'channels':
+                for ch_dname, index in indexes.items():
+                    signal = getattr(self.channels, ch_dname)
+                    if signal.kind & Kind.normal:
+                        res[signal.name] = channel_entry(signal, index)
+            else:
+                res.update(getattr(cpt, method)())
+        return res
+
+    def read(self):
+        if self.read_mode != 'rdal':
+            return super().read()
+
+        ''' one fresh fetch of the waveform, not the last monitor update '''
+        waveform = self.rdal.get(use_monitor=False)
+        timestamp = self.rdal.timestamp
+        def channel_entry(signal, index):
+            value = waveform[index]
+            return dict(value=value.item() if hasattr(value, 'item') else value, timestamp=timestamp)
+        return self._rdal_mode('read', dict(value=waveform, timestamp=timestamp), channel_entry,
+                               self._rdal_indexes(len(waveform)))
+
+    def describe(self):
+        if self.read_mode != 'rdal':
+            return super().describe()
+
+        rdal = self.rdal.describe()[self.rdal.name]
+        def channel_entry(signal, index):
+            return dict(source=f"{rdal['source']}[{index}]", dtype='number', shape=[])
+        return self._rdal_mode('describe', rdal, channel_entry, self.rdal_indexes)
+
+    '''
+        fly mode
+
+        In non-stop mode the counter updates RDAL at its own rate. Between
+        kickoff and complete every RDAL monitor update is copied with its
+        timestamp into a preallocated ring buffer of fly_buffer_size rows,
+        collect_pages then emits the selected channels as event pages of
+        up to fly_page_size events. The channels are located in RDAL at
+        kickoff, see rdal_indexes. When the ring buffer wraps around, the
+        oldest updates are dropped and counted in fly_dropped.
+
+        :example:
+            @collect_stream_decorator()
+            def fly(tc, motor, stop):
+                yield from bps.open_run()
+                yield from bps.kickoff(tc, wait=True)
+                yield from bps.mv(motor, stop)
+                yield from bps.complete(tc, wait=True)
+                yield from bps.collect(tc)
+                yield from bps.close_run()
+    '''
+    fly_buffer_size = 100000
+    fly_page_size = 1000
+    fly_stream_name = 'primary'
+
+    def _fly_keys(self, indexes=None):
+        '''
+            :return: [(data key, index in the RDAL waveform)] of the selected channels
+        '''
+        indexes = self.rdal_indexes if indexes is None else indexes
+        return [(getattr(self.channels, ch_dname).name, index)
+                for ch_dname, index in indexes.items()
+                if getattr(self.channels, ch_dname).kind & Kind.normal]
+
+    def _on_rdal(self, value=None, timestamp=None, **kwargs):
+        with self._fly_lock:
+            i = self._fly_count % len(self._fly_times)
+            columns = self._fly_indexes < len(value)
+            self._fly_values[i] = np.nan
+            self._fly_values[i, columns] = np.asarray(value)[self._fly_indexes[columns]]
+            self._fly_times[i] = timestamp
+            self._fly_count += 1
+
+    def kickoff(self):
+        '''
+            start buffering the RDAL monitor updates
+        '''
+        self._fly_lock = threading.Lock()
+        ''' one column per channel, the RDAL indexes of the columns '''
+        self._fly_channels = self.rdal_indexes
+        self._fly_indexes = np.array(list(self._fly_channels.values()))
+        self._fly_values = np.full((self.fly_buffer_size, len(self._fly_indexes)), np.nan)
+        self._fly_times = np.empty(self.fly_buffer_size)
+        self._fly_count = 0
+        self._fly_collected = 0
+        self.fly_dropped = 0
+        self._fly_cid = self.rdal.subscribe(self._on_rdal, run=False)
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
+    def complete(self):
+        '''
+            stop buffering, the counter itself keeps counting
+        '''
+        if getattr(self, '_fly_cid', None) is not None:
+            self.rdal.unsubscribe(self._fly_cid)
+            self._fly_cid = None
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
+    def describe_collect(self):
+        rdal = self.rdal.describe()[self.rdal.name]
+        return {self.fly_stream_name: {key: dict(source=f"{rdal['source']}[{index}]",
+                                                 dtype='number', shape=[])
+                                       for key, index in self._fly_keys(getattr(self, '_fly_channels', None))}}
+
+    def collect_pages(self):
+        '''
+            event pages of the updates buffered since the last collect
+        '''
+        keys = self._fly_keys(self._fly_channels)
+        columns = [j for j, ch_dname in enumerate(self._fly_channels)
+                   if getattr(self.channels, ch_dname).kind & Kind.normal]
+        with self._fly_lock:
+            count = self._fly_count
+            size = len(self._fly_times)
+            first = max(self._fly_collected, count - size)
+            self.fly_dropped += first - self._fly_collected
+            rows = np.arange(first, count) % size
+            values = self._fly_values[rows][:, columns]
+            times = self._fly_times[rows]
+            self._fly_collected = count
+        for start in range(0, len(rows), self.fly_page_size):
+            stop = start + self.fly_page_size
+            t = times[start:stop].tolist()
+            yield dict(time=t,
+                       data={key: values[start:stop, j].tolist() for j, (key, index) in enumerate(keys)},
+                       timestamps={key: t for key, index in keys})
+
     def stage(self):
-        if self.stop_mode.get() == 'N':
+        ''' the configuration is read once here, not at every trigger '''
+        self._stop_mode = self.stop_mode.get()
+        if self._stop_mode == 'N':
             ''' non-stop mode '''
             self.clear_and_start.set(1)
         else:
@@ -41,11 +213,17 @@ class TsujiCounter(Device):
             if exp_time_sig_name in self.stage_sigs:
                 del self.stage_sigs[exp_time_sig_name]
 
-        return super().stage()
+        devices = super().stage()
+        if self._stop_mode != 'N':
+            ''' watched once staged, nothing is left subscribed if stage fails '''
+            self._watch_done()
+        return devices
 
     def unstage(self):
-        if self.stop_mode.get() == 'N':
+        if self._current_stop_mode() == 'N':
             self.stop_counting.set(1)
+        self._unwatch_done()
+        self._stop_mode = None
 
         return super().unstage()
 
@@ -68,33 +246,104 @@ class TsujiCounter(Device):
         st = self.counting_time.set(val)
         st.wait()
 
+    '''
+        trigger path
+
+        One persistent watcher of done, subscribed at stage, completes the
+        status of the current trigger on the falling edge, so nothing is
+        subscribed per point. A trigger of an unstaged counter subscribes a
+        watcher which removes itself on that falling edge. Every trigger
+        records the times of the put, the rising edge (counting started)
+        and the falling edge (done).
+    '''
+    _stop_mode = None
+    _timing = None
+    _done_cid = None
+    _done_once = False
+    _trigger_status = None
+    trigger_timing_size = 10000
+
+    def _current_stop_mode(self):
+        return self.stop_mode.get() if self._stop_mode is None else self._stop_mode
+
+    def _watch_done(self, once=False):
+        '''
+        :param once: watch only the current trigger, the timing is kept
+        '''
+        if self._done_cid is None:
+            if not once or self._timing is None:
+                self._timing = TimingRing(('put', 'start', 'done'), self.trigger_timing_size)
+            self._done_once = once
+            self._done_cid = self.done.subscribe(self._on_done, run=False)
+        elif not once:
+            ''' staged while an unstaged trigger is counting '''
+            self._done_once = False
+
+    def _unwatch_done(self):
+        if self._done_cid is not None:
+            self.done.unsubscribe(self._done_cid)
+            self._done_cid = None
+        if self._trigger_status is not None and not self._trigger_status.done:
+            self._trigger_status.set_exception(RuntimeError(f'{self.name} unstaged while counting'))
+        self._trigger_status = None
+
+    def _on_done(self, old_value=None, value=None, timestamp=None, **kwargs):
+        status = self._trigger_status
+        if status is None:
+            return
+        if old_value == 0 and value == 1:
+            self._timing.mark('start')
+        elif old_value == 1 and value == 0:
+            self._timing.mark('done')
+            self._trigger_status = None
+            if self._done_once:
+                self.done.unsubscribe(self._done_cid)
+                self._done_cid = None
+            status.set_finished()
+
     def trigger(self):
         """
         Trigger the detector and return a Status object.
         """
         status = DeviceStatus(self)
 
-        # Wire up a callback that will mark the status object as finished
-        # when we see the state flip from "acquiring" to "not acquiring"---
-        # that is, a negative edge.
-        def callback(old_value, value, **kwargs):
-            if old_value == 1 and value == 0:
-                status._finished()
-                self.done.clear_sub(callback)
-
-        if self.stop_mode.get() == 'N':
+        if self._current_stop_mode() == 'N':
             # doesn't need to set clear_and_start signal
-            status._finished()
-        else:
-            self.done.subscribe(callback)
-            # Now 'put' 1 to the clear_and_start signal.
-            self.clear_and_start.set(1)
+            status.set_finished()
+            return status
 
+        if self._done_cid is None:
+            ''' not staged '''
+            self._watch_done(once=True)
+        self._trigger_status = status
+        self._timing.start()
+        # Now 'put' 1 to the clear_and_start signal,
+        # the watcher finishes the status on the falling edge of done.
+        self.clear_and_start.set(1)
 
         # And return the Status object, which the caller can use to
         # tell when the action is complete.
         return status
 
+    @property
+    def trigger_timing(self):
+        '''
+        :return: (triggers, 3) array of the last trigger_timing_size triggers,
+                 seconds put->start, start->done, put->done, nan if not seen
+        '''
+        if self._timing is None:
+            return np.empty((0, 3))
+        put, start, done = self._timing.times().T
+        return np.column_stack([start - put, done - start, done - put])
+
+    def trigger_histogram(self, bins=20, phase='total'):
+        '''
+        :param phase: 'start' put->start, 'count' start->done, 'total' put->done
+        :return: np.histogram of the trigger timing in seconds
+        '''
+        column = dict(start=0, count=1, total=2)[phase]
+        return TimingRing.histogram(self.trigger_timing[:, column], bins)
+
     def select_channels(self, chan_indexs=None, kind='hinted', verbose=False):
         '''
         Select channels based on channel index (0-based)
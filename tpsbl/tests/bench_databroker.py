@@ -0,0 +1,63 @@
+'''
+    sidecar index of a directory of msgpack runs:
+    first update, no-op update and search against reading every start document,
+    lazy MsgpackRun access against decoding a whole run
+
+    python -m tpsbl.tests.bench_databroker
+'''
+import time
+import tempfile
+from pathlib import Path
+from tpsbl.databroker.index import RunIndex, read_start_stop, scan_msgpack_dir
+from tpsbl.databroker.reader import MsgpackRun
+from tpsbl.databroker.utils import _msgpack_gen
+from tpsbl.tests.test_databroker import write_run
+
+def bench_index(num_runs, num_events=200):
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(num_runs):
+            write_run(Path(directory), num_events=num_events, scan_id=i,
+                      plan_name='scan', sample_name=f'sample{i % 10}')
+        res = {}
+        t0 = time.perf_counter()
+        for path in scan_msgpack_dir(directory):
+            read_start_stop(path)
+        res['read all'] = time.perf_counter() - t0
+        with RunIndex(directory) as index:
+            t0 = time.perf_counter()
+            index.update()
+            res['first update'] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            index.update()
+            res['no-op update'] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            index.search(sample_name='sample3', scan_id=(0, num_runs//2))
+            res['search'] = time.perf_counter() - t0
+        return res
+
+def bench_reader(num_events):
+    with tempfile.TemporaryDirectory() as directory:
+        start, path = write_run(Path(directory), num_events=num_events)
+        res = {}
+        t0 = time.perf_counter()
+        list(_msgpack_gen(path))
+        res['decode all'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        run = MsgpackRun(path)
+        res['offsets'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        run.start, run.stop
+        res['start/stop'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        list(run.events(limit=10))
+        res['first 10 events'] = time.perf_counter() - t0
+        return res
+
+if __name__ == '__main__':
+    for num_runs in (100, 1000):
+        for step, elapsed in bench_index(num_runs).items():
+            print(f"{num_runs:>6d} runs {step:>14s}{elapsed:>10.4f} s")
+
+    for num_events in (10000, 100000):
+        for step, elapsed in bench_reader(num_events).items():
+            print(f"{num_events:>6d} events {step:>16s}{elapsed:>10.4f} s")
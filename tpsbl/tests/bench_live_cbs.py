@@ -0,0 +1,118 @@
+'''
+    total fitting cost of LiveEdgeFit over an edge scan,
+    closed-form estimators against the final lmfit fits,
+    one LiveMultiFit against a LiveFit per channel
+
+    python -m tpsbl.tests.bench_live_cbs
+'''
+import time
+import numpy as np
+from scipy import special
+from lmfit.models import GaussianModel
+from bluesky.callbacks.fitting import LiveFit
+from tpsbl.bluesky.callbacks.live_cbs import LiveEdgeFit, LiveMultiFit, ESTIMATORS
+
+def bench_edge_fit(num_points, update_every):
+    rng = np.random.default_rng(0)
+    x = np.linspace(-5, 5, num_points)
+    y = 10*(special.erf(x)+1) + rng.uniform(-0.1, 0.1, num_points)
+    lef = LiveEdgeFit(GaussianModel(), 'det', {'x':'motor'}, update_every=update_every)
+    lef.start({'uid':'bench', 'time':0})
+    t0 = time.perf_counter()
+    for xi, yi in zip(x, y):
+        lef.event({'data':{'det':yi, 'motor':xi}})
+    lef.stop({'uid':'bench-stop', 'run_start':'bench', 'time':0, 'exit_status':'success'})
+    return time.perf_counter() - t0, lef.result.params['center'].value
+
+def bench_estimators(num_points, repeat=20):
+    '''
+        :return: {method: (seconds per estimate, pos)} on a noisy peak at 0.3
+                 and a noisy edge at 0
+    '''
+    rng = np.random.default_rng(0)
+    x = np.linspace(-5, 5, num_points)
+    peak = 10*np.exp(-(x-0.3)**2/(2*0.8**2)) + rng.uniform(-0.1, 0.1, num_points)
+    edge = 10*(special.erf(x)+1) + rng.uniform(-0.1, 0.1, num_points)
+    def fit(x, y):
+        model = GaussianModel()
+        return {'pos': model.fit(y, model.guess(y, x=x), x=x).params['center'].value}
+    def edgefit(x, y):
+        lef = LiveEdgeFit(GaussianModel(), 'det', {'x':'motor'})
+        lef._x, lef._y, lef._num_points = x, y, len(x)
+        lef.update_fit()
+        return {'pos': lef.result.params['center'].value}
+    methods = dict(ESTIMATORS, fit=fit, edgefit=edgefit)
+    res = {}
+    for method, estimator in methods.items():
+        y = edge if method in ('derivative', 'edgefit') else peak
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            pos = estimator(x, y)['pos']
+        res[method] = ((time.perf_counter() - t0)/repeat, pos)
+    return res
+
+def bench_multi_fit(num_channels, num_points=101, update_every=10):
+    '''
+        :return: (LiveMultiFit seconds, LiveFit per channel seconds) over a scan
+    '''
+    rng = np.random.default_rng(0)
+    x = np.linspace(-5, 5, num_points)
+    centers = np.linspace(-2, 2, num_channels)
+    Y = 10*np.exp(-(x[:,None]-centers)**2/2) + rng.uniform(-0.1, 0.1, (num_points, num_channels))
+    names = [f'ch{i}' for i in range(num_channels)]
+    start = {'uid':'bench', 'time':0}
+    stop = {'uid':'bench-stop', 'run_start':'bench', 'time':0, 'exit_status':'success'}
+    def run(cbs):
+        for cb in cbs:
+            cb.start(start)
+        t0 = time.perf_counter()
+        for xi, yi in zip(x, Y):
+            event = {'data':dict(zip(names, yi), motor=xi)}
+            for cb in cbs:
+                cb.event(event)
+        for cb in cbs:
+            cb.stop(stop)
+        return time.perf_counter() - t0
+    multi = run([LiveMultiFit('motor', names, update_every=update_every, verbose=False)])
+    single = run([LiveFit(GaussianModel(), name, {'x':'motor'}, update_every=update_every) for name in names])
+    return multi, single
+
+def edge_fit_scaling(num_points=(250, 1000), update_every=1, refit_growth=1.05):
+    '''
+        :return: exponent p of the total fitting cost ~ points**p
+    '''
+    def bench(n):
+        rng = np.random.default_rng(0)
+        x = np.linspace(-5, 5, n)
+        y = 10*(special.erf(x)+1) + rng.uniform(-0.1, 0.1, n)
+        lef = LiveEdgeFit(GaussianModel(), 'det', {'x':'motor'}, update_every=update_every,
+                          refit_growth=refit_growth)
+        lef.start({'uid':'bench', 'time':0})
+        t0 = time.perf_counter()
+        for xi, yi in zip(x, y):
+            lef.event({'data':{'det':yi, 'motor':xi}})
+        lef.stop({'uid':'bench-stop', 'run_start':'bench', 'time':0, 'exit_status':'success'})
+        return time.perf_counter() - t0
+    n0, n1 = num_points
+    return np.log(bench(n1)/bench(n0))/np.log(n1/n0)
+
+if __name__ == '__main__':
+    print(f"{'points':>8s}{'update_every':>14s}{'total s':>10s}{'center':>10s}")
+    for num_points in (250, 500, 1000):
+        for update_every in (1, 10):
+            elapsed, center = bench_edge_fit(num_points, update_every)
+            print(f"{num_points:>8d}{update_every:>14d}{elapsed:>10.3f}{center:>10.4f}")
+    exponent = edge_fit_scaling()
+    print(f"total cost ~ points**{exponent:.2f}, "
+          f"every event refit ~ points**{edge_fit_scaling(refit_growth=None):.2f}")
+    assert exponent < 1.4, "LiveEdgeFit cost does not scale about linearly"
+
+    print(f"\n{'points':>8s}{'method':>12s}{'ms':>10s}{'pos':>10s}")
+    for num_points in (101, 1001):
+        for method, (elapsed, pos) in bench_estimators(num_points).items():
+            print(f"{num_points:>8d}{method:>12s}{elapsed*1e3:>10.3f}{pos:>10.4f}")
+
+    print(f"\n{'channels':>8s}{'multi s':>10s}{'LiveFit s':>12s}")
+    for num_channels in (8, 32):
+        multi, single = bench_multi_fit(num_channels)
+        print(f"{num_channels:>8d}{multi:>10.3f}{single:>12.3f}")
@@ -0,0 +1,25 @@
+'''
+    cost and accuracy of the LiveGridImage clim estimators
+
+    python -m tpsbl.tests.bench_plotting
+'''
+import timeit
+import numpy as np
+from tpsbl.bluesky.callbacks.plotting import PercentileClim, SubsampleClim, HistogramClim, EMAClim
+
+def bench_clim(shape, number=10):
+    rng = np.random.default_rng(0)
+    I = rng.poisson(100, shape).astype(np.uint32)
+    exact = np.percentile(I, (5, 95))
+    estimators = dict(percentile=PercentileClim(), subsample=SubsampleClim(),
+                      histogram=HistogramClim(), ema=EMAClim())
+    for name, estimator in estimators.items():
+        elapsed = min(timeit.repeat(lambda: estimator(I), number=number, repeat=3))/number
+        lims = estimator(I)
+        print(f"{str(shape):>14s}{name:>12s}{elapsed*1e3:>10.3f}"
+              f"{lims[0]-exact[0]:>10.2f}{lims[1]-exact[1]:>10.2f}")
+
+if __name__ == '__main__':
+    print(f"{'frame':>14s}{'estimator':>12s}{'ms':>10s}{'d_low':>10s}{'d_high':>10s}")
+    for shape in [(2048, 2048), (4096, 4096)]:
+        bench_clim(shape)
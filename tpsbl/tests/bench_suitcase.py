@@ -0,0 +1,49 @@
+'''
+    per-page cost of XYESerializer: pandas row-0 path vs page_mode
+
+    python -m tpsbl.tests.bench_suitcase
+'''
+import tempfile
+import timeit
+from pathlib import Path
+import numpy as np
+from event_model import compose_run
+from tpsbl.bluesky.callbacks.suitcase import XYESerializer
+
+def bench(page_mode, num_rows=1, num_points=23040, number=20):
+    run = compose_run(metadata={'motors':['temp', 'delta'],
+                                'plan_args':{'args':['temp', [25], 'delta', [0]]}})
+    data_keys = {'tth':{'source':'sim', 'dtype':'array', 'shape':[num_points]},
+                 'signal':{'source':'sim', 'dtype':'array', 'shape':[num_points]},
+                 'temp_user_setpoint':{'source':'sim', 'dtype':'number', 'shape':[]}}
+    desc = run.compose_descriptor(name='primary', data_keys=data_keys)
+    tth = 0.005*np.arange(num_points)
+    pages = []
+    for i in range(number):
+        seq_num = list(range(i*num_rows+1, (i+1)*num_rows+1))
+        pages.append(desc.compose_event_page(
+            data={'tth':[tth]*num_rows,
+                  'signal':[np.random.rand(num_points)*1e4 for _ in seq_num],
+                  'temp_user_setpoint':[25.0]*num_rows},
+            timestamps={'tth':[0]*num_rows, 'signal':[0]*num_rows,
+                        'temp_user_setpoint':[0]*num_rows},
+            seq_num=seq_num))
+
+    with tempfile.TemporaryDirectory() as directory:
+        serializer = XYESerializer('signal', 'tth', directory, file_prefix='',
+                                   page_mode=page_mode)
+        serializer('start', run.start_doc)
+        serializer('descriptor', desc.descriptor_doc)
+        it = iter(pages)
+        elapsed = timeit.timeit(lambda: serializer('event_page', next(it)), number=number)
+        serializer('stop', run.compose_stop())
+        assert len(list(Path(directory).iterdir())) == (number*num_rows if page_mode else number)
+    return elapsed/number
+
+if __name__ == '__main__':
+    print(f"{'path':>10s}{'rows/page':>10s}{'ms/page':>10s}{'ms/file':>10s}")
+    for num_rows in (1, 10):
+        legacy = bench(False, num_rows)
+        page = bench(True, num_rows)
+        print(f"{'legacy':>10s}{num_rows:>10d}{legacy*1e3:>10.2f}{legacy*1e3:>10.2f}")
+        print(f"{'page':>10s}{num_rows:>10d}{page*1e3:>10.2f}{page*1e3/num_rows:>10.2f}")
@@ -0,0 +1,305 @@
+from tpsbl.ophyd.areadetectors import (PerkinElmerStandard, EigerStandard, EigerSeries,
+                                       EigerHDF5Series)
+from ophyd.sim import make_fake_device
+import numpy as np
+import pytest
+import threading
+import time
+
+def make_detector(cls, file_store=False, **kwargs):
+    '''
+        fake detector whose plugins stage without a file writer, or with
+        the file store of its file_plugin if file_store, the stage_sigs of
+        the detector itself are kept
+    '''
+    det = make_fake_device(cls)('X:', name='det', **kwargs)
+    det.cam.port_name.sim_put('CAM')
+    for name in det._sub_devices:
+        plugin = getattr(det, name)
+        plugin.stage_sigs.clear()
+        if getattr(plugin, '_plugin_type', None):
+            plugin.plugin_type.sim_put(plugin._plugin_type)
+            plugin.port_name.sim_put(name.upper())
+            plugin.nd_array_port.sim_put('CAM')
+    plugin = getattr(det, det.file_plugin)
+    if file_store:
+        plugin.enable.sim_put(1)
+        plugin.file_path_exists.sim_put(1)
+        plugin.file_template.sim_put('%s%s_%6.6d.tiff')
+        ''' primed by a first frame '''
+        plugin.array_size.width.sim_put(3)
+        plugin.array_size.height.sim_put(2)
+        return det
+    plugin.stage = lambda: [plugin]
+    plugin.unstage = lambda: [plugin]
+    plugin.generate_datum = lambda *args: None
+    return det
+
+def acquire(det, write=True):
+    status = det.trigger()
+    det.cam.acquire.sim_put(0)
+    if write:
+        plugin = getattr(det, det.file_plugin)
+        plugin.array_counter.sim_put(plugin.array_counter.get() + 1)
+    assert status.done
+    return status
+
+def test_perkinelmer_skips_exposure_puts():
+    det = make_detector(PerkinElmerStandard, md={'ctrlprops': {'exposure_time': 0.5}})
+    puts = []
+    set_and_wait = det.cam.acquire_time._set_and_wait
+    def counted(value, timeout, **kwargs):
+        puts.append(value)
+        return set_and_wait(value, timeout, **kwargs)
+    det.cam.acquire_time._set_and_wait = counted
+
+    det.stage()
+    assert puts == [0.5]
+    del puts[:]
+    for _ in range(3):
+        acquire(det)
+    assert puts == []
+    assert det.put_counts['skipped'] == 3
+
+    ''' force puts again '''
+    det.force_puts = True
+    acquire(det)
+    assert puts == [0.5]
+    det.force_puts = False
+    det.unstage()
+
+    ''' a new exposure time is applied at the next stage '''
+    det.md['ctrlprops']['exposure_time'] = 2
+    det.stage()
+    ''' restored at unstage, then set '''
+    assert puts == [0.5, 0, 2]
+    acquire(det)
+    assert puts == [0.5, 0, 2]
+    det.unstage()
+
+def test_stage_skips_known_values():
+    det = make_detector(EigerStandard, md={'ctrlprops': {'exposure_time': 0.5}})
+    det.cam.trigger_mode.sim_set_enum_strs(['Internal Series', 'Internal Enable', 'External Series'])
+    det.cam.trigger_mode.sim_put(0)
+    det.cam.acquire_time.sim_put(0.5)
+    det.cam.acquire_period.sim_put(0.5)
+    det.cam.image_mode.sim_put(1)
+
+    det.stage()
+    det.unstage()
+    applied = det.put_counts['applied']
+    det.stage()
+    ''' only the acquire command is put again '''
+    assert det.put_counts['applied'] - applied == 1
+    assert len(det._original_vals) == 1
+    det.unstage()
+
+def test_trigger_timing():
+    det = make_detector(PerkinElmerStandard)
+    assert det.trigger_timing.shape == (0, 3)
+    det.stage()
+    for _ in range(4):
+        acquire(det)
+    acquire(det, write=False)
+    det.unstage()
+    timing = det.trigger_timing
+    assert timing.shape == (5, 3)
+    assert np.all(timing[:, :2] >= 0)
+    assert np.all(np.isfinite(timing[:4]))
+    assert np.isnan(timing[4, 2])
+    counts, edges = det.trigger_histogram(bins=4, phase='acquire')
+    assert counts.sum() == 5
+
+def test_trigger_timing_stage_failure(monkeypatch):
+    from ophyd.areadetector.trigger_mixins import SingleTrigger
+    det = make_detector(PerkinElmerStandard)
+    callbacks = det.tiff.array_counter._callbacks['value']
+    subscribed = len(callbacks)
+    def stage(self):
+        raise RuntimeError('stage failed')
+    monkeypatch.setattr(SingleTrigger, 'stage', stage)
+    with pytest.raises(RuntimeError):
+        det.stage()
+    assert len(callbacks) == subscribed
+
+def simulate_series(det, period=0.002):
+    ''' the simulated Eiger counts cam.num_images frames after acquire is put to 1 '''
+    def run():
+        for _ in range(det.cam.num_images.get()):
+            time.sleep(period)
+            det.cam.array_counter.sim_put(det.cam.array_counter.get() + 1)
+        det.cam.acquire.sim_put(0)
+    def acquire(value, old_value, **kwargs):
+        if old_value == 0 and value == 1:
+            threading.Thread(target=run, daemon=True).start()
+    det.cam.acquire.subscribe(acquire, run=False)
+
+@pytest.mark.parametrize('cls', [EigerSeries, EigerHDF5Series])
+def test_eiger_series_event_page(cls):
+    from bluesky import RunEngine
+    import bluesky.plan_stubs as bps
+    from tpsbl.bluesky.preprocessors import collect_stream_wrapper
+
+    det = make_detector(cls, file_store=True, md={'sample_name': 'LaB6'})
+    det.series_frames.put(5)
+    simulate_series(det)
+
+    def series(num_series):
+        yield from bps.open_run()
+        yield from bps.stage(det)
+        for _ in range(num_series):
+            yield from bps.kickoff(det, wait=True)
+            yield from bps.complete(det, wait=True)
+            yield from bps.collect(det)
+        yield from bps.unstage(det)
+        yield from bps.close_run()
+
+    RE = RunEngine({})
+    ''' the file plugin restores cam.num_images at unstage, the next run puts it again '''
+    for _ in range(2):
+        docs = []
+        RE(collect_stream_wrapper(series(2)), lambda name, doc: docs.append((name, doc)))
+    names = [name for name, doc in docs]
+    pages = [doc for name, doc in docs if name == 'event_page']
+    assert [len(page['seq_num']) for page in pages] == [5, 5]
+    assert names.count('resource') == 1
+    assert names.count('datum') == 10
+    assert names.index('datum') < names.index('event_page')
+
+    frames = sum((page['data']['det_frame'] for page in pages), [])
+    assert frames == list(range(frames[0], frames[0] + 10))
+    for page in pages:
+        assert page['timestamps']['det_frame'] == page['timestamps']['det_image']
+        assert np.all(np.diff(page['timestamps']['det_image']) > 0)
+    datums = [doc for name, doc in docs if name == 'datum']
+    assert sum((page['data']['det_image'] for page in pages), []) == [d['datum_id'] for d in datums]
+    assert [d['datum_kwargs']['point_number'] for d in datums] == list(range(10))
+    resource = next(doc for name, doc in docs if name == 'resource')
+    assert resource['spec'] == getattr(det, det.file_plugin).filestore_spec
+    assert getattr(det, det.file_plugin).file_name.get() == 'LaB6'
+    descriptor = next(doc for name, doc in docs if name == 'descriptor')
+    assert descriptor['data_keys']['det_image']['external'] == 'FILESTORE:'
+    assert descriptor['configuration']['det']['data']['det_series_frames'] == 5
+
+def test_hdf5_plugin_resource():
+    from tpsbl.ophyd.areadetectors import EigerHDF5Standard, PerkinElmerHDF5Standard
+    hdf5 = make_fake_device(EigerHDF5Standard)('X:', name='det').hdf5
+    keys = [key for key in hdf5.stage_sigs if isinstance(key, str)]
+    ''' chunking and compression before the file is opened by capture '''
+    assert keys.index('num_frames_chunks') < keys.index('capture')
+    assert keys.index('compression') < keys.index('capture')
+    assert hdf5.stage_sigs['file_write_mode'] == 'Stream'
+
+    det = make_detector(EigerHDF5Standard, file_store=True, md={'sample_name': 'LaB6'})
+    assert 'tiff' not in det.component_names
+    det.stage()
+    for _ in range(3):
+        acquire(det)
+    docs = list(det.collect_asset_docs())
+    det.unstage()
+    assert [name for name, doc in docs] == ['resource'] + ['datum']*3
+    resource = docs[0][1]
+    assert resource['spec'] == 'XPD_HDF5'
+    assert resource['resource_kwargs'] == {'frame_per_point': 1}
+    assert resource['path_semantics'] == 'posix'
+    assert [doc['datum_kwargs']['point_number'] for name, doc in docs[1:]] == [0, 1, 2]
+    assert det.hdf5.file_name.get() == 'LaB6'
+
+    det = make_detector(PerkinElmerHDF5Standard, file_store=True, md={'sample_name': 'Si'})
+    det.stage()
+    resource = next(doc for name, doc in det.collect_asset_docs())
+    det.unstage()
+    assert resource['path_semantics'] == 'windows'
+    assert resource['root'].rstrip('/') == '/blsw/19a/data/commission'
+
+def test_eiger_series_late_frames(caplog):
+    det = make_detector(EigerSeries, file_store=True, md={'sample_name': 'LaB6'})
+    det.series_frames.put(3)
+    det.series_settle_time = 0.5
+    det.stage()
+    det.kickoff()
+    with pytest.raises(RuntimeError):
+        det.kickoff()
+
+    ''' acquire drops before the last frames have arrived '''
+    det.cam.array_counter.sim_put(1)
+    det.cam.acquire.sim_put(0)
+    status = det.complete()
+    assert not status.done
+    for frame in (2, 3):
+        det.cam.array_counter.sim_put(frame)
+    status.wait(1)
+    page, = det.collect_pages()
+    assert page['data']['det_frame'] == [1, 2, 3]
+    assert det.series_missing == 0
+
+    ''' the missing frames are given up after series_settle_time,
+        the short series is logged and counted '''
+    det.kickoff()
+    det.cam.array_counter.sim_put(4)
+    det.cam.acquire.sim_put(0)
+    t0 = time.monotonic()
+    with caplog.at_level('WARNING', logger='tpsbl.ophyd.areadetectors'):
+        det.complete().wait(2)
+    assert time.monotonic() - t0 >= 0.4
+    assert det.series_missing == 2
+    assert '2 frames missing' in caplog.text
+    page, = det.collect_pages()
+    assert page['data']['det_frame'] == [4]
+
+    ''' the last frame arrives before acquire drops, the next kickoff
+        waits for the end of the previous acquisition '''
+    det.kickoff()
+    for frame in (5, 6, 7):
+        det.cam.array_counter.sim_put(frame)
+    det.complete().wait(1)
+    list(det.collect_pages())
+    threading.Timer(0.1, det.cam.acquire.sim_put, [0]).start()
+    t0 = time.monotonic()
+    det.kickoff()
+    assert time.monotonic() - t0 >= 0.05
+    assert not det.complete().done
+    det.unstage()
+    det.stage()
+    det.cam.acquire.sim_put(1)
+    with pytest.raises(RuntimeError):
+        det._wait_acquire_idle(0.1)
+    det.cam.acquire.sim_put(0)
+
+    ''' unstage drops a series not collected '''
+    det.kickoff()
+    det.unstage()
+    det.stage()
+    det.kickoff()
+    det.unstage()
+
+def test_hdf5_plugin_stage_sets():
+    from tpsbl.ophyd.areadetectors import PerkinElmerHDF5Standard
+    det = make_detector(PerkinElmerHDF5Standard, file_store=True, md={'sample_name': 'Si'})
+    ''' the stage_sigs of the plugin, with the simulated ports,
+        the fake string signals compare as str '''
+    fresh = make_fake_device(PerkinElmerHDF5Standard)('X:', name='det').hdf5
+    ports = {'hdf5.nd_array_port': det.proc.port_name.get(),
+             'proc.nd_array_port': det.trans1.port_name.get()}
+    for key, value in fresh.stage_sigs.items():
+        sig = getattr(det.hdf5, key) if isinstance(key, str) else getattr(det, key.dotted_name)
+        value = ports.get(sig.dotted_name, value)
+        if isinstance(sig.get(), str):
+            value = str(value)
+        det.hdf5.stage_sigs[key if isinstance(key, str) else sig] = value
+
+    det.images_per_set.put(3)
+    det.number_of_sets.put(2)
+    det.stage()
+    assert det.cam.num_images.get() == 6
+    assert det.proc.num_filter.get() == 3
+    assert det.proc.filter_type.get() == 'Average'
+    assert det.proc.enable_filter.get() == '1'
+    assert det.hdf5.nd_array_port.get() == det.proc.port_name.get()
+    acquire(det)
+    docs = list(det.collect_asset_docs())
+    det.unstage()
+    assert docs[0][1]['resource_kwargs'] == {'frame_per_point': 2}
+    assert [name for name, doc in docs] == ['resource', 'datum']
+    ''' restored at unstage '''
+    assert det.proc.num_filter.get() == 0
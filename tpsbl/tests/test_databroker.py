@@ -0,0 +1,287 @@
+import os
+from tpsbl.databroker.utils import scan_msgpack_dir, changed_files
+from tpsbl.databroker.index import RunIndex, read_start_stop
+from event_model import compose_run, pack_event_page
+from suitcase.msgpack import Serializer, _encode
+import numpy as np
+
+def write_run(directory, num_events=5, stop=True, **md):
+    run = compose_run(metadata=md)
+    desc = run.compose_descriptor(name='primary',
+                                  data_keys={'det':{'source':'sim', 'dtype':'number', 'shape':[]},
+                                             'motor':{'source':'sim', 'dtype':'number', 'shape':[]}})
+    serializer = Serializer(str(directory), flush=True)
+    serializer('start', run.start_doc)
+    serializer('descriptor', desc.descriptor_doc)
+    for i in range(num_events):
+        event = desc.compose_event(data={'det':float(i**2), 'motor':float(i)},
+                                   timestamps={'det':0, 'motor':0}, seq_num=i+1)
+        serializer('event_page', pack_event_page(event))
+    if stop:
+        serializer('stop', run.compose_stop())
+    else:
+        serializer._buffer.close()
+    path, = serializer.artifacts['all']
+    return run.start_doc, path
+
+def test_scan_changed_files(tmp_path):
+    assert scan_msgpack_dir(tmp_path / 'missing') == {}
+    start, path = write_run(tmp_path, stop=False, scan_id=1)
+    (tmp_path / 'other.txt').write_text('')
+    first = scan_msgpack_dir(tmp_path)
+    assert list(first) == [str(path)]
+    assert changed_files({}, first) == [str(path)]
+    assert changed_files(first, first) == []
+
+    with open(path, 'ab') as f:
+        f.write(b'\x90')
+    second_start, second = write_run(tmp_path, scan_id=2)
+    assert changed_files(first, scan_msgpack_dir(tmp_path)) == sorted([str(path), str(second)])
+    start, stop = read_start_stop(second)
+    assert start['uid'] == second_start['uid']
+    assert stop['exit_status'] == 'success'
+    assert read_start_stop(path) == (read_start_stop(path)[0], None)
+
+def test_run_index(tmp_path):
+    runs = [write_run(tmp_path, scan_id=i, plan_name='scan' if i % 2 else 'count',
+                      sample_name='LaB6' if i < 3 else 'Si', operator='me')
+            for i in range(1, 6)]
+    running_start, running = write_run(tmp_path, stop=False, scan_id=6, plan_name='scan')
+    (tmp_path / 'empty.msgpack').write_bytes(b'')
+    with RunIndex(tmp_path) as index:
+        assert len(index.update()) == 6
+        assert index.update() == []
+        assert [r['scan_id'] for r in index.search(plan_name='scan')] == [1, 3, 5, 6]
+        assert [r['scan_id'] for r in index.search(scan_id=(2, 4), sample_name='LaB6')] == [2]
+        assert [r['scan_id'] for r in index.search(since=runs[3][0]['time'])] == [4, 5, 6]
+        assert len(index.search(operator='me')) == 5
+        row, = index.search(scan_id=6)
+        assert row['stop'] is None and row['start']['uid'] == running_start['uid']
+
+    ''' the finished run is re-indexed, the others are kept '''
+    with open(running, 'ab') as f:
+        f.write(_encode(('stop', {'uid':'s', 'run_start':running_start['uid'],
+                                             'time':0, 'exit_status':'abort'})))
+    with RunIndex(tmp_path) as index:
+        indexed = index.update()
+        assert [r['path'] for r in indexed] == [str(running)]
+        assert index.search(scan_id=6)[0]['exit_status'] == 'abort'
+        runs[0][1].unlink()
+        index.update()
+        assert len(index) == 5
+
+def test_run_index_read_only(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'archive'
+    data_dir.mkdir()
+    write_run(data_dir, scan_id=1)
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache_dir))
+    if os.geteuid() == 0:
+        ''' root writes anyway, check the mode bits as another user would '''
+        access = os.access
+        monkeypatch.setattr(os, 'access', lambda path, mode: access(path, mode) and
+                            not (mode & os.W_OK and os.stat(path).st_mode & 0o222 == 0))
+    data_dir.chmod(0o555)
+    try:
+        with RunIndex(data_dir) as index:
+            assert [r['scan_id'] for r in index.update()] == [1]
+            assert os.path.dirname(index.path) == str(cache_dir / 'tpsbl' / 'index')
+        with RunIndex(data_dir) as index:
+            assert index.update() == []
+            assert len(index) == 1
+        assert [p.suffix for p in data_dir.iterdir()] == ['.msgpack']
+    finally:
+        data_dir.chmod(0o755)
+
+    ''' a missing directory is not created '''
+    with RunIndex(tmp_path / 'missing') as index:
+        assert index.path == ':memory:'
+        assert index.update() == []
+    assert not (tmp_path / 'missing').exists()
+
+def test_msgpack_run(tmp_path):
+    from tpsbl.databroker.reader import MsgpackRun
+    start, path = write_run(tmp_path, num_events=20, stop=False, scan_id=7)
+    run = MsgpackRun(path)
+    assert run.start['uid'] == start['uid']
+    assert run.stop is None
+    assert run.counts() == {'start':1, 'descriptor':1, 'event_page':20}
+    events = list(run.events(limit=3))
+    assert [e['data']['det'] for e in events] == [0., 1., 4.]
+    assert list(run.events('baseline')) == []
+
+    ''' a partial document is left for the next refresh '''
+    stop = _encode(('stop', {'uid':'s', 'run_start':start['uid'], 'time':0, 'exit_status':'success'}))
+    with open(path, 'ab') as f:
+        f.write(stop[:5])
+    assert run.refresh() == 0
+    with open(path, 'ab') as f:
+        f.write(stop[5:])
+    assert run.refresh() == 1
+    assert run.stop['exit_status'] == 'success'
+    assert [name for name, doc in run.documents()][-1] == 'stop'
+    assert len(list(run.event_pages())) == 20
+
+def test_msgpack_run_replay_xye(tmp_path):
+    from tpsbl.databroker.reader import open_runs
+    from tpsbl.bluesky.callbacks.suitcase import XYESerializer
+    from tpsbl.tests.test_suitcase import make_docs
+    docs, tth, signal = make_docs()
+    serializer = Serializer(str(tmp_path))
+    for name, doc in docs:
+        serializer(name, doc)
+    (tmp_path / 'xye').mkdir()
+    run, = open_runs(tmp_path)
+    run.replay(XYESerializer('signal', 'tth', str(tmp_path / 'xye'), file_prefix='', page_mode=True))
+    files = sorted((tmp_path / 'xye').iterdir())
+    assert len(files) == 3
+    xy = np.loadtxt(files[1], delimiter=',', skiprows=1)
+    np.testing.assert_allclose(xy[:, 1], signal[1].round(1))
+
+def test_range_rows(tmp_path):
+    from tpsbl.databroker.utils import msgpack_dirs, CatalogRegistry
+    for day, scan_ids in (('20240301', (1, 2)), ('20240303', (3,)), ('20240305', (4, 5))):
+        (tmp_path / day).mkdir()
+        for scan_id in scan_ids:
+            write_run(tmp_path / day, scan_id=scan_id, plan_name='count')
+    (tmp_path / '20240302.txt').write_text('')
+    dirs = msgpack_dirs('2024-03-01', '20240304', root=tmp_path)
+    assert [os.path.basename(d) for d in dirs] == ['20240301', '20240303']
+
+    registry = CatalogRegistry()
+    dirs = msgpack_dirs('20240301', '20240305', root=tmp_path)
+    rows = registry.search_rows(dirs, max_workers=3, plan_name='count')
+    assert [row['scan_id'] for row in rows] == [1, 2, 3, 4, 5]
+
+    ''' only the changed directory is indexed again '''
+    calls = []
+    for d in dirs:
+        index = registry.index(d)
+        index.update = lambda files=None, update=index.update, d=d: calls.append(d) or update(files)
+    write_run(tmp_path / '20240303', scan_id=6, plan_name='count')
+    rows = registry.search_rows(dirs, max_workers=3, scan_id=(3, 6))
+    assert [row['scan_id'] for row in rows] == [3, 4, 5, 6]
+    assert calls == [str(tmp_path / '20240303')]
+
+def test_hdf5_handler(tmp_path):
+    import h5py
+    from tpsbl.databroker.handlers import XPDHDF5Handler
+    path = tmp_path/'LaB6_000000.h5'
+    frames = np.arange(4*3*2).reshape(4, 3, 2)
+    writer = h5py.File(path, 'w', libver='latest')
+    data = writer.create_dataset('/entry/data/data', data=frames[:2], maxshape=(None, 3, 2), chunks=(1, 3, 2))
+    writer.swmr_mode = True
+
+    handler = XPDHDF5Handler(path, frame_per_point=1)
+    assert np.array_equal(handler(1), frames[1])
+    file = handler._file
+
+    ''' frames appended while the file is open are read through the same handle '''
+    data.resize(4, axis=0)
+    data[2:] = frames[2:]
+    data.flush()
+    assert np.array_equal(handler(3), frames[3])
+    assert handler._file is file
+    try:
+        handler(4)
+        assert False
+    except IndexError:
+        pass
+    writer.close()
+
+    assert np.array_equal(XPDHDF5Handler(path, frame_per_point=2)(1), frames[2:])
+    assert handler.get_file_list([{'point_number': 0}]) == [str(path)]
+    handler.close()
+
+class FakeCatalog:
+    '''
+        stands for the bluesky-msgpack-catalog opened by intake, which is
+        not needed to test the registry bookkeeping
+    '''
+    def __init__(self, cat_name, config_file):
+        self.cat_name = cat_name
+        self.config_file = config_file
+        self.upserted = []
+
+    def upsert(self, start, stop, gen, args, kwargs):
+        self.upserted.append((start['uid'], None if stop is None else stop['exit_status'], args))
+
+def fake_registry(monkeypatch):
+    from tpsbl.databroker import utils
+    registry = utils.CatalogRegistry()
+    opened = []
+    def _open(cat_name):
+        opened.append(cat_name)
+        return FakeCatalog(cat_name, registry.config_file)
+    monkeypatch.setattr(registry, '_open', _open)
+    monkeypatch.setattr(utils, 'catalog_registry', registry)
+    return registry, opened
+
+def test_catalog_registry_get(tmp_path, monkeypatch):
+    from tpsbl.databroker.utils import get_catalog
+    registry, opened = fake_registry(monkeypatch)
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    catalog = get_catalog('xrd', str(tmp_path / 'a'))
+    ''' opened once per (name, msgpack_dir), whatever the path spelling '''
+    assert get_catalog('xrd', str(tmp_path / 'a' / '.')) is catalog
+    assert registry.get('xrd', tmp_path / 'a') is catalog
+    other = get_catalog('xrd', str(tmp_path / 'b'))
+    assert other is not catalog
+    assert opened == ['xrd_temp', 'xrd_temp_1']
+
+    ''' one config file lists all the sources with the handler registry '''
+    config = open(registry.config_file).read()
+    assert f"paths: {tmp_path / 'a'}/*.msgpack" in config
+    assert f"paths: {tmp_path / 'b'}/*.msgpack" in config
+    assert 'XPD_HDF5: tpsbl.databroker.handlers.XPDHDF5Handler' in config
+
+    ''' a failed open is not cached '''
+    def fail(cat_name):
+        raise OSError(cat_name)
+    monkeypatch.setattr(registry, '_open', fail)
+    try:
+        get_catalog('saxs', str(tmp_path / 'a'))
+    except OSError:
+        pass
+    else:
+        assert False
+    assert ('saxs', str(tmp_path / 'a')) not in registry._entries
+    registry.clear()
+    assert registry._entries == {}
+
+def test_catalog_registry_refresh(tmp_path, monkeypatch):
+    from tpsbl.databroker.utils import get_catalog
+    registry, opened = fake_registry(monkeypatch)
+    first_start, first = write_run(tmp_path, scan_id=1)
+    catalog = get_catalog('xrd', str(tmp_path))
+    ''' the files present at open are loaded by the catalog itself '''
+    assert catalog.upserted == []
+
+    ''' new runs are upserted into the same catalog, without reopening it '''
+    running_start, running = write_run(tmp_path, stop=False, scan_id=2)
+    running = str(running)
+    (tmp_path / 'partial.msgpack').write_bytes(b'')
+    assert get_catalog('xrd', str(tmp_path)) is catalog
+    assert catalog.upserted == [(running_start['uid'], None, (running,))]
+    assert opened == ['xrd_temp']
+
+    ''' unchanged files are not upserted again, without refresh nothing is scanned '''
+    assert registry.refresh('xrd', str(tmp_path)) == []
+    second_start, second = write_run(tmp_path, scan_id=3)
+    get_catalog('xrd', str(tmp_path), refresh=False)
+    assert len(catalog.upserted) == 1
+
+    ''' a grown file is upserted again with its stop document, the partial
+        file is retried until it holds a run '''
+    with open(running, 'ab') as f:
+        f.write(_encode(('stop', {'uid':'s', 'run_start':running_start['uid'],
+                                  'time':0, 'exit_status':'success'})))
+    assert registry.refresh(name='other') == []
+    assert sorted(registry.refresh()) == sorted([running, str(second)])
+    assert catalog.upserted[1:] == sorted([(running_start['uid'], 'success', (running,)),
+                                           (second_start['uid'], 'success', (str(second),))],
+                                          key=lambda row: row[2])
+    assert registry.refresh() == []
+    entry, = registry._entries.values()
+    assert str(tmp_path / 'partial.msgpack') not in entry['files']
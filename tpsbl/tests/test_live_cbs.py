@@ -1,5 +1,8 @@
-from tpsbl.bluesky.callbacks.live_cbs import LiveEdgeFit, LiveCbsFactory
+from tpsbl.bluesky.callbacks.live_cbs import LiveEdgeFit, LiveCbsFactory, OutOfBandFits, ESTIMATORS
 from ophyd.sim import SynGauss, motor, noisy_det
+from bluesky.callbacks.core import CallbackBase
+from bluesky.callbacks.fitting import LiveFit
+from concurrent.futures import Future
 from scipy import special
 import numpy as np
 from lmfit.models import GaussianModel
@@ -46,3 +49,169 @@ def test_live_cbs_factory():
     RE(scan([cum_det], motor, -5,5,101),
        RunRouter([LiveCbsFactory(motor, cum_det, 'edgefit', update_every=101)]))
 
+
+def test_live_edge_fit_warm_start():
+    lef = LiveEdgeFit(GaussianModel(), 'cum_det', {'x':'motor'}, update_every=10)
+    RE = RunEngine({})
+    RE(scan([cum_det], motor, -5,5,101), lef)
+    assert lef.x_data.shape == (101,)
+    # d/dm Imax*(erf(m)+1) is a gaussian centered at 0 with sigma 1/sqrt(2)
+    assert abs(lef.result.params['center'].value) < 0.05
+    assert abs(lef.result.params['sigma'].value - 1/np.sqrt(2)) < 0.05
+    assert lef.result.nfev <= lef.max_nfev + 1
+
+def test_live_edge_fit_refit_growth():
+    fitted = []
+    lef = LiveEdgeFit(GaussianModel(), 'cum_det', {'x':'motor'}, refit_growth=1.1)
+    update_fit = lef.update_fit
+    def counted():
+        fitted.append(lef._num_points)
+        update_fit()
+    lef.update_fit = counted
+    RE = RunEngine({})
+    RE(scan([cum_det], motor, -5,5,401), lef)
+    # the fitted points grow geometrically, the last fit is made at stop
+    assert fitted[-1] == 401
+    assert all(n1 >= 1.1*n0 for n0, n1 in zip(fitted[:-2], fitted[1:-1]))
+    assert sum(fitted) < 11*1.1*401
+    assert abs(lef.result.params['center'].value) < 0.05
+
+def test_live_cbs_factory_out_of_band():
+    motor.move = motor.set
+    RE = RunEngine({})
+    factory = LiveCbsFactory(motor, cum_det, 'edgefit', update_every=101,
+                             fit_plots_enabled=False, fit_timeout=30)
+    RE(scan([cum_det], motor, -5,5,101), RunRouter([factory]))
+    assert abs(motor.position) < 0.1
+    assert factory.fits.futures['fit'].done()
+    # without a Qt backend the report is made at stop, by the caller
+    assert factory.report_thread is None
+    table = factory.fit_report.table
+    assert abs(table.loc['edgefit', 'pos']) < 0.1
+    assert list(table.index[:4]) == ['max', 'min', 'com', 'cen']
+
+def test_out_of_band_fits_stale():
+    submitted = []
+    class Executor:
+        def submit(self, fn, *args):
+            submitted.append(args)
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+    lf = LiveFit(GaussianModel(), 'noisy_det', {'x':'motor'}, update_every=1)
+    lef = LiveEdgeFit(GaussianModel(), 'cum_det', {'x':'motor'}, update_every=1, refit_growth=None)
+    fits = OutOfBandFits(dict(fit=lf, edgefit=lef), Executor())
+    RE = RunEngine({})
+    RE(scan([noisy_det, cum_det], motor, -5,5,21), [lf, lef])
+    # both fits are up to date at stop, nothing is refitted
+    assert submitted == []
+    assert fits.result('fit') is lf.result
+    assert fits.result('edgefit') is lef.result
+
+    lef = LiveEdgeFit(GaussianModel(), 'cum_det', {'x':'motor'}, update_every=100)
+    fits = OutOfBandFits(dict(edgefit=lef), Executor())
+    RE(scan([cum_det], motor, -5,5,21), lef)
+    assert submitted == [(lef,)]
+    assert lef._num_fitted == 21
+
+peak_det = SynGauss('peak_det', motor, 'motor', center=0.3, Imax=10,
+                    noise='uniform', sigma=0.8, noise_multiplier=0.1)
+
+class Collect(CallbackBase):
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+        self.data = []
+
+    def event(self, doc):
+        self.data.append((doc['data'][self.x], doc['data'][self.y]))
+
+def scan_xy(det):
+    RE = RunEngine({})
+    collect = Collect('motor', det.name)
+    RE(scan([det], motor, -5,5,101), collect)
+    return np.array(collect.data).T
+
+def test_peak_estimators():
+    x, y = scan_xy(peak_det)
+    for method in ('moments', 'caruana'):
+        res = ESTIMATORS[method](x, y)
+        assert abs(res['pos'] - 0.3) < 0.05, method
+        assert abs(res['height'] - 10) < 0.5, method
+        assert abs(res['fwhm'] - 0.8*2.3548) < 0.15, method
+
+def test_edge_estimator():
+    x, y = scan_xy(cum_det)
+    # d/dm Imax*(erf(m)+1) is a gaussian of height 2*Imax/sqrt(pi) and sigma 1/sqrt(2)
+    res = ESTIMATORS['derivative'](x, y)
+    assert abs(res['pos']) < 0.05
+    assert abs(res['height'] - 20/np.sqrt(np.pi)) < 0.5
+    assert abs(res['fwhm'] - 2.3548/np.sqrt(2)) < 0.15
+    res = ESTIMATORS['derivative'](x, -y)
+    assert res['height'] < 0
+
+def test_estimators_channels():
+    x, y = scan_xy(peak_det)
+    Y = np.stack([y, 2*y, np.zeros_like(y)], axis=1)
+    for method, estimator in ESTIMATORS.items():
+        res = estimator(x, Y)
+        assert res['pos'].shape == (3,)
+        assert np.allclose(res['pos'][:2], estimator(x, y)['pos'])
+        assert np.isnan(res['pos'][2])
+
+def test_derivative_edge_opposite_lobe():
+    '''
+        the opposite lobe of dy/dx does not lift the noisy tails over the
+        threshold: a peak rising with sigma 0.5 and falling with sigma 0.55
+        has a rising edge at 0.3-0.5, its mirror a falling edge at 0.5-0.3
+    '''
+    x = np.linspace(-5, 5, 101)
+    def skewed(x):
+        sigma = np.where(x < 0.3, 0.5, 0.55)
+        return 10*np.exp(-(x-0.3)**2/(2*sigma**2))
+    for seed in range(20):
+        noise = np.random.default_rng(seed).uniform(-0.1, 0.1, x.size)
+        rising = ESTIMATORS['derivative'](x, skewed(x) + noise)
+        assert abs(rising['pos'] + 0.2) < 0.1 and rising['height'] > 0
+        falling = ESTIMATORS['derivative'](x, skewed(-x) + noise)
+        assert abs(falling['pos'] - 0.2) < 0.1 and falling['height'] < 0
+
+def test_live_cbs_factory_estimator():
+    motor.move = motor.set
+    RE = RunEngine({})
+    factory = LiveCbsFactory(motor, peak_det, 'caruana', update_every=101,
+                             fit_plots_enabled=False)
+    RE(scan([peak_det], motor, -5,5,101), RunRouter([factory]))
+    assert abs(motor.position - 0.3) < 0.05
+    assert abs(factory.fit_report.table.loc['fit', 'pos'] - 0.3) < 0.05
+
+def test_live_multi_fit():
+    from tpsbl.bluesky.callbacks.live_cbs import LiveMultiFit
+    dets = [SynGauss(f'g{i}', motor, 'motor', center=c, Imax=10, sigma=0.5,
+                     noise='uniform', noise_multiplier=0.1)
+            for i, c in enumerate((-1, 0, 1.5))]
+    motor.move = motor.set
+    RE = RunEngine({})
+    mf = LiveMultiFit('motor', [d.name for d in dets] + ['missing'], 'caruana',
+                      update_every=10, positioner=motor, move_policy='g2')
+    RE(scan(dets, motor, -3,3,61), mf)
+    res = mf.results
+    assert mf.y_data.shape == (61, 4)
+    assert np.allclose(res['pos'][:3], (-1, 0, 1.5), atol=0.05)
+    assert np.isnan(res.loc['missing', 'pos'])
+    assert abs(motor.position - 1.5) < 0.05
+    assert abs(mf.move_target(res.iloc[:3].assign(pos=[1, 2, 3.])) - 3) < 1e-9
+    mf.move_policy = 'mean'
+    assert abs(mf.move_target() - 0.5/3*1) < 0.05
+
+def test_live_multi_fit_event_page():
+    from tpsbl.bluesky.callbacks.live_cbs import LiveMultiFit
+    x = np.linspace(-5, 5, 101)
+    Y = np.stack([10*np.exp(-(x-c)**2/(2*0.5**2)) for c in np.linspace(-2, 2, 32)], axis=1)
+    mf = LiveMultiFit('x', [f'ch{i}' for i in range(32)], 'moments', verbose=False)
+    mf.start({'uid':'start', 'time':0})
+    for chunk in np.array_split(np.arange(101), 4):
+        mf.event_page(dict(data=dict(x=x[chunk], **{f'ch{i}': Y[chunk, i] for i in range(32)}),
+                           timestamps={}, seq_num=list(chunk+1), time=list(x[chunk]),
+                           uid=[str(i) for i in chunk], descriptor='d', filled={}))
+    mf.stop({'uid':'stop', 'run_start':'start', 'time':0, 'exit_status':'success'})
+    assert np.allclose(mf.results['pos'], np.linspace(-2, 2, 32), atol=0.02)
@@ -0,0 +1,137 @@
+from tpsbl.ophyd.motor_manager import MotorManager, MotorSnapshot
+from ophyd import Component as Cpt
+from ophyd.sim import SynAxis
+import time
+import os
+import numpy as np
+
+class Stage(MotorManager):
+    x = Cpt(SynAxis)
+    y = Cpt(SynAxis)
+    z = Cpt(SynAxis)
+    th = Cpt(SynAxis)
+
+def make_stage(latency=0.2, **kwargs):
+    stage = Stage(name='stage', **kwargs)
+    for i, name in enumerate(stage.component_names):
+        motor = getattr(stage, name)
+        motor.set(i).wait()
+        get = motor.setpoint.get
+        def slow_get(get=get, **kwargs):
+            time.sleep(latency)
+            return get(**kwargs)
+        motor.setpoint.get = slow_get
+        stage.add_motor(motor)
+    return stage
+
+def test_read_motors_concurrent():
+    stage = make_stage(latency=0.2, readout_timeout=2)
+    t0 = time.perf_counter()
+    values, status = stage.read_motors()
+    assert time.perf_counter() - t0 < 0.5
+    assert values == {'x':0, 'y':1, 'z':2, 'th':3}
+    assert set(status.values()) == {'ok'}
+    assert stage.motors_val == values
+
+def test_read_motors_deadline(capsys):
+    stage = make_stage(latency=0.05, readout_timeout=0.5)
+    def offline(**kwargs):
+        time.sleep(2)
+    def broken(**kwargs):
+        raise TimeoutError('y not connected')
+    stage.x.setpoint.get = offline
+    stage.y.setpoint.get = broken
+    t0 = time.perf_counter()
+    values, status = stage.read_motors()
+    assert time.perf_counter() - t0 < 1
+    assert values == {'z':2, 'th':3}
+    assert status['x'] == 'timeout'
+    assert 'y not connected' in status['y']
+    assert stage.motors_val == values
+    assert 'x: timeout' in capsys.readouterr().out
+
+def test_show_all_cached(capsys):
+    stage = make_stage(latency=0.2)
+    assert stage.stale_after == 60
+    ''' subscribed at registration, the first show_all is instant '''
+    t0 = time.perf_counter()
+    stage.show_all()
+    assert time.perf_counter() - t0 < 0.05
+    out = capsys.readouterr().out.split('\n\n')[-2]
+    names, values = out.split('\n')
+    assert names.split() == ['x', 'y', 'z', 'th']
+    assert [float(v) for v in values.split()] == [0, 1, 2, 3]
+
+    ''' the cache follows the monitors '''
+    stage.y.set(5).wait()
+    assert stage.cached_motors_val()[0]['y'] == 5
+    values, stale = stage.cached_motors_val(now=time.time() + 120)
+    assert stale == {'x', 'y', 'z', 'th'}
+    stage.stale_after = 0
+    assert '*' in repr(stage)
+    ''' subscribed only once '''
+    assert len(stage.x.setpoint._callbacks['value']) == 1
+
+def test_revalidate():
+    stage = make_stage(latency=0, stale_after=0.2)
+    assert stage.cached_motors_val()[1] == set()
+    time.sleep(0.3)
+    ''' the monitors of idle motors are not updated '''
+    assert stage.cached_motors_val()[1] == {'x', 'y', 'z', 'th'}
+    def broken(**kwargs):
+        raise TimeoutError('y not connected')
+    stage.y.setpoint.get = broken
+    stage.revalidate()
+    assert stage.cached_motors_val()[1] == {'y'}
+    ''' and in the background, every second at least '''
+    checked = stage.monitor_motors()['x']['checked']
+    time.sleep(1.3)
+    assert stage.monitor_motors()['x']['checked'] > checked
+
+    ''' a motor registered again replaces the monitors of the previous one '''
+    other = make_stage(latency=0)
+    stage.add_motor(other.x)
+    assert len(stage.x.setpoint._callbacks['value']) == 0
+    other.x.set(7).wait()
+    assert stage.cached_motors_val()[0]['x'] == 7
+
+def test_registry_per_instance():
+    first = make_stage(latency=0)
+    second = make_stage(latency=0)
+    for motor in second.motors:
+        second.add_motor(motor)
+    assert [m.dotted_name for m in first.motors] == ['x', 'y', 'z', 'th']
+    assert len(second.motors) == 4
+    assert second.get_motor('th') is second.th
+
+def test_snapshot_diff_restore(tmp_path):
+    stage = make_stage(latency=0.1)
+    before = stage.snapshot()
+    assert before.as_dict() == {'x':0, 'y':1, 'z':2, 'th':3}
+    assert before.connected.all()
+
+    stage.x.set(0.5).wait()
+    stage.z.set(2.001).wait()
+    after = stage.snapshot()
+    assert before.diff(after) == {'x':(0, 0.5), 'z':(2, 2.001)}
+    assert before.diff(after, tol={'z':0.01}) == {'x':(0, 0.5)}
+    assert set(before.diff(after, tol=0.01)) == {'x'}
+
+    before.save(tmp_path / 'before.npz')
+    loaded = MotorSnapshot.load(tmp_path / 'before.npz')
+    assert loaded.as_dict() == before.as_dict() and loaded.time == before.time
+    ''' np.savez appends .npz, load finds the file by the same suffix-less path '''
+    path = after.save(tmp_path / 'after')
+    assert path == str(tmp_path / 'after.npz')
+    assert sorted(os.listdir(tmp_path)) == ['after.npz', 'before.npz']
+    assert MotorSnapshot.load(tmp_path / 'after').as_dict() == after.as_dict()
+    assert MotorSnapshot.load(path).time == after.time
+
+    ''' a motor that could not be read is neither compared nor restored '''
+    partial = MotorSnapshot(['x', 'y', 'z'], [0, np.nan, 2])
+    assert 'y' not in partial.diff(after)
+
+    status = stage.restore(loaded, names=['x', 'z'])
+    status.wait(5)
+    assert stage.snapshot().as_dict() == {'x':0, 'y':1, 'z':2, 'th':3}
+    assert stage.restore(loaded).done
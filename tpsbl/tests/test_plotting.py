@@ -0,0 +1,255 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from tpsbl.bluesky.callbacks.plotting import (RedrawScheduler, PercentileClim, SubsampleClim,
+                                             HistogramClim, EMAClim, DisplayPyramid, ResultPlot,
+                                             LiveGridImage, ProcPlot)
+import numpy as np
+import time
+
+def test_redraw_scheduler_coalesce():
+    fig = plt.figure()
+    drawn = []
+    scheduler = RedrawScheduler(max_fps=5)
+    for i in range(10):
+        scheduler.request(fig, lambda i=i: drawn.append(i))
+    # the first request renders, the others are merged into one pending frame
+    assert scheduler.stats(fig)['rendered'] == 1
+    assert scheduler.stats(fig)['pending']
+    scheduler.flush(fig)
+    stats = scheduler.stats(fig)
+    assert stats['rendered'] == 2
+    assert stats['dropped'] == 8
+    assert not stats['pending']
+    assert drawn[0] == 0 and 9 in drawn
+
+def test_redraw_scheduler_max_fps():
+    fig = plt.figure()
+    scheduler = RedrawScheduler()
+    scheduler.set_max_fps(fig, 1000)
+    for i in range(3):
+        scheduler.request(fig)
+        time.sleep(0.01)
+    assert scheduler.stats(fig)['rendered'] == 3
+
+def test_clim_estimators():
+    rng = np.random.default_rng(0)
+    I = rng.normal(1000, 100, (1024, 1024))
+    exact = np.percentile(I, (5, 95))
+    for estimator in [PercentileClim(), SubsampleClim(), HistogramClim(), EMAClim()]:
+        np.testing.assert_allclose(estimator(I), exact, rtol=0.01)
+
+def test_ema_clim():
+    estimator = EMAClim(PercentileClim((0, 100)), alpha=0.5)
+    assert estimator(np.array([0., 10.])) == (0., 10.)
+    assert estimator(np.array([10., 20.])) == (5., 15.)
+    estimator.reset()
+    assert estimator(np.array([10., 20.])) == (10., 20.)
+
+def test_display_pyramid():
+    I = np.arange(64*48, dtype=float).reshape(64, 48)
+    pyramid = DisplayPyramid(I, 'max')
+    assert pyramid.level(0) is I
+    assert pyramid.level(2).shape == (16, 12)
+    assert pyramid.level(2)[0, 0] == I[:4, :4].max()
+    # built from level 2, reduced once more
+    np.testing.assert_array_equal(pyramid.level(3), DisplayPyramid.block_reduce(I, 8, 'max'))
+    assert pyramid.level(100).shape == pyramid.level(pyramid.max_level).shape
+    assert DisplayPyramid(I).level(1)[0, 0] == I[:2, :2].mean()
+
+def result_run(cb, scan_id, seq_nums):
+    x = np.linspace(0, 10, 50)
+    cb('start', {'scan_id': scan_id, 'uid': str(scan_id), 'time': 0})
+    for seq_num in seq_nums:
+        cb('event', {'seq_num': seq_num, 'data': {'tth': x, 'I': x*seq_num}})
+
+def legend_labels(cb):
+    return [text.get_text() for text in cb.legend.get_texts()]
+
+def test_result_plot_pool():
+    fig, ax = plt.subplots()
+    cb = ResultPlot('I', 'tth', ax=ax, max_line_num=3, vis_line_num=2)
+    result_run(cb, 1, range(1, 6))
+    assert len(ax.lines) == 3
+    # the oldest line is recycled, the legend lists the oldest first
+    assert [line.get_label() for line in cb.lines] == ['seq#:3', 'seq#:4', 'seq#:5']
+    assert legend_labels(cb) == ['seq#:3', 'seq#:4', 'seq#:5']
+    for legline, line in zip(cb.legend.get_lines(), cb.lines):
+        assert cb.lined[legline] is line
+        assert legline.get_color() == line.get_color()
+    assert [line.get_visible() for line in cb.lines] == [False, True, True]
+    assert [legline.get_alpha() for legline in cb.legend.get_lines()] == [0.2, 1.0, 1.0]
+    np.testing.assert_array_equal(cb.lines[-1].get_ydata(), np.linspace(0, 10, 50)*5)
+
+    # the next run reuses the pool, the lines of the previous run are gone
+    pool = list(ax.lines)
+    result_run(cb, 2, [1, 2])
+    assert list(ax.lines) == pool
+    assert legend_labels(cb) == ['seq#:1', 'seq#:2']
+    assert [line.get_visible() for line in pool] == [True, True, False]
+    assert len(pool[2].get_xdata()) == 0
+    assert len(ax.get_legend().get_texts()) == 2
+
+def test_result_plot_blit_fallback():
+    fig, ax = plt.subplots()
+    cb = ResultPlot('I', 'tth', ax=ax, max_line_num=2, blit=False)
+    result_run(cb, 1, [])
+    blits = []
+    fig.canvas.blit = lambda bbox=None: blits.append(bbox)
+    result_run(cb, 1, range(1, 5))
+    cb.stop({})
+    assert not cb._blit
+    assert not blits
+
+    # no background before the first full draw
+    fig, ax = plt.subplots()
+    cb = ResultPlot('I', 'tth', ax=ax, max_line_num=2, blit=True)
+    result_run(cb, 1, [])
+    assert cb._blit
+    assert cb._background is None
+    draws = []
+    fig.canvas.draw_idle = lambda: draws.append(1)
+    cb._render()
+    assert draws == [1]
+    fig.canvas.draw()
+    assert cb._background is not None
+    fig.canvas.blit = lambda bbox=None: blits.append(bbox)
+    cb._render()
+    assert draws == [1]
+    assert len(blits) == 1
+
+def test_result_plot_savefig(tmp_path):
+    def saved_svg(blit):
+        fig, ax = plt.subplots()
+        # the default arguments do not blit
+        kwargs = {'blit': True} if blit else {}
+        cb = ResultPlot('I', 'tth', ax=ax, max_line_num=3, **kwargs)
+        result_run(cb, 1, range(1, 5))
+        assert cb._blit == blit
+        cb.stop({})
+        fig.canvas.draw()
+        background = cb._background
+        for ext in ('pdf', 'svg'):
+            fig.savefig(tmp_path/f'result_{blit}.{ext}')
+        # a savefig does not replace the background of the screen canvas
+        assert cb._background is background
+        return (tmp_path/f'result_{blit}.svg').read_text()
+
+    svg = saved_svg(False)
+    assert 'seq#:4' in svg
+    # the animated lines and legend are drawn in the exported figure
+    blit_svg = saved_svg(True)
+    assert 'seq#:4' in blit_svg
+    assert blit_svg.count('<g id="line2d_') == svg.count('<g id="line2d_')
+
+def test_clim_estimator_without_reset():
+    estimator = EMAClim(lambda I: (I.min(), I.max()), alpha=0.5)
+    assert estimator(np.array([0., 10.])) == (0., 10.)
+    estimator.reset()
+    assert estimator(np.array([10., 20.])) == (10., 20.)
+
+    fig, ax = plt.subplots()
+    cb = LiveGridImage((4, 6), 'I', ax=ax, clim_estimator=lambda I: (I.min(), I.max()))
+    I = np.arange(24.).reshape(4, 6)
+    for scan_id in (1, 2):
+        cb('start', {'scan_id': scan_id, 'uid': f'run{scan_id}', 'time': 0})
+        cb('event', {'seq_num': 1, 'data': {'I': I*scan_id}})
+    assert cb.im.get_clim() == (0., 46.)
+
+def test_live_grid_image_decimate():
+    fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
+    cb = LiveGridImage((1024, 1024), 'I', ax=ax, decimate='max')
+    I = np.arange(1024*1024, dtype=float).reshape(1024, 1024)
+    cb('start', {'scan_id': 1, 'uid': 'run1', 'time': 0})
+    cb('event', {'seq_num': 1, 'data': {'I': I}})
+    bbox = ax.get_position(original=True).transformed(fig.transFigure)
+    k = int(np.floor(np.log2(1024/min(bbox.width, bbox.height))))
+    # the whole frame at the level matching the axes size
+    assert k > 0
+    assert cb.im.get_array().shape == (1024 >> k, 1024 >> k)
+    np.testing.assert_array_equal(cb.im.get_array(), cb._pyramid.level(k))
+
+    # zooming in renders a full resolution tile of the zoomed region
+    ax.set_xlim(99.5, 199.5)
+    ax.set_ylim(9.5, 59.5)
+    tile = cb.im.get_array()
+    np.testing.assert_array_equal(tile, I[10:60, 100:200])
+    assert cb.im.get_extent() == [99.5, 199.5, 9.5, 59.5]
+    assert ax.get_xlim() == (99.5, 199.5)
+    assert ax.get_ylim() == (9.5, 59.5)
+
+    # zooming out again, the level is chosen by the visible region
+    ax.set_xlim(-0.5, 1023.5)
+    ax.set_ylim(-0.5, 511.5)
+    assert cb.im.get_array().shape == (512 >> k, 1024 >> k)
+    cb('stop', {'exit_status': 'success'})
+
+class PickEvent:
+    def __init__(self, artist):
+        self.artist = artist
+
+def proc_plot(**kwargs):
+    plt.close('fig_name')
+    cb = ProcPlot(**kwargs)
+    cb('descriptor', {'uid': 'descriptor-1'})
+    return cb
+
+def test_proc_plot_series():
+    cb = proc_plot()
+    x = np.linspace(0, 1, 20)
+    cb('event', {'series': {'raw12.3': (x, x), 'bci12.3': (x, 2*x)},
+                 'line_params': {'marker': 'x', 'linestyle': ''}})
+    assert cb.check_labels == ['All', 'raw12.3', 'bci12.3']
+    assert [line.get_label() for line in cb.ax.lines] == ['raw12.3', 'bci12.3']
+    np.testing.assert_array_equal(cb._lines['bci12.3'].get_ydata(), 2*x)
+    assert cb._lines['raw12.3'].get_marker() == 'x'
+
+    # existing lines are updated in place, single line docs still work
+    cb('event', {'series': {'raw12.3': (x, 3*x)}})
+    cb('event', {'data': {'x': x, 'y': 4*x}, 'line_params': {'label': 'ff12.3'}})
+    assert len(cb.ax.lines) == 3
+    np.testing.assert_array_equal(cb._lines['raw12.3'].get_ydata(), 3*x)
+    cb('event', {'series': {'all_lines': (x, 0*x)}})
+    assert all(not line.get_ydata().any() for line in cb.ax.lines)
+    cb('stop', {'exit_status': 'success'})
+    plt.close('fig_name')
+
+def test_proc_plot_toggle_legend():
+    cb = proc_plot(toggle_row_height=0.1)
+    x = np.linspace(0, 1, 20)
+    cb('event', {'series': {f'line{i}': (x, i*x) for i in range(3)}})
+    assert cb.get_status() == [True]*4
+    assert cb.ax_leg.get_aspect() == 1.0
+
+    box, text = cb._toggles['line1']
+    cb.on_pick(PickEvent(text))
+    assert not cb._lines['line1'].get_visible()
+    assert cb.get_status() == [False, True, False, True]
+    cb.on_pick(PickEvent(box))
+    assert cb.get_status() == [True]*4
+
+    all_box, _ = cb._toggles['All']
+    cb.on_pick(PickEvent(all_box))
+    assert cb.get_status() == [False]*4
+    assert not any(line.get_visible() for line in cb.ax.lines)
+    cb.on_pick(PickEvent(cb._toggles['line0'][0]))
+    cb.on_pick(PickEvent(all_box))
+    assert cb.get_status() == [True]*4
+
+    # the rows shrink to fit all the entries in ax_leg
+    assert cb._toggles['line2'][0].get_height() == 0.7*0.1
+    cb('event', {'series': {f'line{i}': (x, i*x) for i in range(3, 20)}})
+    assert len(cb.check_labels) == 21
+    boxes = [box for box, _ in cb._toggles.values()]
+    assert boxes[-1].get_y() >= 0
+    assert boxes[-1].get_y() + boxes[-1].get_height() < boxes[-2].get_y()
+    assert all(text.get_fontsize() < plt.rcParams['font.size'] for _, text in cb._toggles.values())
+
+    # a new figure takes over the pick events
+    fig, cid = cb.fig, cb._pick_cid
+    plt.close('fig_name')
+    cb('descriptor', {'uid': 'descriptor-2'})
+    assert cb.fig is not fig
+    assert cid not in fig.canvas.callbacks.callbacks.get('pick_event', {})
+    assert cb._pick_cid in cb.fig.canvas.callbacks.callbacks['pick_event']
+    plt.close('fig_name')
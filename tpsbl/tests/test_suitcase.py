@@ -0,0 +1,177 @@
+from tpsbl.bluesky.callbacks.suitcase import (XYESerializer, AsyncSerializer, XYEHDF5Serializer,
+                                              XYERunReader, hdf5_to_xye)
+import os
+import time
+from event_model import compose_run
+import numpy as np
+
+def make_docs(num_rows=3, num_points=100):
+    run = compose_run(metadata={'motors':['temp', 'delta'],
+                                'plan_args':{'args':['temp', [25, 50, 75], 'delta', [0, 1]]}})
+    data_keys = {'tth':{'source':'sim', 'dtype':'array', 'shape':[num_points]},
+                 'signal':{'source':'sim', 'dtype':'array', 'shape':[num_points]},
+                 'temp_user_setpoint':{'source':'sim', 'dtype':'number', 'shape':[]}}
+    desc = run.compose_descriptor(name='primary', data_keys=data_keys)
+    tth = 0.005*np.arange(num_points)
+    signal = [np.random.rand(num_points)*1e4 for _ in range(num_rows)]
+    temp = [25.0 + 25*i for i in range(num_rows)]
+    page = desc.compose_event_page(data={'tth':[tth]*num_rows, 'signal':signal,
+                                         'temp_user_setpoint':temp},
+                                   timestamps={'tth':[0]*num_rows, 'signal':[0]*num_rows,
+                                               'temp_user_setpoint':[0]*num_rows},
+                                   seq_num=list(range(1, num_rows+1)))
+    stop = run.compose_stop()
+    return [('start', run.start_doc), ('descriptor', desc.descriptor_doc),
+            ('event_page', page), ('stop', stop)], tth, signal
+
+def serialize(directory, docs, **kwargs):
+    serializer = XYESerializer('signal', 'tth', str(directory), file_prefix='', **kwargs)
+    for name, doc in docs:
+        serializer(name, doc)
+    return sorted(directory.iterdir())
+
+def test_xye_page_mode(tmp_path):
+    docs, tth, signal = make_docs()
+    files = serialize(tmp_path, docs, page_mode=True)
+    assert [f.name for f in files] == ['seq_num-0001-temp-25.00.xye',
+                                       'seq_num-0002-temp-50.00.xye',
+                                       'seq_num-0003-temp-75.00.xye']
+    for f, sig in zip(files, signal):
+        header, *rows = f.read_text().splitlines()
+        assert header == 'time,signal'
+        xy = np.array([row.split(',') for row in rows], dtype=float)
+        np.testing.assert_allclose(xy[:, 0], tth.round(3))
+        np.testing.assert_allclose(xy[:, 1], sig.round(1))
+
+def test_xye_page_mode_matches_legacy(tmp_path):
+    docs, _, _ = make_docs()
+    (tmp_path / 'legacy').mkdir()
+    (tmp_path / 'page').mkdir()
+    legacy = serialize(tmp_path / 'legacy', docs)
+    page = serialize(tmp_path / 'page', docs, page_mode=True)
+    assert [f.name for f in legacy] == [f.name for f in page][:1]
+    legacy_xy = np.loadtxt(legacy[0], delimiter=',', skiprows=1)
+    page_xy = np.loadtxt(page[0], delimiter=',', skiprows=1)
+    np.testing.assert_allclose(legacy_xy, page_xy)
+
+def test_async_serializer(tmp_path):
+    docs, _, _ = make_docs()
+    serializer = AsyncSerializer(XYESerializer('signal', 'tth', str(tmp_path), file_prefix='',
+                                               page_mode=True), maxsize=1)
+    for name, doc in docs:
+        serializer(name, doc)
+    # stop flushes the queue before returning
+    assert len(list(tmp_path.iterdir())) == 3
+    stats = serializer.stats
+    assert stats['written'] == len(docs)
+    assert stats['dropped'] == 0
+    assert stats['queue_depth'] == 0
+
+def test_async_serializer_drop():
+    written = []
+    def slow_serializer(name, doc):
+        time.sleep(0.05)
+        written.append(name)
+
+    serializer = AsyncSerializer(slow_serializer, maxsize=1, policy='drop')
+    serializer('start', {})
+    for i in range(10):
+        serializer('event_page', {})
+    serializer('stop', {})
+    stats = serializer.stats
+    assert written[0] == 'start' and written[-1] == 'stop'
+    assert stats['dropped'] > 0
+    assert stats['written'] + stats['dropped'] == 12
+
+def test_xye_hdf5_serializer(tmp_path):
+    docs, tth, signal = make_docs(num_rows=5)
+    serializer = XYEHDF5Serializer('signal', 'tth', str(tmp_path), file_prefix='run-', grow_by=2)
+    for name, doc in docs:
+        serializer(name, doc)
+    path = tmp_path / 'run-xye.h5'
+    with XYERunReader(path) as run:
+        assert len(run) == 5
+        x, y = run[[3, 1]]
+        np.testing.assert_array_equal(x[0], tth)
+        np.testing.assert_array_equal(y, np.array(signal)[[3, 1]])
+        assert list(run.table['seq_num']) == [1, 2, 3, 4, 5]
+        assert list(run.table['temp_user_setpoint']) == [25, 50, 75, 100, 125]
+
+    out = tmp_path / 'xye'
+    out.mkdir()
+    files = hdf5_to_xye(path, str(out), rows=slice(0, 2))
+    assert sorted(f.name for f in out.iterdir()) == ['seq_num-0001-temp-25.00.xye',
+                                                      'seq_num-0002-temp-50.00.xye']
+    xy = np.loadtxt(files[1], delimiter=',', skiprows=1)
+    np.testing.assert_allclose(xy[:, 1], signal[1].round(1))
+
+def test_async_serializer_error():
+    written = []
+    def failing_serializer(name, doc):
+        if name == 'descriptor':
+            raise OSError('disk full')
+        time.sleep(0.01)
+        written.append(name)
+
+    serializer = AsyncSerializer(failing_serializer, maxsize=4)
+    serializer('start', {})
+    serializer('descriptor', {})
+    serializer('event_page', {})
+    try:
+        serializer.flush()
+        assert False
+    except OSError:
+        pass
+    ''' the writer stops at the first error '''
+    try:
+        serializer('event_page', {})
+        assert False
+    except RuntimeError:
+        pass
+    assert written == ['start']
+    serializer.close()
+
+def test_async_serializer_close_timeout():
+    import threading
+    release = threading.Event()
+    serializer = AsyncSerializer(lambda name, doc: release.wait(), maxsize=1)
+    serializer('start', {})
+    try:
+        serializer.close(timeout=0.05)
+        assert False
+    except TimeoutError:
+        pass
+    release.set()
+    serializer.close()
+
+def test_hdf5_to_xye_matches_serializer(tmp_path):
+    docs, _, _ = make_docs()
+    (tmp_path / 'direct').mkdir()
+    (tmp_path / 'converted').mkdir()
+    direct = serialize(tmp_path / 'direct', docs, page_mode=True)
+    serializer = XYEHDF5Serializer('signal', 'tth', str(tmp_path), file_prefix='run-')
+    for name, doc in docs:
+        serializer(name, doc)
+    converted = sorted(hdf5_to_xye(tmp_path / 'run-xye.h5', str(tmp_path / 'converted')))
+    assert [f.name for f in direct] == [os.path.basename(f) for f in converted]
+    for a, b in zip(direct, converted):
+        assert a.read_text() == open(b).read()
+
+def test_xye_hdf5_serializer_descriptors(tmp_path):
+    docs, tth, signal = make_docs(num_rows=2)
+    start, desc, page, stop = [doc for name, doc in docs]
+    data_keys = dict(desc['data_keys'], pressure={'source':'sim', 'dtype':'number', 'shape':[]})
+    del data_keys['temp_user_setpoint']
+    desc2 = dict(desc, uid='desc2', name='baseline', data_keys=data_keys)
+    page2 = dict(page, descriptor='desc2', uid=['e1', 'e2'],
+                 data={'tth':page['data']['tth'], 'signal':page['data']['signal'], 'pressure':[1.0, 2.0]},
+                 timestamps={'tth':[0, 0], 'signal':[0, 0], 'pressure':[0, 0]},
+                 filled={})
+    serializer = XYEHDF5Serializer('signal', 'tth', str(tmp_path), file_prefix='run-', grow_by=2)
+    for name, doc in [('start', start), ('descriptor', desc), ('event_page', page),
+                      ('descriptor', desc2), ('event_page', page2), ('stop', stop)]:
+        serializer(name, doc)
+    with XYERunReader(tmp_path / 'run-xye.h5') as run:
+        table = run.table
+    np.testing.assert_array_equal(table['pressure'], [np.nan, np.nan, 1, 2])
+    np.testing.assert_array_equal(table['temp_user_setpoint'][:2], [25, 50])
@@ -0,0 +1,24 @@
+from tpsbl.ophyd.timing import TimingRing
+import numpy as np
+
+def test_timing_ring():
+    ring = TimingRing(('put', 'start', 'done'), size=3)
+    assert ring.times().shape == (0, 3)
+    ''' no row to mark yet '''
+    ring.mark('done')
+    for i in range(5):
+        ring.start()
+        ring.mark('done')
+        first = ring.times()[-1, 2]
+        ring.mark('done')
+        ''' only the first mark is kept '''
+        assert ring.times()[-1, 2] == first
+    times = ring.times()
+    assert len(ring) == 3 and ring.count == 5
+    assert np.all(np.isnan(times[:, 1]))
+    ''' the oldest row first '''
+    assert np.all(np.diff(times[:, 0]) >= 0)
+    assert np.all(times[:, 2] >= times[:, 0])
+    counts, edges = TimingRing.histogram(times[:, 2] - times[:, 0], bins=2)
+    assert counts.sum() == 3
+    assert TimingRing.histogram(times[:, 1])[0].sum() == 0
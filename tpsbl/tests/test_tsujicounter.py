@@ -0,0 +1,152 @@
+from tpsbl.ophyd.tsujicounter import TsujiCounter8Ch, TsujiCounter16Ch
+from ophyd.sim import make_fake_device
+import numpy as np
+import pytest
+import threading
+
+FakeTsujiCounter8Ch = make_fake_device(TsujiCounter8Ch)
+
+def make_counter(**kwargs):
+    tc = FakeTsujiCounter8Ch('X:', name='tc', **kwargs)
+    waveform = np.arange(9)*10
+    tc.rdal.sim_put(waveform)
+    for ch_dname, value in zip(tc.channels.component_names, waveform):
+        getattr(tc.channels, ch_dname).sim_put(value)
+    return tc
+
+def test_rdal_read_mode():
+    tc = make_counter()
+    tc.select_channels([0, 3, 't'])
+    tc.select_channels([3], kind='normal')
+    channels = tc.read()
+    tc.read_mode = 'rdal'
+    rdal = tc.read()
+    assert list(rdal) == list(channels) == ['tc_rdal', 'tc_channels_ch0', 'tc_channels_ch3', 'tc_channels_cht']
+    assert {k: v['value'] for k, v in rdal.items() if k != 'tc_rdal'} == \
+           {k: v['value'] for k, v in channels.items() if k != 'tc_rdal'}
+    assert rdal['tc_channels_cht']['value'] == 80
+    assert list(tc.describe()) == list(rdal)
+    assert tc.describe()['tc_channels_ch3']['source'].endswith('[3]')
+    ''' kinds are kept '''
+    assert tc.hints['fields'] == ['tc_channels_ch0', 'tc_channels_cht']
+
+    tc.deselect_channels()
+    assert list(tc.read()) == ['tc_rdal']
+
+def test_rdal_wider_counter():
+    ''' CHT is the last element of RDAL, whatever chN fields are defined '''
+    tc = make_fake_device(TsujiCounter16Ch)('X:', name='tc', read_mode='rdal')
+    tc.rdal.sim_put(np.arange(17)*10)
+    tc.select_channels([0, 15, 't'])
+    assert tc.rdal_indexes['ch15'] == 15 and tc.rdal_indexes['cht'] == 16
+    values = {k: v['value'] for k, v in tc.read().items() if k != 'tc_rdal'}
+    assert values == {'tc_channels_ch0': 0, 'tc_channels_ch15': 150, 'tc_channels_cht': 160}
+    assert tc.describe()['tc_channels_cht']['source'].endswith('[16]')
+
+    ''' an 8 channel class on a 16 channel counter '''
+    tc = make_counter(read_mode='rdal')
+    tc.rdal.sim_put(np.arange(17)*10)
+    tc.select_channels([7, 't'])
+    assert tc.read()['tc_channels_cht']['value'] == 160
+    assert tc.read()['tc_channels_ch7']['value'] == 70
+
+    tc.kickoff()
+    tc.rdal.sim_put(np.arange(17)*20)
+    tc.complete()
+    page, = tc.collect_pages()
+    assert page['data'] == {'tc_channels_ch7': [140.0], 'tc_channels_cht': [320.0]}
+    assert tc.describe_collect()['primary']['tc_channels_cht']['source'].endswith('[16]')
+
+def test_fly_collect_pages():
+    from bluesky import RunEngine
+    import bluesky.plan_stubs as bps
+    from ophyd.sim import SynAxis
+    from tpsbl.bluesky.preprocessors import collect_stream_wrapper
+
+    tc = make_counter()
+    tc.select_channels([1, 2])
+    tc.fly_buffer_size = 8
+    tc.fly_page_size = 3
+    motor = SynAxis(name='motor')
+    ''' the counter updates RDAL while the motor moves '''
+    motor.readback.subscribe(lambda value, **kwargs: tc.rdal.sim_put(np.arange(9)*value), run=False)
+
+    def fly(points):
+        yield from bps.open_run()
+        yield from bps.kickoff(tc, wait=True)
+        for x in points:
+            yield from bps.mv(motor, x)
+        yield from bps.complete(tc, wait=True)
+        yield from bps.collect(tc)
+        yield from bps.close_run()
+
+    docs = []
+    RE = RunEngine({})
+    RE(collect_stream_wrapper(fly([1, 2, 3, 4, 5])), lambda name, doc: docs.append((name, doc)))
+    pages = [doc for name, doc in docs if name == 'event_page']
+    assert [len(page['seq_num']) for page in pages] == [3, 2]
+    assert sum((page['data']['tc_channels_ch2'] for page in pages), []) == [2, 4, 6, 8, 10]
+    assert tc.fly_dropped == 0
+
+    ''' the ring buffer keeps the last fly_buffer_size updates '''
+    docs.clear()
+    RE(collect_stream_wrapper(fly(range(1, 11))), lambda name, doc: docs.append((name, doc)))
+    pages = [doc for name, doc in docs if name == 'event_page']
+    assert sum((page['data']['tc_channels_ch1'] for page in pages), []) == list(range(3, 11))
+    assert tc.fly_dropped == 2
+
+def test_trigger_watcher_timing():
+    tc = make_counter()
+    tc.stop_mode.sim_put('T')
+    ''' the simulated counter raises done at the put and drops it shortly after '''
+    def count(value, **kwargs):
+        if value == 1:
+            tc.done.sim_put(1)
+            threading.Timer(0.01, tc.done.sim_put, (0,)).start()
+    tc.clear_and_start.subscribe(count, run=False)
+    tc.stage()
+    gets = []
+    tc.stop_mode.get = lambda *args, **kwargs: gets.append(1) or 'T'
+    for i in range(5):
+        tc.trigger().wait(2)
+    assert gets == []
+    assert len(tc.done._callbacks['value']) == 1
+    timing = tc.trigger_timing
+    assert timing.shape == (5, 3)
+    assert np.all(timing[:, 2] >= 0.01) and np.all(timing[:, 0] < 0.01)
+    counts, edges = tc.trigger_histogram(bins=4)
+    assert counts.sum() == 5
+    tc.unstage()
+    assert len(tc.done._callbacks['value']) == 0
+
+def test_trigger_unstaged():
+    tc = make_counter()
+    tc.stop_mode.sim_put('T')
+    def count(value, **kwargs):
+        if value == 1:
+            tc.done.sim_put(1)
+            threading.Timer(0.01, tc.done.sim_put, (0,)).start()
+    tc.clear_and_start.subscribe(count, run=False)
+    ''' the watcher of an unstaged trigger removes itself when done '''
+    for i in range(3):
+        tc.trigger().wait(2)
+        assert len(tc.done._callbacks['value']) == 0
+    assert tc.trigger_timing.shape == (3, 3)
+
+    tc.stage()
+    tc.trigger().wait(2)
+    assert len(tc.done._callbacks['value']) == 1
+    assert tc.trigger_timing.shape == (1, 3)
+    tc.unstage()
+    assert len(tc.done._callbacks['value']) == 0
+
+def test_stage_failure_unwatched(monkeypatch):
+    from ophyd import Device
+    tc = make_counter()
+    tc.stop_mode.sim_put('T')
+    def stage(self):
+        raise RuntimeError('stage failed')
+    monkeypatch.setattr(Device, 'stage', stage)
+    with pytest.raises(RuntimeError):
+        tc.stage()
+    assert len(tc.done._callbacks['value']) == 0